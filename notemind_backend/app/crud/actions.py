@@ -1,92 +1,142 @@
 # Этот файл будет содержать CRUD-операции (Create, Read, Update, Delete)
-# Временное решение: хранение данных в памяти
-# В будущем это будет заменено на реальные запросы к базе данных
+# Данные агента (события, задачи, самочувствие) пока хранятся в памяти - в MemoryStore
+# с тем же интерфейсом, что и функции для базы данных ниже
 
-from typing import Dict, List, Any
+import logging
+import os
+from typing import Dict, List, Any, Optional
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import and_, or_, select
+from sqlalchemy import and_, func, literal, or_, select
 from datetime import datetime, timedelta
-from app.database import models
+from app.crud.memory_store import EventRecord, HealthMetricRecord, MemoryStore, TaskRecord
+from app.crud.search_index import STOP_WORDS, InvertedIndex, SearchHit, query_words
+from app.database import archive, models
+from app.services.prompts import user_zone
+from app.services.tracing import CRUD_LATENCY, traced_by_name
 
-# --- Имитация базы данных ---
-mock_db: Dict[str, List[Dict[str, Any]]] = {
-    "events": [],
-    "tasks": [],
-    "health_metrics": [],
-}
+logger = logging.getLogger(__name__)
+
+# Файл снимка хранилища в памяти: загружается при старте и пишется при остановке сервера
+MEMORY_STORE_SNAPSHOT = os.getenv("MEMORY_STORE_SNAPSHOT", "")
+# Как и в планировщике: у событий из сообщений нет длительности, считаем их часовыми
+DEFAULT_EVENT_DURATION = timedelta(hours=1)
+# Слова запроса короче этого не ищутся нечетко (по триграммам)
+SEARCH_FUZZY_MIN_LENGTH = 4
+
+# --- Хранилище в памяти ---
+memory_store = MemoryStore()
+
+def load_memory_snapshot() -> None:
+    if MEMORY_STORE_SNAPSHOT and memory_store.load_snapshot(MEMORY_STORE_SNAPSHOT):
+        logger.info("Хранилище в памяти загружено из снимка %s", MEMORY_STORE_SNAPSHOT)
+
+def save_memory_snapshot() -> None:
+    if MEMORY_STORE_SNAPSHOT:
+        memory_store.save_snapshot(MEMORY_STORE_SNAPSHOT)
+        logger.info("Снимок хранилища в памяти записан в %s", MEMORY_STORE_SNAPSHOT)
+
+def _local_time(user_id: int, value: str) -> datetime:
+    """ISO-время из сообщения -> локальное время пользователя без tzinfo (так хранятся события)."""
+    moment = datetime.fromisoformat(value)
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(user_zone(user_id)).replace(tzinfo=None)
+    return moment
 
 # --- Функции для сохранения данных ---
 
-async def save_event(user_id: int, title: str, start_time: str, location: str = None) -> Dict[str, Any]:
+@traced_by_name(CRUD_LATENCY, "crud")
+async def save_event(user_id: int, title: str, start_time: str, location: str = None,
+                     event_type: str = "meeting", duration: timedelta = DEFAULT_EVENT_DURATION) -> EventRecord:
     """
-    Имитирует сохранение события в базу данных.
-    Возвращает созданный объект.
+    Сохраняет событие в хранилище и возвращает созданную запись.
+    ValueError, если время не в формате ISO.
     """
-    print(f"--- CRUD-ДЕЙСТВИЕ: Сохранение события для user_id={user_id} ---")
-    event = {
+    start = _local_time(user_id, start_time)
+    event = await memory_store.create_event(None, {
         "user_id": user_id,
         "title": title,
-        "start_time": start_time,
+        "start_time": start,
+        "end_time": start + duration,
         "location": location,
-        "id": len(mock_db["events"]) + 1
-    }
-    mock_db["events"].append(event)
-    print(f"    Событие сохранено: {event}")
+        "event_type": event_type,
+    })
+    logger.debug("CRUD: событие %d сохранено на %s", event.id, start, extra={"user_id": user_id})
     return event
 
-async def save_task(user_id: int, title: str, duration_hours: float = None, deadline: str = None) -> Dict[str, Any]:
+@traced_by_name(CRUD_LATENCY, "crud")
+async def save_task(user_id: int, title: str, duration_hours: float = None, deadline: str = None) -> TaskRecord:
     """
-    Имитирует сохранение задачи в базу данных.
-    Возвращает созданный объект.
+    Сохраняет задачу в хранилище и возвращает созданную запись.
+    Срок в формате ISO становится deadline, произвольный ("к пятнице") - описанием.
     """
-    print(f"--- CRUD-ДЕЙСТВИЕ: Сохранение задачи для user_id={user_id} ---")
-    task = {
+    task_data = {
         "user_id": user_id,
         "title": title,
-        "duration_hours": duration_hours,
-        "deadline": deadline,
-        "id": len(mock_db["tasks"]) + 1
+        "estimated_duration": round(duration_hours * 60) if duration_hours else None,
     }
-    mock_db["tasks"].append(task)
-    print(f"    Задача сохранена: {task}")
+    if deadline:
+        try:
+            task_data["deadline"] = _local_time(user_id, deadline)
+        except ValueError:
+            task_data["description"] = f"Срок: {deadline}"
+    task = await memory_store.create_task(None, task_data)
+    logger.debug("CRUD: задача %d сохранена", task.id, extra={"user_id": user_id})
     return task
 
-async def save_health_metric(user_id: int, metric: str, value: str) -> Dict[str, Any]:
+@traced_by_name(CRUD_LATENCY, "crud")
+async def save_health_metric(user_id: int, metric: str, value: str) -> HealthMetricRecord:
     """
-    Имитирует сохранение метрики здоровья в базу данных.
-    Возвращает созданный объект.
+    Сохраняет запись о самочувствии. Числовое значение ("7") - в value,
+    словесное ("плохо") - в notes.
     """
-    print(f"--- CRUD-ДЕЙСТВИЕ: Сохранение метрики для user_id={user_id} ---")
-    health_metric = {
+    try:
+        numeric: Optional[float] = float(str(value).replace(",", "."))
+        notes = None
+    except ValueError:
+        numeric, notes = None, value
+    health_metric = await memory_store.create_health_metric(None, {
         "user_id": user_id,
-        "metric": metric,
-        "value": value,
-        "id": len(mock_db["health_metrics"]) + 1
-    }
-    mock_db["health_metrics"].append(health_metric)
-    print(f"    Метрика сохранена: {health_metric}")
+        "metric_type": metric,
+        "value": numeric,
+        "notes": notes,
+    })
+    logger.debug("CRUD: метрика %d сохранена", health_metric.id, extra={"user_id": user_id})
     return health_metric
 
 # --- Функции для чтения данных ---
 
-async def get_events(user_id: int) -> List[Dict[str, Any]]:
+@traced_by_name(CRUD_LATENCY, "crud")
+async def get_events(user_id: int) -> List[EventRecord]:
+    """
+    Все события пользователя по возрастанию времени начала.
+    """
+    return memory_store.user_events(user_id)
+
+@traced_by_name(CRUD_LATENCY, "crud")
+async def get_events_overlapping(user_id: int, start: datetime, end: datetime) -> List[EventRecord]:
+    """
+    События пользователя, пересекающиеся с интервалом [start, end), по возрастанию начала.
+    """
+    return memory_store.overlapping_events(user_id, start, end)
+
+@traced_by_name(CRUD_LATENCY, "crud")
+async def find_items(user_id: int, query: str, limit: int = 5) -> List[SearchHit]:
     """
-    Имитирует получение всех событий для конкретного пользователя.
+    Поиск по событиям и задачам пользователя (название, описание, место) для агента.
     """
-    print(f"--- CRUD-ДЕЙСТВИЕ: Получение событий для user_id={user_id} ---")
-    user_events = [event for event in mock_db["events"] if event["user_id"] == user_id]
-    print(f"    Найдено событий: {len(user_events)}")
-    return user_events
+    return await memory_store.search_user_items(None, user_id, query, limit)
 
 # --- АСИНХРОННЫЕ ФУНКЦИИ ДЛЯ РАБОТЫ С БАЗОЙ ДАННЫХ ---
 
 # Асинхронные CRUD операции для User
+@traced_by_name(CRUD_LATENCY, "crud")
 async def get_user_by_max_id(db: AsyncSession, max_user_id: str):
     result = await db.execute(
         select(models.User).where(models.User.max_user_id == max_user_id)
     )
     return result.scalar_one_or_none()
 
+@traced_by_name(CRUD_LATENCY, "crud")
 async def create_user(db: AsyncSession, user_data: dict):
     db_user = models.User(**user_data)
     db.add(db_user)
@@ -94,6 +144,7 @@ async def create_user(db: AsyncSession, user_data: dict):
     await db.refresh(db_user)
     return db_user
 
+@traced_by_name(CRUD_LATENCY, "crud")
 async def update_user_home_address(db: AsyncSession, user_id: int, home_address: str):
     result = await db.execute(
         select(models.User).where(models.User.id == user_id)
@@ -106,6 +157,7 @@ async def update_user_home_address(db: AsyncSession, user_id: int, home_address:
     return db_user
 
 # Асинхронные CRUD операции для Event
+@traced_by_name(CRUD_LATENCY, "crud")
 async def get_events_by_user_id(db: AsyncSession, user_id: int, skip: int = 0, limit: int = 100):
     result = await db.execute(
         select(models.Event)
@@ -115,24 +167,34 @@ async def get_events_by_user_id(db: AsyncSession, user_id: int, skip: int = 0, l
     )
     return result.scalars().all()
 
+@traced_by_name(CRUD_LATENCY, "crud")
 async def get_events_by_date_range(db: AsyncSession, user_id: int, start_date: datetime, end_date: datetime):
+    """События окна; если окно уходит дальше горячего диапазона - вместе с архивными."""
     result = await db.execute(
         select(models.Event).where(
             and_(
                 models.Event.user_id == user_id,
                 models.Event.start_time >= start_date,
+                # Следует из end_time <= end_date, но позволяет PostgreSQL не читать секции после окна
+                models.Event.start_time <= end_date,
                 models.Event.end_time <= end_date
             )
         )
     )
-    return result.scalars().all()
+    events = result.scalars().all()
+    if archive.reaches_archive(start_date):
+        archived = await archive.read_archive(models.Event, [user_id], start_date, end_date, end_column="end_time")
+        events = archive.merge_hot_and_archived(events, archived)
+    return events
 
+@traced_by_name(CRUD_LATENCY, "crud")
 async def get_event_by_id(db: AsyncSession, event_id: int):
     result = await db.execute(
         select(models.Event).where(models.Event.id == event_id)
     )
     return result.scalar_one_or_none()
 
+@traced_by_name(CRUD_LATENCY, "crud")
 async def create_event(db: AsyncSession, event_data: dict):
     db_event = models.Event(**event_data)
     db.add(db_event)
@@ -140,6 +202,7 @@ async def create_event(db: AsyncSession, event_data: dict):
     await db.refresh(db_event)
     return db_event
 
+@traced_by_name(CRUD_LATENCY, "crud")
 async def update_event(db: AsyncSession, event_id: int, event_data: dict):
     result = await db.execute(
         select(models.Event).where(models.Event.id == event_id)
@@ -152,6 +215,7 @@ async def update_event(db: AsyncSession, event_id: int, event_data: dict):
         await db.refresh(db_event)
     return db_event
 
+@traced_by_name(CRUD_LATENCY, "crud")
 async def delete_event(db: AsyncSession, event_id: int) -> bool:
     result = await db.execute(
         select(models.Event).where(models.Event.id == event_id)
@@ -164,6 +228,7 @@ async def delete_event(db: AsyncSession, event_id: int) -> bool:
     return False
 
 # Асинхронные CRUD операции для Task
+@traced_by_name(CRUD_LATENCY, "crud")
 async def get_tasks_by_user_id(db: AsyncSession, user_id: int, skip: int = 0, limit: int = 100):
     result = await db.execute(
         select(models.Task)
@@ -173,12 +238,14 @@ async def get_tasks_by_user_id(db: AsyncSession, user_id: int, skip: int = 0, li
     )
     return result.scalars().all()
 
+@traced_by_name(CRUD_LATENCY, "crud")
 async def get_task_by_id(db: AsyncSession, task_id: int):
     result = await db.execute(
         select(models.Task).where(models.Task.id == task_id)
     )
     return result.scalar_one_or_none()
 
+@traced_by_name(CRUD_LATENCY, "crud")
 async def create_task(db: AsyncSession, task_data: dict):
     db_task = models.Task(**task_data)
     db.add(db_task)
@@ -186,6 +253,7 @@ async def create_task(db: AsyncSession, task_data: dict):
     await db.refresh(db_task)
     return db_task
 
+@traced_by_name(CRUD_LATENCY, "crud")
 async def update_task(db: AsyncSession, task_id: int, task_data: dict):
     result = await db.execute(
         select(models.Task).where(models.Task.id == task_id)
@@ -198,6 +266,7 @@ async def update_task(db: AsyncSession, task_id: int, task_data: dict):
         await db.refresh(db_task)
     return db_task
 
+@traced_by_name(CRUD_LATENCY, "crud")
 async def delete_task(db: AsyncSession, task_id: int) -> bool:
     result = await db.execute(
         select(models.Task).where(models.Task.id == task_id)
@@ -209,6 +278,7 @@ async def delete_task(db: AsyncSession, task_id: int) -> bool:
         return True
     return False
 
+@traced_by_name(CRUD_LATENCY, "crud")
 async def get_pending_tasks_by_user(db: AsyncSession, user_id: int):
     result = await db.execute(
         select(models.Task).where(
@@ -220,8 +290,56 @@ async def get_pending_tasks_by_user(db: AsyncSession, user_id: int):
     )
     return result.scalars().all()
 
+# Полнотекстовый поиск по событиям и задачам
+def _search_query(model, user_id: int, tsquery, fuzzy_words: List[str], limit: int):
+    vector = models.search_vector(model)
+    match = vector.op("@@")(tsquery)
+    # ts_rank_cd учитывает веса полей; за похожее на слово запроса название - очки word_similarity
+    score = func.ts_rank_cd(vector, tsquery)
+    if fuzzy_words:
+        # %> - word_similarity выше порога pg_trgm: находит название при опечатке в запросе
+        match = or_(match, *(model.title.op("%>")(word) for word in fuzzy_words))
+        score = score + func.greatest(*(func.word_similarity(literal(word), model.title) for word in fuzzy_words))
+    return (
+        select(model, score.label("score"))
+        .where(model.user_id == user_id, match)
+        .order_by(score.desc(), model.id.desc())
+        .limit(limit)
+    )
+
+@traced_by_name(CRUD_LATENCY, "crud")
+async def search_user_items(db: AsyncSession, user_id: int, query: str, limit: int = 10, offset: int = 0) -> List[SearchHit]:
+    """
+    События и задачи пользователя, подходящие под запрос, по убыванию релевантности.
+    На PostgreSQL - tsvector ('russian') и pg_trgm по индексам из models.py, на других
+    БД - инвертированный индекс в памяти по строкам пользователя.
+    """
+    words = query_words(query)
+    if not words:
+        return []
+    if db.bind.dialect.name != "postgresql":
+        index = InvertedIndex()
+        for kind, model in (("event", models.Event), ("task", models.Task)):
+            result = await db.execute(select(model).where(model.user_id == user_id))
+            index.add_many(kind, result.scalars())
+        return index.search(query, limit, offset)
+
+    # Любое из слов запроса: вопрос "когда у меня встреча с инвестором" не должен
+    # требовать всех слов сразу. Запись с большим числом совпадений выше по рангу
+    tsquery = func.to_tsquery(models.SEARCH_CONFIG, " | ".join(words))
+    # Короткие и служебные слова ("с", "когда") по триграммам совпадают почти с чем угодно
+    fuzzy_words = [word for word in words if len(word) >= SEARCH_FUZZY_MIN_LENGTH and word not in STOP_WORDS]
+    hits = []
+    for kind, model in (("event", models.Event), ("task", models.Task)):
+        result = await db.execute(_search_query(model, user_id, tsquery, fuzzy_words, offset + limit))
+        hits.extend(SearchHit(kind, record, score) for record, score in result.all())
+    hits.sort(key=lambda hit: (-hit.score, -hit.record.id))
+    return hits[offset:offset + limit]
+
 # Асинхронные CRUD операции для HealthMetric
+@traced_by_name(CRUD_LATENCY, "crud")
 async def get_health_metrics_by_user(db: AsyncSession, user_id: int, metric_type: str = None):
+    # Вся история в БД, без архива: для окон по времени - get_recent_health_metrics
     query = select(models.HealthMetric).where(models.HealthMetric.user_id == user_id)
     if metric_type:
         query = query.where(models.HealthMetric.metric_type == metric_type)
@@ -229,6 +347,7 @@ async def get_health_metrics_by_user(db: AsyncSession, user_id: int, metric_type
     result = await db.execute(query.order_by(models.HealthMetric.recorded_at.desc()))
     return result.scalars().all()
 
+@traced_by_name(CRUD_LATENCY, "crud")
 async def create_health_metric(db: AsyncSession, metric_data: dict):
     db_metric = models.HealthMetric(**metric_data)
     db.add(db_metric)
@@ -236,6 +355,7 @@ async def create_health_metric(db: AsyncSession, metric_data: dict):
     await db.refresh(db_metric)
     return db_metric
 
+@traced_by_name(CRUD_LATENCY, "crud")
 async def get_recent_health_metrics(db: AsyncSession, user_id: int, days: int = 7):
     cutoff_date = datetime.now() - timedelta(days=days)
     result = await db.execute(
@@ -246,4 +366,78 @@ async def get_recent_health_metrics(db: AsyncSession, user_id: int, days: int =
             )
         ).order_by(models.HealthMetric.recorded_at.asc())
     )
-    return result.scalars().all()
\ No newline at end of file
+    metrics = result.scalars().all()
+    if archive.reaches_archive(cutoff_date):
+        archived = await archive.read_archive(models.HealthMetric, [user_id], cutoff_date)
+        metrics = archive.merge_hot_and_archived(metrics, archived)
+    return metrics
+
+# --- Пакетные выборки для фоновых рассылок ---
+# Вместо N запросов на N пользователей - один запрос на весь пакет,
+# результат группируется по user_id.
+
+def _group_by_user(rows, user_ids: List[int]) -> Dict[int, list]:
+    grouped: Dict[int, list] = {user_id: [] for user_id in user_ids}
+    for row in rows:
+        grouped[row.user_id].append(row)
+    return grouped
+
+@traced_by_name(CRUD_LATENCY, "crud")
+async def get_users_page(db: AsyncSession, after_id: int = 0, limit: int = 500,
+                         shard_index: int = 0, shard_count: int = 1):
+    """
+    Возвращает страницу пользователей шарда (user.id % shard_count == shard_index).
+    Пагинация по ключу (id > after_id), а не через OFFSET.
+    """
+    query = select(models.User).where(models.User.id > after_id)
+    if shard_count > 1:
+        query = query.where(models.User.id % shard_count == shard_index)
+    result = await db.execute(query.order_by(models.User.id).limit(limit))
+    return result.scalars().all()
+
+@traced_by_name(CRUD_LATENCY, "crud")
+async def get_events_by_date_range_for_users(db: AsyncSession, user_ids: List[int], start_date: datetime, end_date: datetime):
+    result = await db.execute(
+        select(models.Event).where(
+            and_(
+                models.Event.user_id.in_(user_ids),
+                models.Event.start_time >= start_date,
+                models.Event.start_time <= end_date,
+                models.Event.end_time <= end_date
+            )
+        ).order_by(models.Event.user_id, models.Event.start_time)
+    )
+    events = result.scalars().all()
+    if archive.reaches_archive(start_date):
+        archived = await archive.read_archive(models.Event, user_ids, start_date, end_date, end_column="end_time")
+        events = archive.merge_hot_and_archived(events, archived)
+    return _group_by_user(events, user_ids)
+
+@traced_by_name(CRUD_LATENCY, "crud")
+async def get_pending_tasks_for_users(db: AsyncSession, user_ids: List[int]):
+    result = await db.execute(
+        select(models.Task).where(
+            and_(
+                models.Task.user_id.in_(user_ids),
+                models.Task.status == "pending"
+            )
+        ).order_by(models.Task.user_id, models.Task.deadline)
+    )
+    return _group_by_user(result.scalars().all(), user_ids)
+
+@traced_by_name(CRUD_LATENCY, "crud")
+async def get_recent_health_metrics_for_users(db: AsyncSession, user_ids: List[int], days: int = 7):
+    cutoff_date = datetime.now() - timedelta(days=days)
+    result = await db.execute(
+        select(models.HealthMetric).where(
+            and_(
+                models.HealthMetric.user_id.in_(user_ids),
+                models.HealthMetric.recorded_at >= cutoff_date
+            )
+        ).order_by(models.HealthMetric.user_id, models.HealthMetric.recorded_at.asc())
+    )
+    metrics = result.scalars().all()
+    if archive.reaches_archive(cutoff_date):
+        archived = await archive.read_archive(models.HealthMetric, user_ids, cutoff_date)
+        metrics = archive.merge_hot_and_archived(metrics, archived)
+    return _group_by_user(metrics, user_ids)
@@ -0,0 +1,410 @@
+# In-memory хранилище для разработки, тестов и edge-развертываний без PostgreSQL.
+# Реализует тот же асинхронный интерфейс, что и SQLAlchemy CRUD-функции в actions.py
+# (первый аргумент db принимается и игнорируется), поэтому бэкенды взаимозаменяемы:
+#     await actions.get_events_by_date_range(db, user_id, start, end)
+#     await memory_store.get_events_by_date_range(None, user_id, start, end)
+# Записи - объекты со __slots__ и теми же атрибутами, что у моделей SQLAlchemy.
+import itertools
+import os
+import pickle
+import uuid
+from bisect import bisect_left, bisect_right, insort
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from app.crud.search_index import InvertedIndex, SearchHit
+
+
+# --- Записи ---
+
+class _Record:
+    """Запись со __slots__: поля и значения по умолчанию задаются в _defaults подкласса."""
+    __slots__ = ()
+    _defaults: Dict[str, Any] = {}
+
+    def __init__(self, **fields: Any):
+        unknown = fields.keys() - self._defaults.keys()
+        if unknown:
+            raise TypeError(f"{type(self).__name__}: неизвестные поля {sorted(unknown)}")
+        for name, default in self._defaults.items():
+            setattr(self, name, fields.get(name, default))
+
+    def as_tuple(self) -> tuple:
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    @classmethod
+    def from_tuple(cls, values: tuple) -> "_Record":
+        record = cls.__new__(cls)
+        for name, value in zip(cls.__slots__, values):
+            setattr(record, name, value)
+        return record
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}(id={self.id}, user_id={getattr(self, 'user_id', None)})"
+
+
+class UserRecord(_Record):
+    __slots__ = ("id", "max_user_id", "username", "home_address", "preferences", "created_at")
+    _defaults = {"id": None, "max_user_id": None, "username": None, "home_address": None,
+                 "preferences": None, "created_at": None}
+
+
+class EventRecord(_Record):
+    __slots__ = ("id", "user_id", "title", "description", "start_time", "end_time", "location",
+                 "event_type", "is_travel_event", "travel_duration", "created_at")
+    _defaults = {"id": None, "user_id": None, "title": None, "description": None, "start_time": None,
+                 "end_time": None, "location": None, "event_type": "meeting", "is_travel_event": False,
+                 "travel_duration": None, "created_at": None}
+
+
+class TaskRecord(_Record):
+    __slots__ = ("id", "user_id", "title", "description", "deadline", "estimated_duration", "actual_duration",
+                 "priority", "status", "category", "location", "created_at", "updated_at")
+    _defaults = {"id": None, "user_id": None, "title": None, "description": None, "deadline": None,
+                 "estimated_duration": None, "actual_duration": None, "priority": "medium", "status": "pending",
+                 "category": None, "location": None, "created_at": None, "updated_at": None}
+
+
+class HealthMetricRecord(_Record):
+    __slots__ = ("id", "user_id", "metric_type", "value", "notes", "recorded_at", "created_at")
+    _defaults = {"id": None, "user_id": None, "metric_type": None, "value": None, "notes": None,
+                 "recorded_at": None, "created_at": None}
+
+
+# --- Раздел пользователя ---
+
+class _UserPartition:
+    """
+    Данные одного пользователя. События и метрики отсортированы по времени, рядом
+    хранятся ключи сортировки - выборка по диапазону времени сводится к bisect.
+    События и задачи дополнительно попадают в полнотекстовый индекс пользователя.
+    version растет на каждой записи событий и задач - по нему кэшируются ответы календаря.
+    """
+    __slots__ = ("events", "event_keys", "max_event_duration", "tasks", "metrics", "metric_keys", "search",
+                 "version")
+
+    def __init__(self):
+        self.events: List[EventRecord] = []
+        self.event_keys: List[Tuple[datetime, int]] = []       # (start_time, id)
+        self.max_event_duration = timedelta(0)                  # граница поиска пересечений назад
+        self.tasks: Dict[int, TaskRecord] = {}                  # в порядке создания
+        self.metrics: List[HealthMetricRecord] = []
+        self.metric_keys: List[Tuple[datetime, int]] = []      # (recorded_at, id)
+        self.search = InvertedIndex()
+        self.version = 0
+
+    def add_event(self, event: EventRecord) -> None:
+        key = (event.start_time, event.id)
+        index = bisect_left(self.event_keys, key)
+        self.event_keys.insert(index, key)
+        self.events.insert(index, event)
+        self.search.add("event", event)
+        self.version += 1
+        if event.end_time is not None:
+            self.max_event_duration = max(self.max_event_duration, event.end_time - event.start_time)
+
+    def remove_event(self, event: EventRecord) -> None:
+        index = bisect_left(self.event_keys, (event.start_time, event.id))
+        del self.event_keys[index]
+        del self.events[index]
+        self.search.remove("event", event.id)
+        self.version += 1
+
+    def add_task(self, task: TaskRecord) -> None:
+        self.tasks[task.id] = task
+        self.search.add("task", task)
+        self.version += 1
+
+    def remove_task(self, task: TaskRecord) -> None:
+        del self.tasks[task.id]
+        self.search.remove("task", task.id)
+        self.version += 1
+
+    def add_metric(self, metric: HealthMetricRecord) -> None:
+        key = (metric.recorded_at, metric.id)
+        index = bisect_left(self.metric_keys, key)
+        self.metric_keys.insert(index, key)
+        self.metrics.insert(index, metric)
+
+    def events_from(self, start: datetime) -> Iterator[EventRecord]:
+        """События с началом не раньше start, по возрастанию начала."""
+        return itertools.islice(self.events, bisect_left(self.event_keys, (start,)), None)
+
+
+class MemoryStore:
+    """
+    Хранилище в памяти с разделами по пользователям. Идентификаторы выдаются счетчиками
+    (а не len(list) + 1), поэтому не повторяются при удалениях и параллельных вставках.
+    Времена событий внутри раздела пользователя должны быть одного вида (все naive или
+    все с часовым поясом), иначе их нельзя упорядочить.
+    """
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self) -> None:
+        self._users: Dict[int, UserRecord] = {}
+        self._user_ids: List[int] = []                  # по возрастанию - для постраничной выборки
+        self._users_by_max_id: Dict[str, UserRecord] = {}
+        self._partitions: Dict[int, _UserPartition] = {}
+        self._events: Dict[int, EventRecord] = {}
+        self._tasks: Dict[int, TaskRecord] = {}
+        self._metrics: Dict[int, HealthMetricRecord] = {}
+        self._ids = {kind: itertools.count(1) for kind in ("user", "event", "task", "metric")}
+        # Меняется при каждой очистке и загрузке снимка: версии данных после перезапуска
+        # начинаются заново, и без эпохи старый ETag мог бы совпасть с новыми данными
+        self.epoch = uuid.uuid4().hex[:12]
+
+    def _partition(self, user_id: int) -> _UserPartition:
+        partition = self._partitions.get(user_id)
+        if partition is None:
+            partition = self._partitions[user_id] = _UserPartition()
+        return partition
+
+    def _next_id(self, kind: str) -> int:
+        return next(self._ids[kind])
+
+    # --- Синхронный доступ для горячих путей (без await) ---
+
+    def user_events(self, user_id: int) -> List[EventRecord]:
+        """Все события пользователя по возрастанию начала (список только для чтения)."""
+        partition = self._partitions.get(user_id)
+        return partition.events if partition else []
+
+    def data_version(self, user_id: int) -> int:
+        """Версия событий и задач пользователя: растет на каждой их записи."""
+        partition = self._partitions.get(user_id)
+        return partition.version if partition else 0
+
+    def user_tasks(self, user_id: int) -> List[TaskRecord]:
+        partition = self._partitions.get(user_id)
+        return list(partition.tasks.values()) if partition else []
+
+    def overlapping_events(self, user_id: int, start: datetime, end: datetime) -> List[EventRecord]:
+        """События, пересекающиеся с [start, end): поиск начинается с start - самое длинное событие."""
+        partition = self._partitions.get(user_id)
+        if partition is None:
+            return []
+        result = []
+        for event in partition.events_from(start - partition.max_event_duration):
+            if event.start_time >= end:
+                break
+            if event.end_time > start:
+                result.append(event)
+        return result
+
+    # --- Пользователи ---
+
+    async def get_user_by_max_id(self, db, max_user_id: str) -> Optional[UserRecord]:
+        return self._users_by_max_id.get(max_user_id)
+
+    async def create_user(self, db, user_data: dict) -> UserRecord:
+        user = UserRecord(**user_data)
+        user.id = self._next_id("user")
+        user.created_at = user.created_at or datetime.now()
+        self._users[user.id] = user
+        self._user_ids.append(user.id)
+        self._users_by_max_id[user.max_user_id] = user
+        return user
+
+    async def update_user_home_address(self, db, user_id: int, home_address: str) -> Optional[UserRecord]:
+        user = self._users.get(user_id)
+        if user:
+            user.home_address = home_address
+        return user
+
+    async def get_users_page(self, db, after_id: int = 0, limit: int = 500,
+                             shard_index: int = 0, shard_count: int = 1) -> List[UserRecord]:
+        page = []
+        for user_id in itertools.islice(self._user_ids, bisect_right(self._user_ids, after_id), None):
+            if shard_count > 1 and user_id % shard_count != shard_index:
+                continue
+            page.append(self._users[user_id])
+            if len(page) >= limit:
+                break
+        return page
+
+    # --- События ---
+
+    async def get_events_by_user_id(self, db, user_id: int, skip: int = 0, limit: int = 100) -> List[EventRecord]:
+        return self.user_events(user_id)[skip:skip + limit]
+
+    async def get_events_by_date_range(self, db, user_id: int, start_date: datetime,
+                                       end_date: datetime) -> List[EventRecord]:
+        partition = self._partitions.get(user_id)
+        if partition is None:
+            return []
+        result = []
+        for event in partition.events_from(start_date):
+            if event.start_time > end_date:
+                break
+            if event.end_time <= end_date:
+                result.append(event)
+        return result
+
+    async def get_event_by_id(self, db, event_id: int) -> Optional[EventRecord]:
+        return self._events.get(event_id)
+
+    async def create_event(self, db, event_data: dict) -> EventRecord:
+        event = EventRecord(**event_data)
+        event.id = self._next_id("event")
+        event.created_at = event.created_at or datetime.now()
+        self._events[event.id] = event
+        self._partition(event.user_id).add_event(event)
+        return event
+
+    async def update_event(self, db, event_id: int, event_data: dict) -> Optional[EventRecord]:
+        event = self._events.get(event_id)
+        if event:
+            partition = self._partition(event.user_id)
+            # Ключ сортировки может измениться - переставляем запись
+            partition.remove_event(event)
+            for key, value in event_data.items():
+                setattr(event, key, value)
+            partition.add_event(event)
+        return event
+
+    async def delete_event(self, db, event_id: int) -> bool:
+        event = self._events.pop(event_id, None)
+        if event is None:
+            return False
+        self._partition(event.user_id).remove_event(event)
+        return True
+
+    # --- Задачи ---
+
+    async def get_tasks_by_user_id(self, db, user_id: int, skip: int = 0, limit: int = 100) -> List[TaskRecord]:
+        return self.user_tasks(user_id)[skip:skip + limit]
+
+    async def get_task_by_id(self, db, task_id: int) -> Optional[TaskRecord]:
+        return self._tasks.get(task_id)
+
+    async def create_task(self, db, task_data: dict) -> TaskRecord:
+        task = TaskRecord(**task_data)
+        task.id = self._next_id("task")
+        task.created_at = task.created_at or datetime.now()
+        self._tasks[task.id] = task
+        self._partition(task.user_id).add_task(task)
+        return task
+
+    async def update_task(self, db, task_id: int, task_data: dict) -> Optional[TaskRecord]:
+        task = self._tasks.get(task_id)
+        if task:
+            for key, value in task_data.items():
+                setattr(task, key, value)
+            task.updated_at = datetime.now()
+            # Название или описание могли измениться - переиндексируем
+            partition = self._partition(task.user_id)
+            partition.search.add("task", task)
+            partition.version += 1
+        return task
+
+    async def delete_task(self, db, task_id: int) -> bool:
+        task = self._tasks.pop(task_id, None)
+        if task is None:
+            return False
+        self._partition(task.user_id).remove_task(task)
+        return True
+
+    async def get_pending_tasks_by_user(self, db, user_id: int) -> List[TaskRecord]:
+        return [task for task in self.user_tasks(user_id) if task.status == "pending"]
+
+    # --- Поиск ---
+
+    async def search_user_items(self, db, user_id: int, query: str, limit: int = 10,
+                                offset: int = 0) -> List[SearchHit]:
+        partition = self._partitions.get(user_id)
+        if partition is None:
+            return []
+        return partition.search.search(query, limit, offset)
+
+    # --- Метрики самочувствия ---
+
+    async def get_health_metrics_by_user(self, db, user_id: int, metric_type: str = None) -> List[HealthMetricRecord]:
+        partition = self._partitions.get(user_id)
+        if partition is None:
+            return []
+        return [metric for metric in reversed(partition.metrics)
+                if not metric_type or metric.metric_type == metric_type]
+
+    async def create_health_metric(self, db, metric_data: dict) -> HealthMetricRecord:
+        metric = HealthMetricRecord(**metric_data)
+        metric.id = self._next_id("metric")
+        metric.created_at = metric.created_at or datetime.now()
+        metric.recorded_at = metric.recorded_at or metric.created_at
+        self._metrics[metric.id] = metric
+        self._partition(metric.user_id).add_metric(metric)
+        return metric
+
+    async def get_recent_health_metrics(self, db, user_id: int, days: int = 7) -> List[HealthMetricRecord]:
+        partition = self._partitions.get(user_id)
+        if partition is None:
+            return []
+        cutoff_date = datetime.now() - timedelta(days=days)
+        return partition.metrics[bisect_left(partition.metric_keys, (cutoff_date,)):]
+
+    # --- Пакетные выборки (как в actions.py - словарь user_id -> записи) ---
+
+    async def get_events_by_date_range_for_users(self, db, user_ids: List[int], start_date: datetime,
+                                                 end_date: datetime) -> Dict[int, List[EventRecord]]:
+        return {user_id: await self.get_events_by_date_range(db, user_id, start_date, end_date) for user_id in user_ids}
+
+    async def get_pending_tasks_for_users(self, db, user_ids: List[int]) -> Dict[int, List[TaskRecord]]:
+        grouped = {}
+        for user_id in user_ids:
+            tasks = await self.get_pending_tasks_by_user(db, user_id)
+            # Как ORDER BY deadline в PostgreSQL: задачи без срока - в конце
+            grouped[user_id] = sorted(tasks, key=lambda task: (task.deadline is None, task.deadline or datetime.min))
+        return grouped
+
+    async def get_recent_health_metrics_for_users(self, db, user_ids: List[int],
+                                                  days: int = 7) -> Dict[int, List[HealthMetricRecord]]:
+        return {user_id: await self.get_recent_health_metrics(db, user_id, days) for user_id in user_ids}
+
+    # --- Снимок на диск ---
+
+    def save_snapshot(self, path: str) -> None:
+        """
+        Сохраняет все записи в файл (pickle кортежей полей). Запись атомарная: через
+        временный файл и os.replace. Вызывать из потока event loop или после его остановки.
+        """
+        state = {
+            "users": [user.as_tuple() for user in self._users.values()],
+            "events": [event.as_tuple() for event in self._events.values()],
+            "tasks": [task.as_tuple() for task in self._tasks.values()],
+            "metrics": [metric.as_tuple() for metric in self._metrics.values()],
+        }
+        temporary = f"{path}.tmp"
+        with open(temporary, "wb") as snapshot:
+            pickle.dump(state, snapshot, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary, path)
+
+    def load_snapshot(self, path: str) -> bool:
+        """Заменяет содержимое хранилища снимком из файла. False, если файла нет."""
+        if not os.path.exists(path):
+            return False
+        with open(path, "rb") as snapshot:
+            state = pickle.load(snapshot)
+        self.clear()
+        for values in state["users"]:
+            user = UserRecord.from_tuple(values)
+            self._users[user.id] = user
+            self._users_by_max_id[user.max_user_id] = user
+        self._user_ids = sorted(self._users)
+        for values in state["events"]:
+            event = EventRecord.from_tuple(values)
+            self._events[event.id] = event
+            self._partition(event.user_id).add_event(event)
+        for values in state["tasks"]:
+            task = TaskRecord.from_tuple(values)
+            self._tasks[task.id] = task
+            self._partition(task.user_id).add_task(task)
+        for values in state["metrics"]:
+            metric = HealthMetricRecord.from_tuple(values)
+            self._metrics[metric.id] = metric
+            self._partition(metric.user_id).add_metric(metric)
+        # Счетчики продолжают с максимального id, чтобы новые записи не совпали со старыми
+        for kind, records in (("user", self._users), ("event", self._events), ("task", self._tasks),
+                              ("metric", self._metrics)):
+            self._ids[kind] = itertools.count(max(records, default=0) + 1)
+        return True
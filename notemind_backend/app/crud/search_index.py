@@ -0,0 +1,168 @@
+# Полнотекстовый поиск без PostgreSQL: инвертированный индекс на чистом Python.
+# Используется хранилищем в памяти (индекс на пользователя обновляется при каждой записи)
+# и SQL-бэкендом на SQLite (индекс строится по строкам пользователя на время запроса).
+# На PostgreSQL поиск выполняет сама БД - см. search_user_items в actions.py.
+#
+# Нормализация близка к конфигурации 'russian' в PostgreSQL: нижний регистр, ё -> е,
+# стоп-слова и грубое отсечение окончаний ("инвестором" и "инвестор" - один терм).
+# Опечатки и другие формы, которые отсечение не свело, находятся по сходству триграмм
+# с термами словаря пользователя, как у pg_trgm.
+import math
+import re
+from collections import Counter, defaultdict
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+# Поля и их веса: совпадение в названии важнее, чем в описании
+SEARCH_FIELDS: Tuple[Tuple[str, float], ...] = (("title", 3.0), ("location", 1.5), ("description", 1.0))
+# Порог сходства триграмм для нечеткого совпадения (как pg_trgm.similarity_threshold)
+FUZZY_THRESHOLD = 0.45
+# Сколько похожих термов словаря подставлять вместо одного терма запроса
+FUZZY_CANDIDATES = 3
+# Параметры BM25
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+_WORD = re.compile(r"\w+")
+STOP_WORDS = frozenset(
+    "и в во не что он на я с со как а то все она так его но да ты к у же вы за бы по только ее мне было "
+    "вот от меня еще нет о из ему теперь когда даже ну вдруг ли если уже или ни быть был него до вас "
+    "нибудь опять уж вам ведь там потом себя ничего ей может они тут где есть надо ней для мы тебя их "
+    "чем была сам чтоб без будто чего раз тоже себе под будет ж тогда кто этот того потому этого какой "
+    "совсем ним здесь этом один почти мой тем чтобы нее были куда зачем всех никогда можно при наконец "
+    "два об другой хоть после над больше тот через эти нас про всего них какая много разве три эту моя "
+    "впрочем хорошо свою этой перед иногда лучше чуть том нельзя такой им более всегда конечно всю между "
+    "у меня мой моя мои там тут".split()
+)
+# Окончания в порядке убывания длины: отсекается самое длинное подходящее
+_ENDINGS = tuple(sorted(
+    "иями ями ами ией иям ием иях ого его ому ему ыми ими ешь ишь ете ите ют ут ат ят "
+    "ой ей ий ый ая яя ое ее ую юю ом ем ам ям ах ях ов ев ью ия ие ии ию ых их ым им "
+    "а я о е ы и у ю ь й".split(),
+    key=len, reverse=True,
+))
+_MIN_STEM = 3
+
+
+def stem(word: str) -> str:
+    for ending in _ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= _MIN_STEM:
+            return word[:-len(ending)]
+    return word
+
+
+def tokenize(text: Optional[str]) -> List[str]:
+    """Текст -> термы: слова в нижнем регистре без стоп-слов и окончаний."""
+    if not text:
+        return []
+    return [stem(word) for word in _WORD.findall(text.lower().replace("ё", "е")) if word not in STOP_WORDS]
+
+
+def query_words(query: Optional[str]) -> List[str]:
+    """Слова запроса без нормализации - безопасны для to_tsquery (только буквы и цифры)."""
+    return _WORD.findall(query.lower().replace("ё", "е")) if query else []
+
+
+def trigrams(term: str) -> Set[str]:
+    padded = f"  {term} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class SearchHit:
+    """Результат поиска: вид записи ("event" или "task"), сама запись и релевантность."""
+    __slots__ = ("kind", "record", "score")
+
+    def __init__(self, kind: str, record, score: float):
+        self.kind = kind
+        self.record = record
+        self.score = score
+
+    def __repr__(self) -> str:
+        return f"SearchHit({self.kind}, id={self.record.id}, score={self.score:.3f})"
+
+
+class InvertedIndex:
+    """
+    Инвертированный индекс по событиям и задачам одного пользователя с ранжированием BM25.
+    Частота терма учитывает вес поля (SEARCH_FIELDS). Записи - любые объекты с полями
+    title/description/location и id (модели SQLAlchemy или записи MemoryStore).
+    """
+
+    def __init__(self):
+        self._postings: Dict[str, Dict[Tuple[str, int], float]] = defaultdict(dict)
+        self._documents: Dict[Tuple[str, int], Tuple[object, Tuple[str, ...], float]] = {}   # запись, термы, длина
+        self._trigrams: Dict[str, Set[str]] = defaultdict(set)     # триграмма -> термы словаря
+        self._total_length = 0.0
+
+    def __len__(self) -> int:
+        return len(self._documents)
+
+    def add(self, kind: str, record) -> None:
+        key = (kind, record.id)
+        if key in self._documents:
+            self.remove(kind, record.id)
+        frequencies: Counter = Counter()
+        for field, weight in SEARCH_FIELDS:
+            for term in tokenize(getattr(record, field, None)):
+                frequencies[term] += weight
+        for term, frequency in frequencies.items():
+            postings = self._postings[term]
+            if not postings:
+                for trigram in trigrams(term):
+                    self._trigrams[trigram].add(term)
+            postings[key] = frequency
+        length = sum(frequencies.values())
+        self._documents[key] = (record, tuple(frequencies), length)
+        self._total_length += length
+
+    def add_many(self, kind: str, records: Iterable) -> None:
+        for record in records:
+            self.add(kind, record)
+
+    def remove(self, kind: str, record_id: int) -> None:
+        entry = self._documents.pop((kind, record_id), None)
+        if entry is None:
+            return
+        _, terms, length = entry
+        for term in terms:
+            postings = self._postings[term]
+            postings.pop((kind, record_id), None)
+            if not postings:
+                del self._postings[term]
+                for trigram in trigrams(term):
+                    self._trigrams[trigram].discard(term)
+        self._total_length -= length
+
+    def _expand(self, term: str) -> List[Tuple[str, float]]:
+        """Терм запроса -> термы словаря с коэффициентом: точное совпадение или похожие по триграммам."""
+        if term in self._postings:
+            return [(term, 1.0)]
+        query_trigrams = trigrams(term)
+        shared: Counter = Counter()
+        for trigram in query_trigrams:
+            shared.update(self._trigrams.get(trigram, ()))
+        candidates = []
+        for candidate, common in shared.items():
+            similarity = common / (len(query_trigrams) + len(trigrams(candidate)) - common)
+            if similarity >= FUZZY_THRESHOLD:
+                candidates.append((candidate, similarity))
+        candidates.sort(key=lambda item: item[1], reverse=True)
+        return candidates[:FUZZY_CANDIDATES]
+
+    def search(self, query: str, limit: int = 10, offset: int = 0) -> List[SearchHit]:
+        """Записи, содержащие хотя бы один терм запроса (или похожий), по убыванию релевантности."""
+        if not self._documents:
+            return []
+        count = len(self._documents)
+        average_length = self._total_length / count or 1.0
+        scores: Dict[Tuple[str, int], float] = defaultdict(float)
+        for term in set(tokenize(query)):
+            for candidate, similarity in self._expand(term):
+                postings = self._postings[candidate]
+                idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+                for key, frequency in postings.items():
+                    norm = BM25_K1 * (1 - BM25_B + BM25_B * self._documents[key][2] / average_length)
+                    scores[key] += similarity * idf * frequency * (BM25_K1 + 1) / (frequency + norm)
+        # Равные по релевантности - сначала более новые записи
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], -item[0][1]))[offset:offset + limit]
+        return [SearchHit(kind, self._documents[(kind, record_id)][0], score)
+                for (kind, record_id), score in ranked]
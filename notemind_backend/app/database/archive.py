@@ -0,0 +1,167 @@
+import asyncio
+import gzip
+import json
+import logging
+import os
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Collection, Dict, Iterable, List, Optional
+
+from sqlalchemy import DateTime
+
+from app.database import models
+from app.services.metrics import Counter
+
+logger = logging.getLogger(__name__)
+
+# --- Архив холодных месяцев ---
+# События и замеры самочувствия старше ARCHIVE_AFTER_MONTHS полных месяцев переносятся
+# из БД в файлы (app/database/partitions.py) и читаются отсюда, когда запрошенное окно
+# уходит дальше горячего диапазона. Формат - NDJSON в gzip, по строке JSON на запись:
+#   ARCHIVE_DIR/<таблица>/<ГГГГ-ММ>/b<корзина>-s<шард>-<запуск>.ndjson.gz
+# Корзина - user_id % ARCHIVE_BUCKETS: чтение данных пользователя распаковывает
+# только его корзину за нужные месяцы, а не весь месяц.
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "./archive")
+# Сколько полных месяцев (кроме текущего) хранится в БД. 0 - не архивировать
+ARCHIVE_AFTER_MONTHS = int(os.getenv("ARCHIVE_AFTER_MONTHS", "12"))
+# Число корзин зашито в имена файлов: менять его можно только вместе с пустым архивом
+ARCHIVE_BUCKETS = 16
+
+# Таблицы с архивом -> столбец, по которому они делятся на месяцы
+ARCHIVED_MODELS = {
+    models.Event: "start_time",
+    models.HealthMetric: "recorded_at",
+}
+
+# Запросы, которым пришлось читать архив (окно старше горячего диапазона)
+ARCHIVE_READS = Counter("archive_reads_total", "Чтения данных из архива холодных месяцев", ["table"])
+
+
+def naive_utc(value: datetime) -> datetime:
+    """Время без tzinfo в UTC: так сравниваются значения из БД, архива и параметров запросов."""
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def month_start(value: datetime) -> datetime:
+    return naive_utc(value).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def add_months(month: datetime, months: int) -> datetime:
+    index = month.year * 12 + month.month - 1 + months
+    return month.replace(year=index // 12, month=index % 12 + 1)
+
+
+def hot_since(now: Optional[datetime] = None) -> Optional[datetime]:
+    """Начало горячего диапазона: более ранние месяцы уходят в архив. None - архив выключен."""
+    if ARCHIVE_AFTER_MONTHS <= 0:
+        return None
+    return add_months(month_start(now or datetime.now(timezone.utc)), -ARCHIVE_AFTER_MONTHS)
+
+
+def reaches_archive(start: datetime) -> bool:
+    """Уходит ли окно, начинающееся в start, в архивные месяцы."""
+    since = hot_since()
+    return since is not None and naive_utc(start) < since
+
+
+def _table_dir(table: str) -> str:
+    return os.path.join(ARCHIVE_DIR, table)
+
+
+def _datetime_columns(model) -> List[str]:
+    return [column.key for column in model.__table__.columns if isinstance(column.type, DateTime)]
+
+
+def write_month(model, month: datetime, rows: Iterable[Dict[str, Any]], shard: int = 0) -> int:
+    """
+    Записывает строки месяца в архив (по файлу на корзину) и возвращает их число.
+    Файл появляется под своим именем только целиком записанным. Повторная запись тех же
+    строк (сбой между записью и удалением из БД) безопасна: при чтении дубли по id схлопываются.
+    """
+    table = model.__tablename__
+    directory = os.path.join(_table_dir(table), f"{month:%Y-%m}")
+    os.makedirs(directory, exist_ok=True)
+    buckets: Dict[int, List[Dict[str, Any]]] = {}
+    for row in rows:
+        buckets.setdefault(row["user_id"] % ARCHIVE_BUCKETS, []).append(row)
+
+    run = f"{int(time.time())}-{uuid.uuid4().hex[:8]}"
+    for bucket, bucket_rows in buckets.items():
+        path = os.path.join(directory, f"b{bucket:02d}-s{shard}-{run}.ndjson.gz")
+        with gzip.open(path + ".part", "wt", encoding="utf-8") as archive_file:
+            for row in bucket_rows:
+                archive_file.write(json.dumps(row, ensure_ascii=False, default=datetime.isoformat))
+                archive_file.write("\n")
+        os.replace(path + ".part", path)
+    return sum(len(bucket_rows) for bucket_rows in buckets.values())
+
+
+def archived_months(model) -> List[datetime]:
+    """Месяцы, за которые в архиве есть данные таблицы, по возрастанию."""
+    try:
+        names = os.listdir(_table_dir(model.__tablename__))
+    except FileNotFoundError:
+        return []
+    months = []
+    for name in names:
+        try:
+            months.append(datetime.strptime(name, "%Y-%m"))
+        except ValueError:
+            continue
+    return sorted(months)
+
+
+def read_rows(model, user_ids: Collection[int], start: datetime, end: Optional[datetime] = None,
+              end_column: Optional[str] = None) -> List[Dict[str, Any]]:
+    """
+    Строки пользователей из архива, у которых столбец месяца >= start, а end_column
+    (по умолчанию тот же столбец) <= end. Время - в UTC без tzinfo. Блокирующая функция.
+    """
+    key = ARCHIVED_MODELS[model]
+    end_column = end_column or key
+    start = naive_utc(start)
+    end = naive_utc(end) if end is not None else None
+    users = set(user_ids)
+    buckets = {f"b{user_id % ARCHIVE_BUCKETS:02d}-" for user_id in users}
+    datetime_columns = _datetime_columns(model)
+
+    found: Dict[int, Dict[str, Any]] = {}
+    for month in archived_months(model):
+        if add_months(month, 1) <= start or (end is not None and month > end):
+            continue
+        directory = os.path.join(_table_dir(model.__tablename__), f"{month:%Y-%m}")
+        for name in sorted(os.listdir(directory)):
+            if not name.endswith(".ndjson.gz") or name[:4] not in buckets:
+                continue
+            with gzip.open(os.path.join(directory, name), "rt", encoding="utf-8") as archive_file:
+                for line in archive_file:
+                    row = json.loads(line)
+                    if row["user_id"] not in users:
+                        continue
+                    for column in datetime_columns:
+                        if row[column] is not None:
+                            row[column] = naive_utc(datetime.fromisoformat(row[column]))
+                    if row[key] < start or (end is not None and row[end_column] > end):
+                        continue
+                    found[row["id"]] = row
+    return sorted(found.values(), key=lambda row: (row["user_id"], row[key]))
+
+
+async def read_archive(model, user_ids: Collection[int], start: datetime, end: Optional[datetime] = None,
+                       end_column: Optional[str] = None) -> list:
+    """
+    Как read_rows, но возвращает несохраненные объекты модели и читает файлы в потоке.
+    Вызывать, только если окно уходит в архив (reaches_archive).
+    """
+    ARCHIVE_READS.labels(model.__tablename__).inc()
+    rows = await asyncio.to_thread(read_rows, model, user_ids, start, end, end_column)
+    return [model(**row) for row in rows]
+
+
+def merge_hot_and_archived(hot: list, archived: list) -> list:
+    """Архивные записи (они старше) перед горячими; запись, успевшая попасть в оба места, - из БД."""
+    hot_ids = {record.id for record in hot}
+    return [record for record in archived if record.id not in hot_ids] + list(hot)
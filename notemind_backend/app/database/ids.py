@@ -0,0 +1,92 @@
+import os
+import threading
+import time
+
+# --- Глобально уникальные id без общей последовательности БД ---
+# Схема (63 бита, помещается в BIGINT):
+#   41 бит - миллисекунды от ID_EPOCH_MS (хватит на ~69 лет),
+#    6 бит - шард, в котором создана строка (до 64 шардов),
+#    6 бит - узел (процесс), выдавший id,
+#   10 бит - счетчик внутри миллисекунды (1024 id/мс на узел).
+# Id растут со временем, поэтому индекс по первичному ключу заполняется с конца, как и с SERIAL.
+ID_EPOCH_MS = 1704067200000  # 2024-01-01 00:00 UTC
+
+SHARD_BITS = 6
+NODE_BITS = 6
+SEQUENCE_BITS = 10
+MAX_SHARDS = 1 << SHARD_BITS
+MAX_NODES = 1 << NODE_BITS
+
+_SEQUENCE_MASK = (1 << SEQUENCE_BITS) - 1
+_NODE_SHIFT = SEQUENCE_BITS
+_SHARD_SHIFT = SEQUENCE_BITS + NODE_BITS
+_TIMESTAMP_SHIFT = SEQUENCE_BITS + NODE_BITS + SHARD_BITS
+
+# Id меньше этого порога выданы обычной последовательностью БД до перехода на эту схему
+# (метка времени таких id - первые минуты после ID_EPOCH_MS, реальные id так не выдаются)
+LEGACY_ID_LIMIT = 1 << 40
+
+# Номер узла должен быть уникален среди всех процессов, выдающих id (например, номер
+# реплики сервиса): процессы с одним номером выдадут одинаковые id в одну миллисекунду.
+# Угадать его нельзя (pid в контейнерах одинаковый), поэтому без ID_NODE допускается только
+# один процесс с одной БД - тогда номер 0. Обязательность при шардах проверяет app/database/shards.py
+ID_NODE_ENV = os.getenv("ID_NODE", "").strip()
+ID_NODE = int(ID_NODE_ENV) if ID_NODE_ENV else 0
+
+# Воркеры uvicorn (--workers / WEB_CONCURRENCY) наследуют один ID_NODE - масштабировать нужно
+# репликами, у каждой свой ID_NODE
+if int(os.getenv("WEB_CONCURRENCY", "1")) > 1:
+    raise ValueError("Несколько воркеров uvicorn в одном процессе делят ID_NODE: запускайте реплики с разными ID_NODE")
+
+
+def require_node_id(reason: str) -> None:
+    """Ошибка запуска, если ID_NODE не задан явно, а id выдают несколько процессов (reason - почему)."""
+    if not ID_NODE_ENV:
+        raise ValueError(f"Задайте ID_NODE (0..{MAX_NODES - 1}, свой у каждого процесса): {reason}")
+
+
+class IdGenerator:
+    """Генератор id по схеме выше. Потокобезопасен; при переполнении счетчика ждет следующую миллисекунду."""
+
+    def __init__(self, node: int = ID_NODE):
+        if not 0 <= node < MAX_NODES:
+            raise ValueError(f"ID_NODE должен быть в диапазоне 0..{MAX_NODES - 1}")
+        self.node = node
+        self._last_ms = 0
+        self._sequence = 0
+        self._lock = threading.Lock()
+
+    def next_id(self, shard: int = 0) -> int:
+        if not 0 <= shard < MAX_SHARDS:
+            raise ValueError(f"Номер шарда должен быть в диапазоне 0..{MAX_SHARDS - 1}")
+        with self._lock:
+            # Часы могли уйти назад - продолжаем с последней выданной миллисекунды
+            now_ms = max(int(time.time() * 1000) - ID_EPOCH_MS, self._last_ms)
+            if now_ms == self._last_ms:
+                self._sequence = (self._sequence + 1) & _SEQUENCE_MASK
+                if self._sequence == 0:
+                    while now_ms <= self._last_ms:
+                        now_ms = int(time.time() * 1000) - ID_EPOCH_MS
+            else:
+                self._sequence = 0
+            self._last_ms = now_ms
+            return (now_ms << _TIMESTAMP_SHIFT) | (shard << _SHARD_SHIFT) | (self.node << _NODE_SHIFT) | self._sequence
+
+
+def shard_of(row_id: int) -> int:
+    """Шард, в котором была создана строка с этим id (для старых id - 0)."""
+    if row_id < LEGACY_ID_LIMIT:
+        return 0
+    return (row_id >> _SHARD_SHIFT) & (MAX_SHARDS - 1)
+
+
+id_generator = IdGenerator()
+
+
+def new_row_id(context) -> int:
+    """
+    Значение по умолчанию для первичных ключей (Column(default=...)). Шард берется из
+    execution_options движка, через который идет вставка (см. app/database/shards.py).
+    Аргумент без значения по умолчанию: только так SQLAlchemy передает контекст выполнения.
+    """
+    return id_generator.next_id(context.execution_options.get("shard", 0))
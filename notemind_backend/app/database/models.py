@@ -1,15 +1,19 @@
-from sqlalchemy import Column, Integer, String, DateTime, Boolean, Float, Text, ForeignKey
+from sqlalchemy import BigInteger, Column, Integer, String, DateTime, Boolean, Float, Text, ForeignKey, DDL, Index, event, literal_column
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from app.database.core import Base
+from app.database.ids import new_row_id
 from datetime import datetime
 from typing import Optional
 from pydantic import BaseModel
 
+# Первичные ключи - BIGINT из app/database/ids.py, а не SERIAL: id уникальны между шардами
+# и не зависят от последовательности одной БД. id пользователя хранит его исходный шард
+
 class User(Base):
     __tablename__ = "users"
 
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(BigInteger, primary_key=True, index=True, autoincrement=False, default=new_row_id)
     max_user_id = Column(String, unique=True, index=True, nullable=False)
     username = Column(String, nullable=True)
     home_address = Column(String, nullable=True)
@@ -24,12 +28,15 @@ class User(Base):
 
 class Event(Base):
     __tablename__ = "events"
+    # В PostgreSQL - секции по месяцам начала события (app/database/partitions.py)
+    __table_args__ = {"postgresql_partition_by": "RANGE (start_time)"}
 
-    id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    id = Column(BigInteger, primary_key=True, index=True, autoincrement=False, default=new_row_id)
+    user_id = Column(BigInteger, ForeignKey("users.id"), nullable=False)
     title = Column(String, nullable=False)
     description = Column(Text, nullable=True)
-    start_time = Column(DateTime(timezone=True), nullable=False)
+    # Ключ секционирования обязан входить в первичный ключ секционированной таблицы
+    start_time = Column(DateTime(timezone=True), primary_key=True, nullable=False)
     end_time = Column(DateTime(timezone=True), nullable=False)
     location = Column(String, nullable=True)
     event_type = Column(String, nullable=False)  # meeting, travel, work, etc.
@@ -40,11 +47,14 @@ class Event(Base):
     # Связи
     user = relationship("User", back_populates="events")
 
+    # Для ORM запись по-прежнему определяется одним id (он уникален и без start_time)
+    __mapper_args__ = {"primary_key": [id]}
+
 class Task(Base):
     __tablename__ = "tasks"
 
-    id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    id = Column(BigInteger, primary_key=True, index=True, autoincrement=False, default=new_row_id)
+    user_id = Column(BigInteger, ForeignKey("users.id"), nullable=False)
     title = Column(String, nullable=False)
     description = Column(Text, nullable=True)
     deadline = Column(DateTime(timezone=True), nullable=True)
@@ -62,18 +72,70 @@ class Task(Base):
 
 class HealthMetric(Base):
     __tablename__ = "health_metrics"
-
-    id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    # В PostgreSQL - секции по месяцам замера (app/database/partitions.py)
+    __table_args__ = (
+        Index("ix_health_metrics_user_id_recorded_at", "user_id", "recorded_at"),
+        {"postgresql_partition_by": "RANGE (recorded_at)"},
+    )
+
+    id = Column(BigInteger, primary_key=True, index=True, autoincrement=False, default=new_row_id)
+    user_id = Column(BigInteger, ForeignKey("users.id"), nullable=False)
     metric_type = Column(String, nullable=False)  # sleep, energy, stress, mood
     value = Column(Float, nullable=False)
     notes = Column(Text, nullable=True)
-    recorded_at = Column(DateTime(timezone=True), nullable=False)
+    recorded_at = Column(DateTime(timezone=True), primary_key=True, nullable=False)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
     # Связи
     user = relationship("User", back_populates="health_metrics")
 
+    __mapper_args__ = {"primary_key": [id]}
+
+class UserShard(Base):
+    """
+    Каталог шардов: пользователи, живущие не там, куда их направляет правило по умолчанию
+    (перенесенные между шардами или созданные при другом числе шардов). Хранится в шарде 0.
+    """
+    __tablename__ = "user_shards"
+
+    user_id = Column(BigInteger, primary_key=True, autoincrement=False)
+    max_user_id = Column(String, unique=True, nullable=False)
+    shard = Column(Integer, nullable=False)
+    moved_at = Column(DateTime(timezone=True), server_default=func.now())
+
+# --- Полнотекстовый поиск (только PostgreSQL) ---
+# Конфигурация 'russian': стемминг и стоп-слова русского языка. Вектор задан выражением,
+# а не отдельным столбцом, поэтому запрос использует GIN-индекс, только если выражение
+# в нем совпадает с индексным буква в букву - оба строятся функцией search_vector.
+# Триграммные индексы (pg_trgm) по названию находят записи при опечатках в запросе.
+# На SQLite эти индексы не создаются - там работает app/crud/search_index.py.
+SEARCH_CONFIG = "russian"
+
+def search_vector(model):
+    """Взвешенный tsvector записи: название - A, место - B, описание - C."""
+    # Константы - литералами, а не параметрами: иначе выражение запроса не совпадет с индексным
+    config = literal_column(f"'{SEARCH_CONFIG}'::regconfig")
+    def weighted(column, weight):
+        return func.setweight(func.to_tsvector(config, func.coalesce(column, literal_column("''"))),
+                              literal_column(f"'{weight}'"))
+    return weighted(model.title, "A").op("||")(weighted(model.location, "B")).op("||")(weighted(model.description, "C"))
+
+event.listen(
+    Base.metadata, "before_create",
+    DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm").execute_if(dialect="postgresql"),
+)
+
+for _model in (Event, Task):
+    _table = _model.__tablename__
+    # Индекс по выражению сам к таблице не привязывается - добавляем явно
+    _model.__table__.append_constraint(
+        Index(f"ix_{_table}_search", search_vector(_model), postgresql_using="gin").ddl_if(dialect="postgresql")
+    )
+    Index(f"ix_{_table}_title_trgm", _model.title, postgresql_using="gin",
+          postgresql_ops={"title": "gin_trgm_ops"}).ddl_if(dialect="postgresql")
+    # Поиск всегда в пределах пользователя
+    Index(f"ix_{_table}_user_id", _model.user_id)
+
 # Pydantic модели для валидации и сериализации
 class UserCreate(BaseModel):
     max_user_id: str
@@ -0,0 +1,154 @@
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Set
+
+from sqlalchemy import delete, func, select, text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncSession
+
+from app.database import archive, shards
+from app.services.metrics import Counter
+
+logger = logging.getLogger(__name__)
+
+# --- Секции по месяцам (только PostgreSQL) ---
+# events и health_metrics секционированы по start_time и recorded_at (RANGE, секция на месяц:
+# events_p2025_01 и т.д.) плюс секция DEFAULT для строк вне созданных месяцев, чтобы вставка
+# никогда не падала. Запросы с условием на время читают только свои секции, а индексы и
+# VACUUM горячих месяцев не зависят от длины истории. Холодные месяцы уходят в архив
+# (app/database/archive.py) целыми секциями. Обслуживание - python manage_partitions.py по cron.
+# На других СУБД секций нет: архивация удаляет холодные строки обычным DELETE.
+
+# На сколько месяцев вперед держать готовые секции
+PARTITION_PREMAKE_MONTHS = int(os.getenv("PARTITION_PREMAKE_MONTHS", "3"))
+# Сколько строк читать из БД и писать в один файл архива за раз
+ARCHIVE_CHUNK_ROWS = int(os.getenv("ARCHIVE_CHUNK_ROWS", "50000"))
+# Если архив выключен, секции создаются на столько месяцев назад
+PARTITION_PAST_MONTHS = 12
+
+# Строки, перенесенные из БД в архив
+ARCHIVED_ROWS = Counter("archived_rows_total", "Строки, перенесенные из БД в архив", ["table"])
+
+
+def partition_name(table: str, month: datetime) -> str:
+    return f"{table}_p{month:%Y_%m}"
+
+
+def _utc(month: datetime) -> datetime:
+    """Граница месяца как параметр запроса: с tzinfo, чтобы timestamptz сравнивался в UTC."""
+    return month.replace(tzinfo=timezone.utc)
+
+
+def _bound(month: datetime) -> str:
+    return f"'{month:%Y-%m-%d} 00:00:00+00'"
+
+
+async def _partitions(conn: AsyncConnection, table: str) -> Set[str]:
+    result = await conn.execute(text(
+        "SELECT child.relname FROM pg_inherits"
+        " JOIN pg_class child ON child.oid = pg_inherits.inhrelid"
+        " JOIN pg_class parent ON parent.oid = pg_inherits.inhparent"
+        " WHERE parent.relname = :table"
+    ), {"table": table})
+    return set(result.scalars())
+
+
+async def ensure_partitions(conn: AsyncConnection, now: Optional[datetime] = None) -> List[str]:
+    """
+    Создает недостающие секции от начала горячего диапазона до PARTITION_PREMAKE_MONTHS
+    месяцев вперед и секцию DEFAULT. Строки, уже попавшие в DEFAULT, переносятся в новую
+    секцию месяца (иначе PostgreSQL не даст ее присоединить). Возвращает созданные секции.
+    """
+    if conn.dialect.name != "postgresql":
+        return []
+    current = archive.month_start(now or datetime.now(timezone.utc))
+    first = archive.hot_since(current) or archive.add_months(current, -PARTITION_PAST_MONTHS)
+    created = []
+    for model, key in archive.ARCHIVED_MODELS.items():
+        table = model.__tablename__
+        await conn.execute(text(f"CREATE TABLE IF NOT EXISTS {table}_default PARTITION OF {table} DEFAULT"))
+        existing = await _partitions(conn, table)
+        month = first
+        while month <= archive.add_months(current, PARTITION_PREMAKE_MONTHS):
+            upper = archive.add_months(month, 1)
+            name = partition_name(table, month)
+            if name not in existing:
+                await conn.execute(text(f"CREATE TABLE {name} (LIKE {table} INCLUDING DEFAULTS)"))
+                await conn.execute(text(
+                    f"WITH moved AS (DELETE FROM {table}_default WHERE {key} >= :lower AND {key} < :upper RETURNING *)"
+                    f" INSERT INTO {name} SELECT * FROM moved"
+                ), {"lower": _utc(month), "upper": _utc(upper)})
+                await conn.execute(text(
+                    f"ALTER TABLE {table} ATTACH PARTITION {name} FOR VALUES FROM ({_bound(month)}) TO ({_bound(upper)})"
+                ))
+                created.append(name)
+            month = upper
+    if created:
+        logger.info("Созданы секции: %s", ", ".join(created))
+    return created
+
+
+async def _archive_shard(shard: int, db: AsyncSession, cutoff: datetime) -> Dict[str, int]:
+    """Переносит в архив месяцы шарда старше cutoff: месяц за месяцем, каждый - своей транзакцией."""
+    archived: Dict[str, int] = {}
+    for model, key_name in archive.ARCHIVED_MODELS.items():
+        table = model.__tablename__
+        key = getattr(model, key_name)
+        oldest = (await db.execute(select(func.min(key)).where(key < _utc(cutoff)))).scalar_one_or_none()
+        if oldest is None:
+            continue
+        month = archive.month_start(oldest)
+        while month < cutoff:
+            upper = archive.add_months(month, 1)
+            started_at = time.perf_counter()
+            rows = 0
+            result = await db.stream(
+                select(model.__table__).where(key >= _utc(month), key < _utc(upper))
+                .execution_options(yield_per=ARCHIVE_CHUNK_ROWS)
+            )
+            async for chunk in result.mappings().partitions(ARCHIVE_CHUNK_ROWS):
+                rows += await asyncio.to_thread(archive.write_month, model, month, [dict(row) for row in chunk], shard)
+            # Файлы записаны - теперь месяц можно убрать из БД
+            conn = await db.connection()
+            if conn.dialect.name == "postgresql" and partition_name(table, month) in await _partitions(conn, table):
+                await db.execute(text(f"DROP TABLE {partition_name(table, month)}"))
+            await db.execute(delete(model).where(key >= _utc(month), key < _utc(upper)))
+            await db.commit()
+            if rows:
+                ARCHIVED_ROWS.labels(table).inc(rows)
+                archived[table] = archived.get(table, 0) + rows
+                logger.info("Месяц %s таблицы %s перенесен в архив", f"{month:%Y-%m}", table,
+                            extra={"shard": shard, "rows": rows, "seconds": round(time.perf_counter() - started_at, 3)})
+            month = upper
+    return archived
+
+
+async def archive_cold_months(now: Optional[datetime] = None) -> Dict[str, int]:
+    """
+    Переносит в архив все месяцы старше горячего диапазона во всех шардах и удаляет их из БД
+    (в PostgreSQL - вместе с секциями). Возвращает число перенесенных строк по таблицам.
+    Повторный запуск после сбоя безопасен: дубли в архиве схлопываются при чтении.
+    """
+    cutoff = archive.hot_since(now)
+    if cutoff is None:
+        return {}
+
+    async def job(shard, factory):
+        async with factory() as db:
+            return await _archive_shard(shard, db, cutoff)
+
+    totals: Dict[str, int] = {}
+    for archived in await shards.fan_out(job, read=False):
+        for table, rows in archived.items():
+            totals[table] = totals.get(table, 0) + rows
+    return totals
+
+
+async def maintain(now: Optional[datetime] = None) -> Dict[str, int]:
+    """Плановое обслуживание: секции на будущие месяцы во всех шардах, затем архивация холодных."""
+    for shard_engine in shards.engines:
+        async with shard_engine.begin() as conn:
+            await ensure_partitions(conn, now)
+    return await archive_cold_months(now)
@@ -0,0 +1,317 @@
+import asyncio
+import logging
+import os
+import time
+import zlib
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple, TypeVar
+
+from sqlalchemy import delete, func, insert, select, text
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.crud.actions import get_user_by_max_id
+from app.database import core, models
+from app.database.ids import MAX_SHARDS, require_node_id, shard_of
+from app.services.metrics import Counter
+
+logger = logging.getLogger(__name__)
+
+# --- Шардирование по пользователям ---
+# Шард 0 - DATABASE_URL (вместе с репликой DATABASE_READ_URL), шарды 1..N-1 - DATABASE_SHARD_URLS
+# через запятую. Все данные пользователя (events, tasks, health_metrics) живут в его шарде.
+# Без DATABASE_SHARD_URLS шард один и все работает как раньше.
+DATABASE_SHARD_URLS = [url.strip() for url in os.getenv("DATABASE_SHARD_URLS", "").split(",") if url.strip()]
+# Как часто перечитывать каталог перенесенных пользователей (таблица user_shards в шарде 0)
+SHARD_MAP_REFRESH_SECONDS = float(os.getenv("SHARD_MAP_REFRESH_SECONDS", "5"))
+
+# result: moved - перенесен, failed - ошибка (данные остались в исходном шарде)
+SHARD_USER_MOVES = Counter("shard_user_moves_total", "Переносы пользователей между шардами", ["result"])
+# Пользователь MAX не нашелся в шарде по хэшу и искался в остальных
+SHARD_LOOKUP_PROBES = Counter("shard_lookup_probes_total", "Поиски пользователя MAX по всем шардам")
+
+# Таблицы с данными пользователя в порядке вставки (удаление - в обратном)
+USER_DATA_MODELS = (models.Event, models.Task, models.HealthMetric)
+
+if len(DATABASE_SHARD_URLS) + 1 > MAX_SHARDS:
+    raise ValueError(f"Не больше {MAX_SHARDS} шардов: номер шарда хранится в id")
+if DATABASE_SHARD_URLS:
+    require_node_id("настроены шарды (DATABASE_SHARD_URLS)")
+
+# execution_options["shard"] читает генератор id (app/database/ids.py): id хранит исходный шард строки
+engines = [core.engine] + [
+    create_async_engine(url, execution_options={"shard": shard}, **core.engine_options(url))
+    for shard, url in enumerate(DATABASE_SHARD_URLS, start=1)
+]
+for _shard, _engine in enumerate(engines[1:], start=1):
+    core.instrument_engine(_engine, f"shard{_shard}")
+
+_session_factories = [core.AsyncSessionLocal] + [
+    sessionmaker(_engine, class_=AsyncSession, expire_on_commit=False) for _engine in engines[1:]
+]
+
+T = TypeVar("T")
+
+
+def session_factory(shard: int, read: bool = False) -> Callable[[], AsyncSession]:
+    """Фабрика сессий шарда. read=True - сессии для чтения (реплика есть только у шарда 0)."""
+    if shard == 0 and read:
+        return core.ReadSessionLocal
+    return _session_factories[shard]
+
+
+class ShardMap:
+    """
+    Шард пользователя. Новый пользователь попадает в шард по хэшу max_user_id, и этот шард
+    записывается в его id - дальше по id шард известен без запросов. Исключения (перенесенные
+    пользователи и созданные при другом числе шардов) хранятся в каталоге user_shards
+    в шарде 0 и кэшируются в процессе на SHARD_MAP_REFRESH_SECONDS.
+    """
+
+    def __init__(self, count: int):
+        self.count = count
+        self._by_user: Dict[int, int] = {}
+        self._by_max_user: Dict[str, int] = {}
+        self._loaded_at = float("-inf")
+        self._refresh_lock = asyncio.Lock()
+
+    def home_shard(self, max_user_id: str) -> int:
+        # crc32, а не hash(): hash строк различается между процессами
+        return zlib.crc32(max_user_id.encode()) % self.count
+
+    def shard_for_max_user(self, max_user_id: str) -> int:
+        shard = self._by_max_user.get(max_user_id)
+        return self.home_shard(max_user_id) if shard is None else shard
+
+    def shard_for_user(self, user_id: int) -> int:
+        shard = self._by_user.get(user_id)
+        if shard is None:
+            shard = shard_of(user_id)
+        if shard >= self.count:
+            raise ValueError(f"Пользователь {user_id} создан в шарде {shard}, а настроено шардов: {self.count}")
+        return shard
+
+    def remember(self, user_id: int, max_user_id: str, shard: int) -> None:
+        self._by_user[user_id] = shard
+        self._by_max_user[max_user_id] = shard
+
+    async def refresh(self, force: bool = False) -> None:
+        """Перечитывает каталог, если он старше SHARD_MAP_REFRESH_SECONDS. С одним шардом ничего не делает."""
+        if self.count == 1:
+            return
+        if not force and time.monotonic() - self._loaded_at < SHARD_MAP_REFRESH_SECONDS:
+            return
+        async with self._refresh_lock:
+            if not force and time.monotonic() - self._loaded_at < SHARD_MAP_REFRESH_SECONDS:
+                return
+            try:
+                async with core.AsyncSessionLocal() as db:
+                    rows = (await db.execute(select(models.UserShard))).scalars().all()
+            except Exception as e:
+                # Старый каталог лучше, чем отказ обслуживать всех пользователей
+                logger.warning("Не удалось перечитать каталог шардов: %s", e)
+                self._loaded_at = time.monotonic()
+                return
+            self._by_user = {row.user_id: row.shard for row in rows}
+            self._by_max_user = {row.max_user_id: row.shard for row in rows}
+            self._loaded_at = time.monotonic()
+
+
+shard_map = ShardMap(len(engines))
+
+
+async def _record_location(user_id: int, max_user_id: str, shard: int) -> None:
+    async with core.AsyncSessionLocal() as db:
+        await db.execute(delete(models.UserShard).where(
+            (models.UserShard.user_id == user_id) | (models.UserShard.max_user_id == max_user_id)
+        ))
+        await db.execute(insert(models.UserShard).values(user_id=user_id, max_user_id=max_user_id, shard=shard))
+        await db.commit()
+    shard_map.remember(user_id, max_user_id, shard)
+
+
+class ShardSessions:
+    """
+    Сессии одного запроса по шардам: открываются при первом обращении к шарду
+    и закрываются все вместе в конце запроса (см. get_shard_db).
+    """
+
+    def __init__(self, shards: ShardMap = shard_map):
+        self.shards = shards
+        self._sessions: Dict[int, AsyncSession] = {}
+
+    def for_shard(self, shard: int) -> AsyncSession:
+        session = self._sessions.get(shard)
+        if session is None:
+            session = self._sessions[shard] = session_factory(shard)()
+        return session
+
+    def for_user(self, user_id: int) -> AsyncSession:
+        return self.for_shard(self.shards.shard_for_user(user_id))
+
+    async def user_by_max_id(self, max_user_id: str) -> Tuple[AsyncSession, Optional[models.User]]:
+        """
+        Пользователь MAX и сессия его шарда. Если его нет в шарде по хэшу (он создан при
+        другом числе шардов), он ищется в остальных, а найденный шард пишется в каталог.
+        Не найден нигде - возвращается сессия шарда, в котором его нужно создать.
+        """
+        shard = self.shards.shard_for_max_user(max_user_id)
+        db = self.for_shard(shard)
+        user = await get_user_by_max_id(db, max_user_id)
+        if user is not None or self.shards.count == 1:
+            return db, user
+        SHARD_LOOKUP_PROBES.inc()
+        for other in range(self.shards.count):
+            if other == shard:
+                continue
+            other_db = self.for_shard(other)
+            user = await get_user_by_max_id(other_db, max_user_id)
+            if user is not None:
+                await _record_location(user.id, max_user_id, other)
+                return other_db, user
+        return db, None
+
+    async def close(self) -> None:
+        sessions, self._sessions = list(self._sessions.values()), {}
+        for session in sessions:
+            await session.close()
+
+
+async def get_shard_db() -> ShardSessions:
+    """Зависимость FastAPI: сессии шардов на время запроса (шард выбирается по пользователю)."""
+    await shard_map.refresh()
+    sessions = ShardSessions()
+    try:
+        yield sessions
+    finally:
+        await sessions.close()
+
+
+# --- Пакетные задачи по всем шардам ---
+
+async def fan_out(job: Callable[[int, Callable[[], AsyncSession]], Awaitable[T]], read: bool = True) -> List[T]:
+    """
+    Запускает job(шард, фабрика сессий) на всех шардах параллельно и возвращает результаты
+    в порядке шардов. Для рассылок и других пакетных задач; read=True - сессии для чтения.
+    """
+    await shard_map.refresh()
+    return list(await asyncio.gather(*(job(shard, session_factory(shard, read)) for shard in range(shard_map.count))))
+
+
+def owns_user(shard: int, user_id: int) -> bool:
+    """Принадлежит ли пользователь шарду (его строки могут остаться в старом шарде после сбоя переноса)."""
+    return shard_map.shard_for_user(user_id) == shard
+
+
+# --- Перенос пользователей между шардами ---
+
+def _row(instance) -> Dict:
+    return {column.key: getattr(instance, column.key) for column in instance.__table__.columns}
+
+
+async def move_user(user_id: int, target: int) -> bool:
+    """
+    Переносит пользователя со всеми данными в шард target без остановки сервиса.
+    Строки пользователя в исходном шарде блокируются (SELECT ... FOR UPDATE) на время
+    копирования: его записи в эти секунды ждут, остальные пользователи не замечают переноса.
+    Порядок: копия в целевой шард -> запись в каталог -> удаление из исходного. Повторный
+    запуск после сбоя безопасен: остатки прерванной копии в целевом шарде удаляются.
+    Процессы узнают о переносе в течение SHARD_MAP_REFRESH_SECONDS; запись, пришедшая за это
+    время в старый шард, завершится ошибкой внешнего ключа, а не потеряется молча.
+    Возвращает False, если пользователь уже в target.
+    """
+    if not 0 <= target < shard_map.count:
+        raise ValueError(f"Нет шарда {target}: настроено шардов {shard_map.count}")
+    await shard_map.refresh(force=True)
+    source = shard_map.shard_for_user(user_id)
+    if source == target:
+        return False
+
+    started_at = time.perf_counter()
+    try:
+        async with session_factory(source)() as src:
+            user = (await src.execute(
+                select(models.User).where(models.User.id == user_id).with_for_update()
+            )).scalar_one_or_none()
+            if user is None:
+                raise LookupError(f"Пользователь {user_id} не найден в шарде {source}")
+            rows = {}
+            for model in USER_DATA_MODELS:
+                result = await src.execute(select(model).where(model.user_id == user_id).with_for_update())
+                rows[model] = [_row(record) for record in result.scalars()]
+
+            async with session_factory(target)() as dst:
+                for model in reversed(USER_DATA_MODELS):
+                    await dst.execute(delete(model).where(model.user_id == user_id))
+                await dst.execute(delete(models.User).where(models.User.id == user_id))
+                await dst.execute(insert(models.User), [_row(user)])
+                for model in USER_DATA_MODELS:
+                    if rows[model]:
+                        await dst.execute(insert(model), rows[model])
+                await dst.commit()
+
+            await _record_location(user_id, user.max_user_id, target)
+
+            for model in reversed(USER_DATA_MODELS):
+                await src.execute(delete(model).where(model.user_id == user_id))
+            await src.execute(delete(models.User).where(models.User.id == user_id))
+            await src.commit()
+    except Exception:
+        SHARD_USER_MOVES.labels("failed").inc()
+        raise
+    SHARD_USER_MOVES.labels("moved").inc()
+    logger.info("Пользователь перенесен из шарда %d в шард %d за %.3f с", source, target,
+                time.perf_counter() - started_at,
+                extra={"user_id": user_id, "rows": sum(len(model_rows) for model_rows in rows.values())})
+    return True
+
+
+async def user_counts() -> List[int]:
+    """Число пользователей в каждом шарде."""
+    async def count(shard, factory):
+        async with factory() as db:
+            return (await db.execute(select(func.count(models.User.id)))).scalar_one()
+    return await fan_out(count, read=False)
+
+
+async def rebalance(max_moves: int) -> List[Tuple[int, int, int]]:
+    """
+    Выравнивает число пользователей по шардам: переносит пользователей из самого
+    заполненного шарда в самый свободный, пока разница больше одного или не сделано
+    max_moves переносов. Возвращает список (user_id, откуда, куда).
+    """
+    counts = await user_counts()
+    moves = []
+    while len(moves) < max_moves:
+        source = max(range(len(counts)), key=counts.__getitem__)
+        target = min(range(len(counts)), key=counts.__getitem__)
+        if counts[source] - counts[target] <= 1:
+            break
+        batch = min(max_moves - len(moves), (counts[source] - counts[target]) // 2)
+        async with session_factory(source)() as db:
+            user_ids = (await db.execute(
+                select(models.User.id).order_by(models.User.id.desc()).limit(batch)
+            )).scalars().all()
+        for user_id in user_ids:
+            if await move_user(user_id, target):
+                moves.append((user_id, source, target))
+        counts[source] -= len(user_ids)
+        counts[target] += len(user_ids)
+    return moves
+
+
+# --- Пул соединений ---
+
+async def warm_up_pool(connections: int = 1) -> None:
+    """Прогрев пулов всех шардов (шард 0 - вместе с репликой)."""
+    async def ping(target):
+        async with target.connect() as conn:
+            await conn.execute(text("SELECT 1"))
+
+    await asyncio.gather(core.warm_up_pool(connections),
+                         *(ping(target) for target in engines[1:] for _ in range(connections)))
+
+
+async def dispose_engines() -> None:
+    await core.dispose_engines()
+    for shard_engine in engines[1:]:
+        await shard_engine.dispose()
@@ -1,30 +1,103 @@
+import logging
+import os
 from fastapi import FastAPI
-from app.database import core, models
-from app.routers import planning, webhooks 
+from fastapi.responses import PlainTextResponse
+from app.crud import actions
+from app.database import models, partitions, shards
+from app.routers import calendar, planning, webhooks 
+from app.services import llm_processor
+from app.services.logs import setup_logging
+from app.services.metrics import render_prometheus
+from app.services.planner_pool import planner_pool
+from app.services.profiling import ProfilingMiddleware, profiling_enabled
+from app.services.tracing import RequestMetricsMiddleware
 import uvicorn
 import asyncio
 
+# Создание таблиц при старте - только для локальной разработки.
+# В проде схема создается отдельной командой до запуска сервера: python create_tables.py
+DB_CREATE_TABLES_ON_STARTUP = os.getenv("DB_CREATE_TABLES_ON_STARTUP", "0") == "1"
+# Сколько соединений с БД открыть заранее
+DB_WARMUP_CONNECTIONS = int(os.getenv("DB_WARMUP_CONNECTIONS", "2"))
+# Загружать граф агента и клиент GigaChat в фоне сразу после старта
+AGENT_PRELOAD = os.getenv("AGENT_PRELOAD", "1") == "1"
+
+# Логи пишутся из отдельного потока через очередь: вызовы логгера не блокируют event loop
+setup_logging()
+logger = logging.getLogger(__name__)
+
 app = FastAPI(
     title="Notemind Backend",
     description="Интеллектуальный ассистент по продуктивности",
     version="1.0.0"
 )
 
-# Функция для создания таблиц при запуске
+# Профилирование отдельных запросов (X-Profile или каждый N-й). Без настроек
+# middleware не подключается совсем. Добавляется первой, чтобы оказаться внутри
+# RequestMetricsMiddleware и видеть трассу запроса
+if profiling_enabled():
+    app.add_middleware(ProfilingMiddleware)
+
+# Время, запросы в работе и X-Request-ID для каждого HTTP-запроса
+app.add_middleware(RequestMetricsMiddleware)
+
+# Функция для создания таблиц при запуске: схема одинаковая во всех шардах.
+# В PostgreSQL сразу создаются и секции events/health_metrics по месяцам
 async def create_tables():
-    # Используем движок из core.py
-    async with core.engine.begin() as conn:
-        await conn.run_sync(models.Base.metadata.create_all)
+    for shard_engine in shards.engines:
+        async with shard_engine.begin() as conn:
+            await conn.run_sync(models.Base.metadata.create_all)
+            await partitions.ensure_partitions(conn)
+
+# Ссылки на фоновые задачи, чтобы их не собрал сборщик мусора
+_background_tasks = set()
+
+async def warm_up():
+    """
+    Прогрев после старта: соединения с БД, пул планировщика и граф агента.
+    Выполняется в фоне, поэтому /health отвечает сразу.
+    """
+    try:
+        if DB_CREATE_TABLES_ON_STARTUP:
+            await create_tables()
+            logger.info("Таблицы БД созданы")
+        await shards.warm_up_pool(DB_WARMUP_CONNECTIONS)
+        logger.info("Пул соединений с БД прогрет", extra={"connections": DB_WARMUP_CONNECTIONS})
+    except Exception as e:
+        logger.error("Не удалось прогреть соединения с БД: %s", e)
+
+    # Процессы планировщика стартуют заранее, а не на первом большом календаре
+    try:
+        await planner_pool.warm_up()
+    except Exception as e:
+        logger.error("Не удалось запустить пул планировщика: %s", e)
+
+    if AGENT_PRELOAD:
+        try:
+            await llm_processor.get_agent()
+        except Exception as e:
+            logger.exception("Не удалось загрузить LLM-агента: %s", e)
 
 @app.on_event("startup")
 async def on_startup():
-    # Запускается при старте сервера
-    await create_tables()
-    print("✅ Database tables created")
+    # Запускается при старте сервера: ничего тяжелого не ждем, только ставим прогрев в фон.
+    # Снимок хранилища в памяти (если задан MEMORY_STORE_SNAPSHOT) читается до первого запроса
+    actions.load_memory_snapshot()
+    task = asyncio.create_task(warm_up())
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    actions.save_memory_snapshot()
+    await shards.dispose_engines()
+    planner_pool.shutdown()
 
 # Подключение роутеров
 # 1. Роутер планирования (для фронтенда /api/v1)
 app.include_router(planning.router, prefix="/api/v1", tags=["planning"]) 
+# Повестка и занятость для фронтенда (условный GET по ETag)
+app.include_router(calendar.router, prefix="/api/v1", tags=["calendar"])
 
 # 2. АКТИВАЦИЯ WEBHOOK (Для входящих запросов от MAX)
 # Подключаем роутер без префикса, чтобы он слушал адрес /webhook
@@ -38,6 +111,11 @@ async def root():
 async def health_check():
     return {"status": "healthy"}
 
+@app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+async def metrics():
+    # Формат экспозиции Prometheus
+    return PlainTextResponse(render_prometheus(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
 if __name__ == "__main__":
     # Добавляем log_level="debug"
     uvicorn.run("app.main:app", host="0.0.0.0", port=8000, reload=True, log_level="debug")
\ No newline at end of file
@@ -0,0 +1,60 @@
+import logging
+from datetime import date
+from typing import Optional
+
+from fastapi import APIRouter, Header, Query
+from fastapi.responses import Response
+
+from app.services.calendar_views import (
+    CALENDAR_VIEW_MAX_DAYS, CALENDAR_VIEW_REQUESTS, VIEW_AGENDA, VIEW_FREE_BUSY, calendar_views, etag_matches,
+)
+from app.services.prompts import user_now
+
+router = APIRouter()
+logger = logging.getLogger(__name__)
+
+# Клиент может хранить ответ, но обязан перепроверять его по ETag при каждом показе
+CACHE_CONTROL = "private, no-cache"
+
+
+def _view_response(view: str, user_id: int, start: Optional[date], days: int, if_none_match: Optional[str]) -> Response:
+    """
+    Ответ представления с ETag. Если ETag клиента совпадает с текущим, возвращается 304
+    без чтения данных пользователя: ETag зависит только от версии данных и окна.
+    """
+    start = start or user_now(user_id).date()
+    etag = calendar_views.etag(view, user_id, start, days)
+    headers = {"ETag": etag, "Cache-Control": CACHE_CONTROL}
+    if etag_matches(if_none_match, etag):
+        CALENDAR_VIEW_REQUESTS.labels(view, "not_modified").inc()
+        return Response(status_code=304, headers=headers)
+    rendered = calendar_views.render(view, user_id, start, days)
+    return Response(content=rendered.body, media_type="application/json", headers=headers)
+
+
+@router.get("/users/{user_id}/agenda")
+async def get_agenda(
+    user_id: int,
+    start: Optional[date] = Query(None, description="Первый день окна (по умолчанию сегодня у пользователя)"),
+    days: int = Query(7, ge=1, le=CALENDAR_VIEW_MAX_DAYS),
+    if_none_match: Optional[str] = Header(None),
+):
+    """
+    Повестка пользователя: события, пересекающиеся с окном дней, и незавершенные задачи.
+    Поддерживает условный GET: с If-None-Match и неизменившимися данными - 304.
+    """
+    return _view_response(VIEW_AGENDA, user_id, start, days, if_none_match)
+
+
+@router.get("/users/{user_id}/freebusy")
+async def get_free_busy(
+    user_id: int,
+    start: Optional[date] = Query(None, description="Первый день окна (по умолчанию сегодня у пользователя)"),
+    days: int = Query(7, ge=1, le=CALENDAR_VIEW_MAX_DAYS),
+    if_none_match: Optional[str] = Header(None),
+):
+    """
+    Занятость по дням окна: занятые интервалы (без названий) и свободные окна
+    в рабочее время. Поддерживает условный GET, как и повестка.
+    """
+    return _view_response(VIEW_FREE_BUSY, user_id, start, days, if_none_match)
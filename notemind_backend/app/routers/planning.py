@@ -1,9 +1,23 @@
+import asyncio
+import json
+import logging
+import os
+from typing import Dict, List
+
 from fastapi import APIRouter, HTTPException
-from pydantic import BaseModel
-from app.services.llm_processor import run_agent_async
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field
+from app.services.llm_processor import agent_inbox, run_agent_stream
+from app.services.llm_gateway import LLMGatewayError, LLMRateLimitedError, Priority, llm_request_context
+from app.services.rate_limit import ingress_limiter, throttled_message
+
+# --- Пакетная обработка ---
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "500"))          # сообщений в одном запросе
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", "4"))  # пользователей пакета параллельно
 
 # Создаем роутер
 router = APIRouter()
+logger = logging.getLogger(__name__)
 
 # --- Модели данных для API (Pydantic) ---
 class UserInput(BaseModel):
@@ -15,6 +29,17 @@ class AgentResponse(BaseModel):
     """Модель для ответа агента."""
     reply: str
 
+class BatchInput(BaseModel):
+    """Пакет сообщений: например, разбор накопившихся заметок или импорт."""
+    items: List[UserInput] = Field(min_length=1, max_length=BATCH_MAX_ITEMS)
+
+async def _enforce_rate_limit(user_id: int) -> None:
+    """429 с Retry-After, если пользователь или сервис в целом превысили лимит входящих запросов."""
+    decision = await ingress_limiter.check("api", str(user_id))
+    if not decision.allowed:
+        raise HTTPException(status_code=429, detail=throttled_message(decision),
+                            headers={"Retry-After": decision.retry_after_header})
+
 # --- Эндпоинты ---
 @router.post("/process", response_model=AgentResponse)
 async def process_user_text(user_input: UserInput):
@@ -22,17 +47,140 @@ async def process_user_text(user_input: UserInput):
     Принимает текст от пользователя, обрабатывает его с помощью LLM-агента
     и возвращает структурированный ответ.
     """
-    print(f"--- API: Получен запрос для user_id={user_input.user_id} ---")
-    print(f"    Текст: '{user_input.text}'")
+    logger.debug("API: запрос: %s", user_input.text, extra={"user_id": user_input.user_id})
+    await _enforce_rate_limit(user_input.user_id)
     
     try:
         # Вызываем нашего агента
-        agent_reply = await run_agent_async(user_input.text, user_input.user_id)
+        # API-запросы не склеиваются, но встают в общую очередь пользователя
+        result = await agent_inbox.submit(user_input.user_id, user_input.text, coalesce=False)
+        agent_reply = result.reply
         
-        print(f"    Ответ агента: '{agent_reply}'")
+        logger.debug("API: ответ агента: %s", agent_reply, extra={"user_id": user_input.user_id})
         return AgentResponse(reply=agent_reply)
     
+    except LLMRateLimitedError as e:
+        # Провайдер ограничивает частоту - просим клиента повторить позже
+        logger.warning("API: LLM перегружен: %s", e, extra={"user_id": user_input.user_id})
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "5"})
+
+    except LLMGatewayError as e:
+        # Очередь переполнена или не успеваем к дедлайну - быстрый отказ вместо ожидания
+        logger.warning("API: запрос отклонен шлюзом LLM: %s", e, extra={"user_id": user_input.user_id})
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
+
     except Exception as e:
         # Обработка возможных ошибок во время выполнения агента
-        print(f"!!! ОШИБКА API: {e}")
+        logger.exception("API: ошибка агента", extra={"user_id": user_input.user_id})
         raise HTTPException(status_code=500, detail=f"Внутренняя ошибка сервера: {e}")
+
+
+def _sse(event: str, data: dict) -> str:
+    """Форматирует одно событие Server-Sent Events."""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@router.post("/process/stream")
+async def process_user_text_stream(user_input: UserInput):
+    """
+    То же, что /process, но ответ приходит потоком Server-Sent Events:
+    ack - запрос принят, tool - результат инструмента, token - фрагмент ответа,
+    reset - отбросить накопленные фрагменты, final - итоговый ответ, error - ошибка.
+    """
+    logger.debug("API (SSE): запрос: %s", user_input.text, extra={"user_id": user_input.user_id})
+    # До открытия потока: клиент получает обычный 429, а не событие error
+    await _enforce_rate_limit(user_input.user_id)
+    events: asyncio.Queue = asyncio.Queue()
+
+    async def pump(text: str, user_id: int):
+        async for event in run_agent_stream(text, user_id):
+            events.put_nowait(event)
+
+    async def event_source():
+        turn = asyncio.create_task(
+            agent_inbox.submit(user_input.user_id, user_input.text, coalesce=False, handler=pump)
+        )
+        turn.add_done_callback(lambda _: events.put_nowait(None))
+        try:
+            while (event := await events.get()) is not None:
+                yield _sse(event["type"], event)
+            turn.result()
+        except LLMRateLimitedError as e:
+            yield _sse("error", {"status": 429, "detail": str(e)})
+        except LLMGatewayError as e:
+            yield _sse("error", {"status": 503, "detail": str(e)})
+        except Exception as e:
+            logger.exception("API (SSE): ошибка агента", extra={"user_id": user_input.user_id})
+            yield _sse("error", {"status": 500, "detail": f"Внутренняя ошибка сервера: {e}"})
+        finally:
+            # Клиент отключился - останавливаем ход агента
+            if not turn.done():
+                turn.cancel()
+
+    return StreamingResponse(
+        event_source(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+def _item_error(error: Exception) -> dict:
+    """Ошибка одного элемента пакета - с тем же статусом, что вернул бы /process."""
+    if isinstance(error, LLMRateLimitedError):
+        return {"status": 429, "detail": str(error)}
+    if isinstance(error, LLMGatewayError):
+        return {"status": 503, "detail": str(error)}
+    return {"status": 500, "detail": f"Внутренняя ошибка сервера: {error}"}
+
+
+@router.post("/process/batch")
+async def process_user_text_batch(batch: BatchInput):
+    """
+    Пакетный вариант /process. Сообщения разных пользователей обрабатываются параллельно
+    (не больше BATCH_MAX_CONCURRENCY пользователей сразу), сообщения одного пользователя -
+    строго в порядке пакета. Запросы к модели идут с фоновым приоритетом, чтобы пакет не
+    задерживал живых пользователей. Каждое сообщение проходит тот же лимит входящих запросов,
+    что и /process: сверх лимита - ошибка 429 этого сообщения. Ответ - NDJSON, по строке на
+    сообщение по мере готовности: {"index": 0, "user_id": 1, "reply": "..."} или
+    {"index": 0, "user_id": 1, "error": {"status": 503, "detail": "..."}}.
+    """
+    by_user: Dict[int, List[int]] = {}
+    for index, item in enumerate(batch.items):
+        by_user.setdefault(item.user_id, []).append(index)
+    logger.debug("API (batch): %d сообщений от %d пользователей", len(batch.items), len(by_user))
+
+    results: asyncio.Queue = asyncio.Queue()
+    limiter = asyncio.Semaphore(BATCH_MAX_CONCURRENCY)
+
+    async def run_user(user_id: int, indexes: List[int]):
+        async with limiter:
+            for index in indexes:
+                line = {"index": index, "user_id": user_id}
+                decision = await ingress_limiter.check("api", str(user_id))
+                if not decision.allowed:
+                    line["error"] = {"status": 429, "detail": throttled_message(decision),
+                                     "retry_after": int(decision.retry_after_header)}
+                    results.put_nowait(line)
+                    continue
+                try:
+                    result = await agent_inbox.submit(user_id, batch.items[index].text, coalesce=False)
+                    line["reply"] = result.reply
+                except Exception as e:
+                    if not isinstance(e, LLMGatewayError):
+                        logger.exception("API (batch): ошибка агента", extra={"user_id": user_id, "index": index})
+                    line["error"] = _item_error(e)
+                results.put_nowait(line)
+
+    async def result_lines():
+        # Приоритет задается до создания задач: они наследуют контекст
+        with llm_request_context(priority=Priority.BACKGROUND):
+            workers = [asyncio.create_task(run_user(user_id, indexes)) for user_id, indexes in by_user.items()]
+        try:
+            for _ in range(len(batch.items)):
+                yield json.dumps(await results.get(), ensure_ascii=False) + "\n"
+        finally:
+            # Клиент отключился - незавершенные сообщения не обрабатываем
+            for worker in workers:
+                worker.cancel()
+
+    return StreamingResponse(result_lines(), media_type="application/x-ndjson")
@@ -1,71 +1,120 @@
+import asyncio
+import logging
 import os
-import requests
-import json
+import time
+from functools import partial
+from typing import Optional
+
 from fastapi import APIRouter, Request, Depends, HTTPException
-from sqlalchemy.ext.asyncio import AsyncSession
-from dotenv import load_dotenv
 
 # --- ИМПОРТЫ МОДУЛЕЙ ПРОЕКТА ---
-# Модуль для получения сессии БД
-from app.database.core import get_db
+# Сессии БД: шард выбирается по пользователю
+from app.database.core import release_connection
+from app.database.shards import ShardSessions, get_shard_db
 # Модели для создания пользователя
 from app.database.models import UserCreate 
 # CRUD функции для работы с пользователем
-from app.crud.actions import get_user_by_max_id, create_user 
+from app.crud.actions import create_user 
 # Функция LLM-агента
-from app.services.llm_processor import run_agent_async 
+from app.services.llm_processor import (
+    EVENT_ACK, EVENT_FINAL, EVENT_RESET, EVENT_TOKEN, EVENT_TOOL, agent_inbox, run_agent_stream,
+)
+# Часовой пояс пользователя для контекста хода
+from app.services.prompts import remember_user_timezone
+# Ошибки шлюза к LLM (перегрузка, дедлайн)
+from app.services.llm_gateway import LLMGatewayError
+# Лимит входящих сообщений
+from app.services.rate_limit import ingress_limiter, throttled_message
+# Отправка сообщений через API MAX
+from app.services.max_api import edit_max_message, send_max_message, send_max_message_get_id
 
-load_dotenv()
-MAX_BOT_TOKEN = os.getenv("MAX_BOT_TOKEN")
-MAX_API_URL = "https://platform-api.max.ru/messages" 
+# Потоковый режим: подтверждение сразу при приеме, затем в том же сообщении - результаты
+# инструментов по мере готовности и итоговый ответ (правками)
+MAX_STREAMING_REPLIES = os.getenv("MAX_STREAMING_REPLIES", "1") == "1"
+MAX_STREAM_EDIT_INTERVAL_SECONDS = int(os.getenv("MAX_STREAM_EDIT_INTERVAL_MS", "800")) / 1000
 
 router = APIRouter()
+logger = logging.getLogger(__name__)
 
-# --- Вспомогательная функция для отправки сообщений MAX ---
-def send_max_message(user_id: str, text: str):
-    """Отправляет ответное сообщение пользователю через API MAX."""
-    if not MAX_BOT_TOKEN:
-        print("ERROR: MAX_BOT_TOKEN not found. Cannot send message.")
-        return
-
-    # АУТЕНТИФИКАЦИЯ: токен передается как query-параметр 'access_token'
-    # АДРЕСАТ: user_id также передается как query-параметр
-    params = {
-        "user_id": user_id,
-        "access_token": MAX_BOT_TOKEN
-    }
-
-    # ТЕЛО ЗАПРОСА: текст и обязательные пустые поля
-    json_body = {
-        "text": text,
-        "attachments": None,
-        "link": None
-    }
-
-    # Заголовок Authorization не нужен
-    headers = {
-        "Content-Type": "application/json"
-    }
 
-    try:
-        response = requests.post(MAX_API_URL, headers=headers, params=params, json=json_body)
-        response.raise_for_status()
-        print(f"Отправлено в MAX: {text}")
-    except Exception as e:
-        print(f"Ошибка отправки сообщения в MAX: {e}")
-# ----------------------------------------------------------
+ACK_TEXT = "⏳ Принято, обрабатываю…"
+
+
+class AckMessage:
+    """
+    Подтверждение приема ("Принято"), отправленное сразу при приеме сообщения - до окна
+    склейки и до конца предыдущего хода пользователя. Потом ход агента правит это же
+    сообщение: дописывает результаты инструментов и заменяет его текстом ответа.
+    """
+
+    def __init__(self, max_user_id: str):
+        self.max_user_id = max_user_id
+        self._sent: Optional[asyncio.Task] = None
+
+    def send(self) -> None:
+        self._sent = asyncio.create_task(send_max_message_get_id(self.max_user_id, ACK_TEXT))
+
+    async def message_id(self) -> Optional[str]:
+        return await self._sent if self._sent is not None else None
+
+    async def replace(self, text: str) -> None:
+        """Заменяет подтверждение текстом (или отправляет текст отдельно, если подтверждения нет)."""
+        message_id = await self.message_id()
+        if not (message_id and await edit_max_message(message_id, text)):
+            await send_max_message(self.max_user_id, text)
+
+
+async def stream_reply_to_max(max_user_id: str, ack: AckMessage, text: str, user_id: int) -> str:
+    """
+    Выполняет ход агента в потоковом режиме и ведет переписку в MAX по ходу дела:
+    подтверждение приема дополняется результатами инструментов, затем в нем печатается
+    ответ. Возвращает итоговый ответ.
+    """
+    message_id = await ack.message_id()
+    progress = [ACK_TEXT]
+    draft = ""
+    last_edit_at = 0.0
+    final_reply = ""
+    async for event in run_agent_stream(text, user_id):
+        kind = event["type"]
+        if kind == EVENT_ACK:
+            if message_id is None:
+                # Подтверждение при приеме не ушло - пробуем еще раз
+                message_id = await send_max_message_get_id(max_user_id, ACK_TEXT)
+        elif kind == EVENT_TOOL:
+            progress.append(f"✅ {event['text']}")
+            if message_id:
+                await edit_max_message(message_id, "\n".join(progress))
+            else:
+                await send_max_message(max_user_id, progress[-1])
+        elif kind == EVENT_RESET:
+            draft = ""
+        elif kind == EVENT_TOKEN:
+            draft += event["text"]
+            now = time.monotonic()
+            # Первый фрагмент - сразу, дальше правки не чаще интервала
+            if message_id and now - last_edit_at >= MAX_STREAM_EDIT_INTERVAL_SECONDS:
+                await edit_max_message(message_id, draft)
+                last_edit_at = now
+        elif kind == EVENT_FINAL:
+            final_reply = event["text"]
+
+    if message_id:
+        await edit_max_message(message_id, final_reply)
+    else:
+        await send_max_message(max_user_id, final_reply)
+    return final_reply
 
 
 @router.post("")
-async def handle_max_update(request: Request, db: AsyncSession = Depends(get_db)):
+async def handle_max_update(request: Request, shard_sessions: ShardSessions = Depends(get_shard_db)):
     """
     Основной обработчик входящих сообщений от MAX.
     """
-    print("\n--- WEBHOOK: Получен новый запрос ---")
     try:
         # 1. Получение данных от MAX
         data = await request.json()
-        print(f"    Данные: {data}")
+        logger.debug("WEBHOOK: получен запрос: %s", data)
     except Exception:
         # Если пришел невалидный JSON
         raise HTTPException(status_code=400, detail="Invalid JSON format")
@@ -76,48 +125,77 @@ async def handle_max_update(request: Request, db: AsyncSession = Depends(get_db)
 
     message_body = data.get("message", {}).get("body", {})
     message_text = message_body.get("text")
-    print(f"    ID пользователя MAX: {max_user_id}, Текст: '{message_text}'")
     
     if not message_text or not max_user_id:
         return {"status": "ignore", "detail": "No text or user_id found"}
+
+    # Лимит проверяется до обращения к БД и агенту: спам отсекается почти бесплатно.
+    # Вежливый ответ - не чаще раза в интервал, чтобы не спамить в ответ самим.
+    # Статус 200: иначе MAX будет повторять доставку
+    decision = await ingress_limiter.check("max", max_user_id)
+    if not decision.allowed:
+        if ingress_limiter.should_reply(max_user_id):
+            await send_max_message(max_user_id, throttled_message(decision))
+        return {"status": "throttled", "scope": decision.scope}
         
     # --- 2. Аутентификация / Регистрация Пользователя ---
-    user = await get_user_by_max_id(db, max_user_id)
+    # Сессия шарда пользователя; нового пользователя создаем в ней же
+    db, user = await shard_sessions.user_by_max_id(max_user_id)
     if not user:
-        print(f"    Пользователь {max_user_id} не найден. Создание нового...")
+        logger.info("WEBHOOK: новый пользователь MAX, регистрация", extra={"max_user_id": max_user_id})
         # Если пользователь не найден, создаем его
         try:
             user_data = UserCreate(max_user_id=max_user_id).model_dump()
             # Передаем словарь напрямую
             user = await create_user(db, user_data)
-            print(f"    Пользователь создан с ID: {user.id}")
+            await release_connection(db)
+            logger.info("WEBHOOK: пользователь создан", extra={"max_user_id": max_user_id, "user_id": user.id})
             
-            send_max_message(max_user_id, "🎉 Добро пожаловать в Notemind! Я ваш AI-ассистент. Попробуйте: 'Завтра в 10 созвон, и я плохо спал'.")
+            await send_max_message(max_user_id, "🎉 Добро пожаловать в Notemind! Я ваш AI-ассистент. Попробуйте: 'Завтра в 10 созвон, и я плохо спал'.")
             # После приветствия завершаем обработку этого запроса
             return {"status": "user_created"}
         except Exception as e:
-            print(f"!!! ERROR creating user: {e}")
-            send_max_message(max_user_id, "Ошибка при регистрации. Проверьте настройки БД.")
+            logger.exception("WEBHOOK: ошибка регистрации пользователя", extra={"max_user_id": max_user_id})
+            await send_max_message(max_user_id, "Ошибка при регистрации. Проверьте настройки БД.")
             return {"status": "user_creation_error"}
     
-    print(f"    Пользователь найден, внутренний ID: {user.id}")
     user_id = user.id 
+    logger.debug("WEBHOOK: сообщение пользователя: %s", message_text, extra={"user_id": user_id})
+    remember_user_timezone(user_id, user.preferences)
+    # Ход агента длится секунды (ожидание GigaChat) - соединение с БД на это время возвращаем в пул
+    await release_connection(db)
     
     # --- 3. Вызов LLM-Агента (Участник 1) ---
     try:
-        print("    -> Вызов LLM-агента...")
         # LLM-агент сам обрабатывает текст, вызывает CRUD и Maps, и возвращает финальный ответ.
-        agent_final_reply = await run_agent_async(message_text, user_id)
-        print(f"    <- Ответ агента: '{agent_final_reply}'")
+        # Сообщения, пришедшие подряд, склеиваются в один запуск агента
+        ack = AckMessage(max_user_id)
+        if MAX_STREAMING_REPLIES:
+            result = await agent_inbox.submit(user_id, message_text, handler=partial(stream_reply_to_max, max_user_id, ack),
+                                              on_lead=ack.send)
+        else:
+            result = await agent_inbox.submit(user_id, message_text)
+        if not result.is_leader:
+            # Ответ на всю пачку отправляет вызов, который запускал агента
+            logger.debug("WEBHOOK: сообщение объединено с предыдущими", extra={"user_id": user_id, "merged": result.merged})
+            return {"status": "coalesced"}
+        agent_final_reply = result.reply
+        logger.debug("WEBHOOK: ответ агента: %s", agent_final_reply, extra={"user_id": user_id})
         
         # --- 4. Отправка ответа пользователю ---
-        print("    -> Отправка ответа в MAX...")
-        send_max_message(max_user_id, agent_final_reply)
+        # В потоковом режиме ответ уже доставлен по ходу выполнения
+        if not MAX_STREAMING_REPLIES:
+            await send_max_message(max_user_id, agent_final_reply)
         
-        print("--- WEBHOOK: Запрос успешно обработан ---")
         return {"status": "processed", "reply": agent_final_reply}
 
+    except LLMGatewayError as e:
+        # Перегрузка - не ошибка агента: вежливо просим повторить позже
+        logger.warning("WEBHOOK: запрос отклонен шлюзом LLM: %s", e, extra={"user_id": user_id})
+        await ack.replace("Сейчас у меня очень много запросов 🙏 Пожалуйста, повторите сообщение через минуту.")
+        return {"status": "throttled"}
+
     except Exception as e:
-        print(f"!!! CRITICAL AGENT ERROR: {e}")
-        send_max_message(max_user_id, "Произошла критическая ошибка в работе AI-агента. Пожалуйста, проверьте логи.")
+        logger.exception("WEBHOOK: критическая ошибка агента", extra={"user_id": user_id})
+        await ack.replace("Произошла критическая ошибка в работе AI-агента. Пожалуйста, проверьте логи.")
         return {"status": "agent_error"}
\ No newline at end of file
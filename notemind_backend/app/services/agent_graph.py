@@ -0,0 +1,287 @@
+# Граф LLM-агента: инструменты, клиент GigaChat и узлы LangGraph.
+# Модуль тяжелый (langchain/langgraph/GigaChat), поэтому загружается лениво
+# через llm_processor.get_agent() при первом обращении к агенту.
+import asyncio
+import logging
+import os
+from contextlib import contextmanager
+from typing import List, Optional, TypedDict, Annotated
+import operator
+
+from gigachat.context import session_id_cvar
+from langchain_gigachat import GigaChat
+from langchain_core.messages import AIMessage, AIMessageChunk, HumanMessage, BaseMessage, ToolMessage, SystemMessage
+from langchain.tools import tool
+from langgraph.errors import GraphRecursionError
+from langgraph.graph import StateGraph, END
+
+from app.crud import actions
+from app.services.ai_planner import plan_task
+from app.services import maps
+from app.services.geo_speculation import GeoPrefetch
+from app.services.prompts import SYSTEM_PROMPT
+from app.services.tracing import (
+    AGENT_MODEL_CALL_LATENCY, AGENT_NODE_LATENCY, AGENT_TOOL_LATENCY, stage_timer,
+)
+from app.services.llm_gateway import LLMDeadlineExceededError, llm_gateway, llm_request_context
+from app.services.turn_context import (
+    AGENT_BUDGET_EXHAUSTED, EVENT_RESET, EVENT_TOKEN, EVENT_TOOL, REASON_STEPS, REASON_TIME,
+    TurnBudget, TurnBudgetExceeded, current_turn, start_turn,
+)
+
+logger = logging.getLogger(__name__)
+
+# --- Состояние графа (AgentState) ---
+class AgentState(TypedDict):
+    messages: Annotated[List[BaseMessage], operator.add]
+    user_id: int
+
+# --- Инструменты (Tools) ---
+# ВНИМАНИЕ: Это функции-заглушки.
+
+@tool
+async def create_event(user_id: int, title: str, start_time: str) -> str:
+    """Создает событие с фиксированным временем в календаре. Не используй этот инструмент для сохранения адреса."""
+    try:
+        await actions.save_event(user_id, title, start_time, location=None) # Location теперь всегда None
+    except ValueError:
+        return f"Не удалось сохранить событие '{title}': время '{start_time}' не в формате ISO (YYYY-MM-DDTHH:MM)."
+    return f"Событие '{title}' на {start_time} успешно сохранено."
+
+@tool
+async def create_task(user_id: int, title: str, duration_hours: float = None, deadline: str = None) -> str:
+    """
+    Создает задачу. Если указана длительность, пытается автоматически запланировать ее в календаре.
+    """
+    # 1. Сохраняем саму задачу
+    task = await actions.save_task(user_id, title, duration_hours, deadline)
+    
+    # 2. Если есть длительность, пытаемся ее запланировать
+    if duration_hours:
+        planned_event = await plan_task(task, user_id)
+        
+        if planned_event:
+            planned_time = planned_event.start_time.strftime('%d %B в %H:%M')
+            return f"Задача '{title}' создана и автоматически запланирована на {planned_time}."
+        else:
+            return f"Задача '{title}' создана, но найти свободный слот для планирования не удалось."
+            
+    return f"Задача '{title}' успешно создана (без времени в календаре)."
+
+@tool
+async def log_health_metric(user_id: int, metric: str, value: str) -> str:
+    """Записывает метрику о самочувствии пользователя."""
+    await actions.save_health_metric(user_id, metric, value)
+    return f"Запись о самочувствии '{metric}: {value}' сохранена."
+
+@tool
+async def get_travel_time(origin_address: str, destination_address: str) -> str:
+    """
+    Рассчитывает время в пути между двумя адресами.
+    """
+    # --- Имитация получения профиля пользователя ---
+    # В реальном приложении этот город нужно будет брать из базы данных
+    user_home_city = maps.DEFAULT_HOME_CITY
+    # -----------------------------------------
+
+    # В реальном приложении 'дом' нужно заменять на реальный адрес из профиля пользователя
+    if origin_address.lower() in ["дом", "из дома", "от дома"]:
+        origin_address = user_home_city 
+
+    # Адреса из сообщения уже геокодируются с начала хода (см. geo_speculation):
+    # готовые координаты берутся оттуда, остальное - запросами в потоке, не блокируя event loop
+    turn = current_turn()
+    geo = turn.geo if turn is not None and turn.geo is not None else GeoPrefetch(user_home_city)
+
+    async def find_destination():
+        # Ищем адрес назначения с привязкой к домашнему городу
+        bias_coords = await geo.geocode(user_home_city)
+        return await geo.geocode(destination_address, bias_coords=bias_coords)
+
+    # Адрес отправления может быть не из домашнего города, поэтому без привязки - и параллельно
+    destination_coords, origin_coords = await asyncio.gather(find_destination(), geo.geocode(origin_address))
+    if not destination_coords:
+        return f"Не удалось найти координаты для адреса назначения: {destination_address}"
+    if not origin_coords:
+        return f"Не удалось найти координаты для адреса отправления: {origin_address}"
+
+    time_minutes = await asyncio.to_thread(maps.get_travel_time, origin_coords, destination_coords)
+    
+    return f"Расчетное время в пути от '{origin_address}' до '{destination_address}' составляет {time_minutes} минут."
+
+
+@tool
+async def find_items(user_id: int, query: str) -> str:
+    """
+    Ищет сохраненные события и задачи пользователя по словам из названия, описания или места.
+    """
+    hits = await actions.find_items(user_id, query)
+    if not hits:
+        return f"По запросу '{query}' ничего не найдено."
+    lines = []
+    for hit in hits:
+        record = hit.record
+        if hit.kind == "event":
+            lines.append(f"- Событие '{record.title}': {record.start_time.strftime('%d.%m %H:%M')}"
+                         + (f", {record.location}" if record.location else ""))
+        else:
+            deadline = f", срок {record.deadline.strftime('%d.%m %H:%M')}" if record.deadline else ""
+            lines.append(f"- Задача '{record.title}' ({record.status}{deadline})"
+                         + (f": {record.description}" if record.description else ""))
+    return "Найдено:\n" + "\n".join(lines)
+
+
+# ... Другие инструменты, такие как get_travel_time и schedule_task, могут быть добавлены позже
+tools = [create_event, create_task, log_health_metric, get_travel_time, find_items]
+
+# --- Настройка LLM ---
+def _create_llm():
+    credentials = os.getenv("GIGACHAT_CREDENTIALS")
+    if not credentials:
+        raise ValueError("GIGACHAT_CREDENTIALS не найден в .env файле!")
+    return GigaChat(credentials=credentials, verify_ssl_certs=False, scope="GIGACHAT_API_PERS")
+
+llm = _create_llm()
+llm_with_tools = llm.bind_tools(tools)
+
+
+def set_chat_model(model) -> None:
+    """Подменяет модель агента, например сценарной в нагрузочном тесте (benchmarks/fakes.py)."""
+    global llm, llm_with_tools
+    llm = model
+    llm_with_tools = model.bind_tools(tools)
+
+# Один системный промпт на все истории: сообщение неизменяемое, делим его по ссылке
+SYSTEM_MESSAGE = SystemMessage(content=SYSTEM_PROMPT)
+
+# Кэш контекста GigaChat: запросы с одинаковым X-Session-ID и общим началом
+# диалога не тарифицируют и не обрабатывают повторно уже виденный префикс
+GIGACHAT_SESSION_CACHE = os.getenv("GIGACHAT_SESSION_CACHE", "1") == "1"
+
+
+@contextmanager
+def gigachat_session(user_id: int):
+    """Помечает все запросы к GigaChat внутри блока сессией пользователя."""
+    if not GIGACHAT_SESSION_CACHE:
+        yield
+        return
+    token = session_id_cvar.set(f"notemind-{user_id}")
+    try:
+        yield
+    finally:
+        session_id_cvar.reset(token)
+
+# Инструменты, которые что-то сохраняют для пользователя
+SAVING_TOOLS = {"create_event", "create_task", "log_health_metric"}
+
+# --- Узлы графа (Nodes) ---
+async def call_model(state: AgentState):
+    with stage_timer(AGENT_NODE_LATENCY, "agent", stage="node:agent"):
+        current_turn().count_step()
+        # Через шлюз: лимит параллельности и частоты, приоритет, повторы на 429
+        with stage_timer(AGENT_MODEL_CALL_LATENCY, stage="llm:call_model"):
+            response = await llm_gateway.ainvoke(llm_with_tools, state["messages"])
+    return {"messages": [response]}
+
+async def call_tools_node(state: AgentState):
+    with stage_timer(AGENT_NODE_LATENCY, "tools", stage="node:tools"):
+        return await _call_tools(state)
+
+async def _call_tools(state: AgentState):
+    turn = current_turn()
+    turn.count_step()
+    tool_messages = []
+    for tool_call in state["messages"][-1].tool_calls:
+        turn.count_tool_call()
+        tool_name = tool_call["name"]
+        tool_input = tool_call["args"]
+        tool_input["user_id"] = state["user_id"] # Внедряем user_id
+        logger.debug("АГЕНТ: вызов %s с %s", tool_name, tool_input, extra={"user_id": state["user_id"]})
+        selected_tool = next((t for t in tools if t.name == tool_name), None)
+        if selected_tool:
+            with stage_timer(AGENT_TOOL_LATENCY, tool_name, stage=f"tool:{tool_name}"):
+                message = await selected_tool.ainvoke(tool_input)
+            tool_messages.append(ToolMessage(tool_call_id=tool_call["id"], content=str(message)))
+            if tool_name in SAVING_TOOLS:
+                # Запоминаем, что уже сохранено: пригодится, если ход прервется по бюджету
+                turn.saved.append(str(message))
+    return {"messages": tool_messages}
+
+def should_continue(state: AgentState):
+    return "tools" if state["messages"][-1].tool_calls else END
+
+
+# --- Построение графа ---
+workflow = StateGraph(AgentState)
+workflow.add_node("agent", call_model)
+workflow.add_node("tools", call_tools_node)
+workflow.set_entry_point("agent")
+workflow.add_conditional_edges("agent", should_continue)
+workflow.add_edge("tools", "agent")
+app_graph = workflow.compile()
+
+
+async def produce_turn(messages: List[BaseMessage], user_id: int, budget: Optional[TurnBudget],
+                        stream_tokens: bool, events: asyncio.Queue, user_input: str = ""):
+    """
+    Выполняет граф для одного хода и складывает события в очередь.
+    Адреса из user_input (текст пользователя без контекста) геокодируются в фоне
+    одновременно с первым вызовом модели.
+    Возвращает (ответ, можно_кэшировать, затраченное_время).
+    Работает в отдельной задаче, чтобы бюджет времени отменял только сам ход,
+    а не код, который читает поток.
+    """
+    with start_turn(user_id, budget) as turn, llm_request_context(timeout=turn.budget.max_seconds), \
+            gigachat_session(user_id):
+        turn.geo = GeoPrefetch()
+        turn.geo.speculate(user_input)
+        exhausted_reason = None
+        response_message = None
+        # updates - результаты узлов графа, messages - токены модели по мере генерации
+        stream_mode = ["updates", "messages"] if stream_tokens else ["updates"]
+        try:
+            # По истечении времени asyncio.timeout отменяет текущие вызовы LLM и инструментов
+            async with asyncio.timeout(turn.budget.max_seconds):
+                async for mode, chunk in app_graph.astream(
+                    {"messages": messages, "user_id": user_id},
+                    # Страховка на уровне LangGraph, основной счет шагов - в узлах
+                    config={"recursion_limit": turn.budget.max_steps + 1},
+                    stream_mode=stream_mode,
+                ):
+                    if mode == "messages":
+                        message_chunk, metadata = chunk
+                        if metadata.get("langgraph_node") == "agent" and isinstance(message_chunk, AIMessageChunk) and message_chunk.content:
+                            events.put_nowait({"type": EVENT_TOKEN, "text": message_chunk.content})
+                        continue
+                    for node, update in chunk.items():
+                        new_messages = (update or {}).get("messages", [])
+                        if node == "tools":
+                            for message in new_messages:
+                                events.put_nowait({"type": EVENT_TOOL, "text": message.content})
+                        elif node == "agent" and new_messages:
+                            response_message = new_messages[-1]
+                            if stream_tokens and response_message.tool_calls and response_message.content:
+                                events.put_nowait({"type": EVENT_RESET})
+        except TimeoutError:
+            exhausted_reason = REASON_TIME
+        except TurnBudgetExceeded as e:
+            exhausted_reason = e.reason
+        except GraphRecursionError:
+            exhausted_reason = REASON_STEPS
+        except LLMDeadlineExceededError:
+            # Шлюз отказал по дедлайну хода: если что-то уже сохранено - это частичный ответ,
+            # иначе пусть вызывающий ответит быстрым отказом
+            if not turn.saved:
+                raise
+            exhausted_reason = REASON_TIME
+        finally:
+            turn.geo.finish()
+
+        elapsed = turn.budget.max_seconds - turn.remaining_seconds()
+        if exhausted_reason:
+            logger.warning("АГЕНТ: бюджет хода исчерпан (%s)", exhausted_reason,
+                           extra={"user_id": user_id, "steps": turn.steps, "tool_calls": turn.tool_calls})
+            AGENT_BUDGET_EXHAUSTED.labels(exhausted_reason).inc()
+            return AIMessage(content=turn.partial_reply(exhausted_reason)), False, elapsed
+        # В кэш попадают только ходы, в которых не было ни одного вызова инструмента
+        return response_message, turn.tool_calls == 0, elapsed
@@ -1,100 +1,78 @@
+import logging
 from datetime import datetime, timedelta
-from typing import Dict, Any, List, Optional
+from typing import Optional
 
 from app.crud import actions
+from app.crud.memory_store import EventRecord, TaskRecord
+from app.services import slot_solver
+from app.services.planner_pool import planner_pool
+from app.services.tracing import PLANNER_LATENCY, traced
+
+logger = logging.getLogger(__name__)
 
 # --- Константы для планировщика ---
 WORK_HOURS_START = 9  # Начало рабочего дня (9:00)
 WORK_HOURS_END = 21   # Конец рабочего дня (21:00)
 MIN_SLOT_MINUTES = 15 # Минимальный интервал между событиями
+PLANNING_HORIZON_DAYS = 30 # Насколько вперед ищем свободный слот
 
-async def plan_task(task: Dict[str, Any], user_id: int) -> Optional[Dict[str, Any]]:
+@traced(PLANNER_LATENCY, stage="planner")
+async def plan_task(task: TaskRecord, user_id: int) -> Optional[EventRecord]:
     """
     Основная функция AI-планировщика.
     Находит свободный слот для задачи и создает событие.
     
-    :param task: Словарь с данными задачи (должен содержать 'duration_hours').
+    :param task: Задача (должна иметь estimated_duration, в минутах).
     :param user_id: ID пользователя.
     :return: Созданное событие или None, если слот не найден.
     """
-    print(f"--- AI-ПЛАНИРОВЩИК: Начало планирования задачи '{task.get('title')}' ---")
-    
-    duration_hours = task.get("duration_hours")
-    if not duration_hours:
-        print("    ОШИБКА: У задачи нет длительности, планирование невозможно.")
+    if not task.estimated_duration:
+        logger.warning("ПЛАНИРОВЩИК: у задачи нет длительности, планирование невозможно", extra={"user_id": user_id})
         return None
 
-    task_duration = timedelta(hours=duration_hours)
-    
-    # 1. Получаем все существующие события пользователя
-    user_events = await actions.get_events(user_id)
-    
-    # 2. Сортируем события по времени начала
-    # Убедимся, что время в строковом формате ISO можно сравнивать
-    sorted_events = sorted(user_events, key=lambda x: x['start_time'])
-    
-    # 3. Ищем свободный слот
-    
-    # Начинаем поиск с текущего времени, округленного до ближайших 15 минут
-    search_start_time = datetime.now()
-    search_start_time = search_start_time.replace(second=0, microsecond=0) + timedelta(minutes=MIN_SLOT_MINUTES - search_start_time.minute % MIN_SLOT_MINUTES)
+    task_duration = timedelta(minutes=task.estimated_duration)
+
+    # 1. Начинаем поиск с текущего времени, округленного до ближайших 15 минут
+    now = datetime.now()
+    search_start_time = now.replace(second=0, microsecond=0) + timedelta(minutes=MIN_SLOT_MINUTES - now.minute % MIN_SLOT_MINUTES)
+    horizon_time = now + timedelta(days=PLANNING_HORIZON_DAYS)
+
+    # 2. Берем только события, пересекающиеся с горизонтом поиска: они уже
+    # отсортированы по началу, выборка по диапазону - бинарный поиск
+    user_events = await actions.get_events_overlapping(user_id, search_start_time, horizon_time + task_duration)
+
+    # 3. Сам поиск - на целых минутах от полуночи первого дня; большие календари
+    # решаются в пуле процессов, чтобы не держать event loop
+    base = search_start_time.replace(hour=0, minute=0)
+    busy = slot_solver.busy_array(
+        (_minutes_floor(event.start_time - base), _minutes_ceil(event.end_time - base)) for event in user_events
+    )
+    slot = await planner_pool.find_slot(
+        busy, _minutes_floor(search_start_time - base), task.estimated_duration, _minutes_floor(horizon_time - base),
+        WORK_HOURS_START * 60, WORK_HOURS_END * 60, MIN_SLOT_MINUTES,
+    )
+    if slot == slot_solver.NO_SLOT:
+        logger.info("ПЛАНИРОВЩИК: нет свободного слота в ближайшие %d дней", PLANNING_HORIZON_DAYS,
+                    extra={"user_id": user_id})
+        return None
 
-    # Добавляем "виртуальное" событие в конце, чтобы ограничить поиск
-    calendar = []
-    for event in sorted_events:
-        try:
-            start = datetime.fromisoformat(event['start_time'])
-            # Предположим, что все события длятся 1 час, если нет данных
-            # В будущем это нужно будет уточнять
-            end = start + timedelta(hours=event.get('duration_hours', 1))
-            calendar.append({"start": start, "end": end})
-        except (ValueError, TypeError):
-            print(f"    ПРЕДУПРЕЖДЕНИЕ: Неверный формат времени у события: {event}")
-            continue
+    # 4. Создаем новое событие
+    new_event = await actions.save_event(
+        user_id=user_id,
+        title=f"Задача: {task.title}",
+        start_time=(base + timedelta(minutes=slot)).isoformat(),
+        location=None, # У задач пока нет локации
+        event_type="task",
+        duration=task_duration,
+    )
+    logger.debug("ПЛАНИРОВЩИК: задача '%s' запланирована на %s", task.title, new_event.start_time,
+                 extra={"user_id": user_id})
+    return new_event
 
-    # Основной цикл поиска
-    while True:
-        # Проверяем, что время находится в пределах рабочего дня
-        if not (WORK_HOURS_START <= search_start_time.hour < WORK_HOURS_END):
-            # Если нет, переходим на следующее утро
-            search_start_time = search_start_time.replace(hour=WORK_HOURS_START, minute=0, second=0) + timedelta(days=1)
-            continue
 
-        slot_end_time = search_start_time + task_duration
-        
-        # Проверяем, что слот не выходит за рамки рабочего дня
-        if slot_end_time.hour > WORK_HOURS_END or (slot_end_time.hour == WORK_HOURS_END and slot_end_time.minute > 0):
-            search_start_time = search_start_time.replace(hour=WORK_HOURS_START, minute=0, second=0) + timedelta(days=1)
-            continue
+def _minutes_floor(delta: timedelta) -> int:
+    return int(delta.total_seconds() // 60)
 
-        # Проверяем на пересечения с существующими событиями
-        is_slot_free = True
-        for event_slot in calendar:
-            if max(search_start_time, event_slot['start']) < min(slot_end_time, event_slot['end']):
-                # Найдено пересечение, слот занят.
-                # Перемещаем начало поиска на конец этого события + минимальный интервал
-                search_start_time = event_slot['end'] + timedelta(minutes=MIN_SLOT_MINUTES)
-                is_slot_free = False
-                break
-        
-        if is_slot_free:
-            # Слот найден!
-            print(f"    Найден свободный слот: {search_start_time.isoformat()}")
-            
-            # 4. Создаем новое событие
-            new_event = await actions.save_event(
-                user_id=user_id,
-                title=f"Задача: {task.get('title')}",
-                start_time=search_start_time.isoformat(),
-                location=None # У задач пока нет локации
-            )
-            print("--- AI-ПЛАНИРОВЩИК: Задача успешно запланирована ---")
-            return new_event
 
-        # Если мы дошли сюда, значит, слот был занят, и search_start_time был обновлен.
-        # Цикл начнется снова с нового времени.
-        
-        # Защита от бесконечного цикла (например, если задача длиннее рабочего дня)
-        if search_start_time > datetime.now() + timedelta(days=30): # Ищем на месяц вперед
-             print("    ОШИБКА: Не удалось найти свободный слот в течение 30 дней.")
-             return None
+def _minutes_ceil(delta: timedelta) -> int:
+    return -int(-delta.total_seconds() // 60)
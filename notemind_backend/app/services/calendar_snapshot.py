@@ -0,0 +1,172 @@
+import os
+from bisect import bisect_left
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from app.crud import actions
+from app.crud.memory_store import EventRecord, TaskRecord
+from app.services.ai_planner import MIN_SLOT_MINUTES, WORK_HOURS_END, WORK_HOURS_START
+from app.services.metrics import Counter
+from app.services.prompts import user_now
+
+# --- Настройки снимка календаря для агента ---
+CALENDAR_SNAPSHOT_ENABLED = os.getenv("CALENDAR_SNAPSHOT_ENABLED", "1") == "1"
+CALENDAR_SNAPSHOT_DAYS = int(os.getenv("CALENDAR_SNAPSHOT_DAYS", "3"))               # дней вперед, включая сегодня
+CALENDAR_SNAPSHOT_MAX_BUSY = int(os.getenv("CALENDAR_SNAPSHOT_MAX_BUSY", "8"))       # занятых блоков на день
+CALENDAR_SNAPSHOT_MAX_TASKS = int(os.getenv("CALENDAR_SNAPSHOT_MAX_TASKS", "8"))     # последних задач
+CALENDAR_SNAPSHOT_TITLE_CHARS = 40
+
+# Снимок перестраивается не чаще, чем раз в этот интервал (если календарь не менялся)
+SNAPSHOT_BUCKET_MINUTES = 15
+
+# Обращения к кэшу отрисованных снимков (hit - календарь и окно времени не менялись)
+CALENDAR_SNAPSHOT_REQUESTS = Counter("calendar_snapshot_requests_total", "Обращения к кэшу снимков календаря", ["result"])
+
+WEEKDAYS_SHORT = ("пн", "вт", "ср", "чт", "пт", "сб", "вс")
+
+Interval = Tuple[datetime, datetime, str]
+
+
+def _short(title: str) -> str:
+    title = " ".join(str(title).split())
+    if len(title) <= CALENDAR_SNAPSHOT_TITLE_CHARS:
+        return title
+    return title[:CALENDAR_SNAPSHOT_TITLE_CHARS - 1] + "…"
+
+
+def free_windows(day: datetime, busy: List[Interval], not_before: datetime) -> List[Tuple[datetime, datetime]]:
+    """
+    Свободные окна дня в рабочее время не короче MIN_SLOT_MINUTES и не раньше not_before.
+    busy - занятые интервалы этого дня по возрастанию начала.
+    """
+    cursor = max(day.replace(hour=WORK_HOURS_START), not_before)
+    work_end = day.replace(hour=WORK_HOURS_END)
+    free = []
+    for start, end, _ in busy:
+        gap_end = min(start, work_end)
+        if gap_end - cursor >= timedelta(minutes=MIN_SLOT_MINUTES):
+            free.append((cursor, gap_end))
+        cursor = max(cursor, end)
+    if work_end - cursor >= timedelta(minutes=MIN_SLOT_MINUTES):
+        free.append((cursor, work_end))
+    return free
+
+
+class _UserCalendar:
+    __slots__ = ("busy", "max_duration", "tasks", "version", "rendered")
+
+    def __init__(self):
+        self.busy: List[Interval] = []          # отсортировано по началу
+        self.max_duration = timedelta(0)        # самый длинный блок - граница поиска назад
+        self.tasks: List[TaskRecord] = []       # в порядке создания
+        self.version: Tuple[str, int] = ("", 0)  # (эпоха, версия данных) хранилища, из которых построен
+        self.rendered: Optional[Tuple[Tuple[str, int], datetime, str]] = None  # (версия, начало окна, текст)
+
+
+class FreeBusyIndex:
+    """
+    Индекс занятого времени и задач по пользователям. Строится из хранилища при первом
+    обращении и перестраивается, когда меняется версия данных пользователя в хранилище
+    (memory_store.data_version): так его устаревание видят любые записи - создание,
+    правка и удаление событий и задач.
+    """
+
+    def __init__(self):
+        self._users: Dict[int, _UserCalendar] = {}
+
+    def _interval(self, event: EventRecord) -> Interval:
+        # Время в хранилище - локальное время пользователя без tzinfo
+        return event.start_time, event.end_time, _short(event.title)
+
+    def _version(self, user_id: int) -> Tuple[str, int]:
+        return actions.memory_store.epoch, actions.memory_store.data_version(user_id)
+
+    def _load(self, user_id: int, version: Tuple[str, int]) -> _UserCalendar:
+        calendar = _UserCalendar()
+        calendar.version = version
+        # Раздел пользователя в хранилище уже отсортирован по началу
+        calendar.busy = [self._interval(event) for event in actions.memory_store.user_events(user_id)]
+        calendar.max_duration = max((end - start for start, end, _ in calendar.busy), default=timedelta(0))
+        calendar.tasks = actions.memory_store.user_tasks(user_id)
+        self._users[user_id] = calendar
+        return calendar
+
+    def get(self, user_id: int) -> _UserCalendar:
+        version = self._version(user_id)
+        calendar = self._users.get(user_id)
+        if calendar is None or calendar.version != version:
+            calendar = self._load(user_id, version)
+        return calendar
+
+    # --- Снимок для агента ---
+
+    def snapshot(self, user_id: int, now: Optional[datetime] = None) -> str:
+        """
+        Компактная сводка на CALENDAR_SNAPSHOT_DAYS дней вперед: занятые блоки,
+        свободные окна в рабочее время и последние задачи. Пустая строка, если
+        у пользователя нет ни событий в этом окне, ни задач.
+        """
+        calendar = self.get(user_id)
+        now = now or user_now(user_id)
+        window_start = now.replace(second=0, microsecond=0) - timedelta(minutes=now.minute % SNAPSHOT_BUCKET_MINUTES)
+        rendered = calendar.rendered
+        if rendered is not None and rendered[0] == calendar.version and rendered[1] == window_start:
+            CALENDAR_SNAPSHOT_REQUESTS.labels("hit").inc()
+            return rendered[2]
+        CALENDAR_SNAPSHOT_REQUESTS.labels("miss").inc()
+        text = self._render(calendar, window_start)
+        calendar.rendered = (calendar.version, window_start, text)
+        return text
+
+    def _render(self, calendar: _UserCalendar, window_start: datetime) -> str:
+        lines = []
+        has_busy = False
+        first_day = window_start.replace(hour=0, minute=0)
+        # Начинаем с событий, которые могли начаться раньше окна, но еще идут
+        index = bisect_left(calendar.busy, (window_start - calendar.max_duration,))
+        for offset in range(CALENDAR_SNAPSHOT_DAYS):
+            day = first_day + timedelta(days=offset)
+            day_end = day + timedelta(days=1)
+            busy = []
+            while index < len(calendar.busy) and calendar.busy[index][0] < day_end:
+                if calendar.busy[index][1] > window_start:
+                    busy.append(calendar.busy[index])
+                index += 1
+            has_busy = has_busy or bool(busy)
+            lines.append(self._render_day(day, busy, window_start))
+
+        tasks = calendar.tasks[-CALENDAR_SNAPSHOT_MAX_TASKS:]
+        if not has_busy and not tasks:
+            return ""
+        if tasks:
+            lines.append("задачи: " + "; ".join(self._render_task(task) for task in tasks))
+        header = f"[Календарь на {CALENDAR_SNAPSHOT_DAYS} дн., рабочее время {WORK_HOURS_START:02d}:00-{WORK_HOURS_END:02d}:00]"
+        return "\n".join([header] + lines)
+
+    def _render_day(self, day: datetime, busy: List[Interval], window_start: datetime) -> str:
+        parts = []
+        if busy:
+            shown = [f"{start:%H:%M}-{end:%H:%M} {title}" for start, end, title in busy[:CALENDAR_SNAPSHOT_MAX_BUSY]]
+            if len(busy) > CALENDAR_SNAPSHOT_MAX_BUSY:
+                shown.append(f"и еще {len(busy) - CALENDAR_SNAPSHOT_MAX_BUSY}")
+            parts.append("занято " + ", ".join(shown))
+
+        # Свободные окна - только в рабочее время и не раньше текущего момента
+        free = free_windows(day, busy, window_start)
+        parts.append("свободно " + ", ".join(f"{start:%H:%M}-{end:%H:%M}" for start, end in free) if free else "свободных окон нет")
+        return f"{WEEKDAYS_SHORT[day.weekday()]} {day:%d.%m}: " + "; ".join(parts)
+
+    def _render_task(self, task: TaskRecord) -> str:
+        details = []
+        if task.estimated_duration:
+            details.append(f"{task.estimated_duration / 60:g} ч")
+        if task.deadline:
+            details.append(f"до {task.deadline:%d.%m %H:%M}")
+        elif task.description:
+            details.append(_short(task.description))
+        title = _short(task.title or "")
+        return f"{title} ({', '.join(details)})" if details else title
+
+
+# Общий индекс процесса, перестраивается по версии данных хранилища
+calendar_index = FreeBusyIndex()
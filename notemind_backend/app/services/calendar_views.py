@@ -0,0 +1,107 @@
+import json
+import os
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
+from typing import Dict, Optional, Tuple
+
+from app.crud import actions
+from app.crud.memory_store import MemoryStore
+from app.database.models import EventResponse, TaskResponse
+from app.services.calendar_snapshot import free_windows
+from app.services.metrics import Counter
+
+# --- Представления календаря для фронтенда (повестка и занятость) ---
+CALENDAR_VIEW_MAX_DAYS = int(os.getenv("CALENDAR_VIEW_MAX_DAYS", "31"))
+# Сколько отрисованных ответов держать в памяти (ключ - пользователь, версия данных, окно)
+CALENDAR_VIEW_CACHE_SIZE = int(os.getenv("CALENDAR_VIEW_CACHE_SIZE", "2048"))
+
+VIEW_AGENDA = "agenda"
+VIEW_FREE_BUSY = "freebusy"
+
+# result: not_modified - 304 по ETag, hit - готовый ответ из кэша, miss - отрисовка
+CALENDAR_VIEW_REQUESTS = Counter("calendar_view_requests_total", "Запросы представлений календаря", ["view", "result"])
+
+# Задачи, которые показываются в повестке
+OPEN_TASK_STATUSES = ("pending", "in_progress")
+
+
+class RenderedView:
+    """Готовый ответ: JSON в байтах и его ETag."""
+    __slots__ = ("body", "etag")
+
+    def __init__(self, body: bytes, etag: str):
+        self.body = body
+        self.etag = etag
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Сравнение для If-None-Match: список тегов через запятую, слабые теги (W/) и "*"."""
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") == etag:
+            return True
+    return False
+
+
+class CalendarViews:
+    """
+    Повестка и занятость пользователя на окно дней. Ответ зависит только от данных
+    пользователя и окна, поэтому ETag строится из версии данных (растет на каждой записи
+    события или задачи) без чтения самих данных, а отрисованные ответы кэшируются по
+    (пользователь, версия, представление, окно). Эпоха хранилища в ETag отличает версии
+    до и после перезапуска.
+    """
+
+    def __init__(self, store: MemoryStore, cache_size: int = CALENDAR_VIEW_CACHE_SIZE):
+        self.store = store
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[Tuple, RenderedView]" = OrderedDict()
+
+    def etag(self, view: str, user_id: int, start: date, days: int) -> str:
+        version = self.store.data_version(user_id)
+        return f'"{self.store.epoch}-{user_id}-{version}-{view}-{start:%Y%m%d}-{days}"'
+
+    def render(self, view: str, user_id: int, start: date, days: int) -> RenderedView:
+        key = (user_id, self.store.data_version(user_id), view, start, days)
+        rendered = self._cache.get(key)
+        if rendered is not None:
+            self._cache.move_to_end(key)
+            CALENDAR_VIEW_REQUESTS.labels(view, "hit").inc()
+            return rendered
+        CALENDAR_VIEW_REQUESTS.labels(view, "miss").inc()
+        window_start = datetime.combine(start, datetime.min.time())
+        payload = (self._agenda if view == VIEW_AGENDA else self._free_busy)(user_id, window_start, days)
+        payload = {"user_id": user_id, "version": key[1], "start": start.isoformat(), "days": days, **payload}
+        body = json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode()
+        rendered = self._cache[key] = RenderedView(body, self.etag(view, user_id, start, days))
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return rendered
+
+    def _agenda(self, user_id: int, window_start: datetime, days: int) -> Dict:
+        events = self.store.overlapping_events(user_id, window_start, window_start + timedelta(days=days))
+        tasks = [task for task in self.store.user_tasks(user_id) if task.status in OPEN_TASK_STATUSES]
+        return {
+            "events": [EventResponse.model_validate(event).model_dump(mode="json") for event in events],
+            "tasks": [TaskResponse.model_validate(task).model_dump(mode="json") for task in tasks],
+        }
+
+    def _free_busy(self, user_id: int, window_start: datetime, days: int) -> Dict:
+        result = []
+        for offset in range(days):
+            day = window_start + timedelta(days=offset)
+            # Только время, без названий: занятость можно показывать другим людям
+            busy = [(event.start_time, event.end_time, "")
+                    for event in self.store.overlapping_events(user_id, day, day + timedelta(days=1))]
+            result.append({
+                "date": day.date().isoformat(),
+                "busy": [{"start": start.isoformat(), "end": end.isoformat()} for start, end, _ in busy],
+                "free": [{"start": start.isoformat(), "end": end.isoformat()}
+                         for start, end in free_windows(day, busy, day)],
+            })
+        return {"by_day": result}
+
+
+calendar_views = CalendarViews(actions.memory_store)
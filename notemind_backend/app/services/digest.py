@@ -0,0 +1,246 @@
+import asyncio
+import logging
+import os
+import time
+from dataclasses import dataclass, field
+from datetime import date, datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from app.crud import actions
+from app.database import shards
+from app.database.core import ReadSessionLocal
+from app.services.max_api import send_max_message
+from app.services.throttling import AsyncTokenBucket
+
+logger = logging.getLogger(__name__)
+
+# --- Настройки утренней рассылки ---
+DIGEST_BATCH_SIZE = int(os.getenv("DIGEST_BATCH_SIZE", "500"))        # пользователей на один пакет запросов
+DIGEST_SEND_CONCURRENCY = int(os.getenv("DIGEST_SEND_CONCURRENCY", "16"))
+DIGEST_SEND_RATE = float(os.getenv("DIGEST_SEND_RATE", "25"))        # сообщений в секунду (лимит API MAX)
+DIGEST_MAX_TASKS = int(os.getenv("DIGEST_MAX_TASKS", "5"))
+DIGEST_SKIP_EMPTY = os.getenv("DIGEST_SKIP_EMPTY", "1") == "1"        # не беспокоить пользователей с пустым днем
+
+# --- Шаблоны сообщения (без LLM) ---
+HEADER_TEMPLATE = "☀️ Доброе утро! Ваш план на {date}:"
+EVENTS_TITLE = "\n📅 События:"
+EVENT_TEMPLATE = "• {start}–{end} {title}{location}"
+NO_EVENTS = "\n📅 Событий на сегодня нет."
+TASKS_TITLE = "\n✅ Задачи ({count}):"
+TASK_TEMPLATE = "• {title}{deadline}"
+MORE_TASKS_TEMPLATE = "…и еще {count}"
+HEALTH_TITLE = "\n💤 Самочувствие за неделю:"
+SLEEP_TEMPLATE = "• Сон: в среднем {value:.1f}"
+ENERGY_TEMPLATE = "• Энергия: последняя оценка {value:.1f}"
+
+PRIORITY_ORDER = {"high": 0, "medium": 1, "low": 2}
+
+SendFunc = Callable[[str, str], Awaitable[bool]]
+
+
+@dataclass
+class UserDigest:
+    """Данные одного пользователя для утренней сводки."""
+    max_user_id: str
+    events: List[Any] = field(default_factory=list)
+    tasks: List[Any] = field(default_factory=list)
+    metrics: List[Any] = field(default_factory=list)
+
+    @property
+    def is_empty(self) -> bool:
+        return not (self.events or self.tasks or self.metrics)
+
+
+# --- 1. Загрузка данных пакетом ---
+
+async def load_digest_batch(db, users: List[Any], day: date) -> List[UserDigest]:
+    """
+    Загружает данные для пакета пользователей тремя запросами (вместо 3 * N).
+    """
+    user_ids = [user.id for user in users]
+    day_start = datetime.combine(day, datetime.min.time())
+    day_end = day_start + timedelta(days=1)
+
+    events = await actions.get_events_by_date_range_for_users(db, user_ids, day_start, day_end)
+    tasks = await actions.get_pending_tasks_for_users(db, user_ids)
+    metrics = await actions.get_recent_health_metrics_for_users(db, user_ids)
+
+    return [
+        UserDigest(
+            max_user_id=user.max_user_id,
+            events=events[user.id],
+            tasks=tasks[user.id],
+            metrics=metrics[user.id],
+        )
+        for user in users
+    ]
+
+
+# --- 2. Рендеринг ---
+
+def _average(values: List[float]) -> Optional[float]:
+    return sum(values) / len(values) if values else None
+
+def render_digest(digest: UserDigest, day: date) -> str:
+    """Собирает текст утренней сводки по шаблонам."""
+    lines = [HEADER_TEMPLATE.format(date=day.strftime("%d.%m.%Y"))]
+
+    if digest.events:
+        lines.append(EVENTS_TITLE)
+        for event in digest.events:
+            lines.append(EVENT_TEMPLATE.format(
+                start=event.start_time.strftime("%H:%M"),
+                end=event.end_time.strftime("%H:%M"),
+                title=event.title,
+                location=f" ({event.location})" if event.location else "",
+            ))
+    else:
+        lines.append(NO_EVENTS)
+
+    if digest.tasks:
+        # Сначала важные, затем с ближайшим дедлайном
+        tasks = sorted(
+            digest.tasks,
+            key=lambda t: (PRIORITY_ORDER.get(t.priority, 1), t.deadline is None, t.deadline or datetime.max),
+        )
+        lines.append(TASKS_TITLE.format(count=len(tasks)))
+        for task in tasks[:DIGEST_MAX_TASKS]:
+            lines.append(TASK_TEMPLATE.format(
+                title=task.title,
+                deadline=f" — до {task.deadline.strftime('%d.%m %H:%M')}" if task.deadline else "",
+            ))
+        if len(tasks) > DIGEST_MAX_TASKS:
+            lines.append(MORE_TASKS_TEMPLATE.format(count=len(tasks) - DIGEST_MAX_TASKS))
+
+    sleep = _average([m.value for m in digest.metrics if m.metric_type == "sleep"])
+    energy = [m.value for m in digest.metrics if m.metric_type == "energy"]
+    if sleep is not None or energy:
+        lines.append(HEALTH_TITLE)
+        if sleep is not None:
+            lines.append(SLEEP_TEMPLATE.format(value=sleep))
+        if energy:
+            # Метрики отсортированы по времени, последняя - самая свежая
+            lines.append(ENERGY_TEMPLATE.format(value=energy[-1]))
+
+    return "\n".join(lines)
+
+
+# --- 3. Отправка ---
+
+class RateLimitedSender:
+    """
+    Параллельная отправка сообщений с ограничением одновременных запросов
+    и общего темпа (сообщений в секунду).
+    """
+
+    def __init__(self, send: SendFunc = send_max_message, rate: float = DIGEST_SEND_RATE,
+                 concurrency: int = DIGEST_SEND_CONCURRENCY):
+        self._send = send
+        self._bucket = AsyncTokenBucket(rate)
+        self._semaphore = asyncio.Semaphore(concurrency)
+
+    async def _send_one(self, user_id: str, text: str) -> bool:
+        async with self._semaphore:
+            await self._bucket.acquire()
+            try:
+                return bool(await self._send(user_id, text))
+            except Exception as e:
+                logger.warning("DIGEST: ошибка отправки: %s", e, extra={"max_user_id": user_id})
+                return False
+
+    async def send_all(self, messages: List[Tuple[str, str]]) -> int:
+        """Отправляет все сообщения и возвращает количество успешных."""
+        results = await asyncio.gather(*(self._send_one(user_id, text) for user_id, text in messages))
+        return sum(results)
+
+
+# --- Конвейер ---
+
+async def run_morning_digest(
+    shard_index: int = 0,
+    shard_count: int = 1,
+    day: Optional[date] = None,
+    send: SendFunc = send_max_message,
+    session_factory=ReadSessionLocal,
+    batch_size: int = DIGEST_BATCH_SIZE,
+    send_rate: float = DIGEST_SEND_RATE,
+    send_concurrency: int = DIGEST_SEND_CONCURRENCY,
+    db_shard: Optional[int] = None,
+    sender: Optional[RateLimitedSender] = None,
+) -> Dict[str, Any]:
+    """
+    Рассылает утреннюю сводку всем пользователям шарда.
+    Пока отправляется пакет N, из БД уже загружается пакет N+1.
+    db_shard - шард БД, из которого читает session_factory: пользователи, принадлежащие
+    другому шарду (остатки прерванного переноса), пропускаются. sender - общий отправитель,
+    если рассылка идет по нескольким шардам сразу и лимит API MAX у них один.
+    """
+    day = day or date.today()
+    sender = sender or RateLimitedSender(send, send_rate, send_concurrency)
+    stats = {"users": 0, "sent": 0, "skipped": 0, "failed": 0}
+    started_at = time.perf_counter()
+    logger.info("DIGEST: старт рассылки за %s, шард %d/%d", day, shard_index, shard_count)
+
+    pending_send: Optional[asyncio.Task] = None
+    pending_count = 0
+    after_id = 0
+    while True:
+        # Короткая сессия на пакет: не держим транзакцию открытой всю рассылку.
+        # Рассылка только читает - запросы идут на реплику, если она настроена
+        async with session_factory() as db:
+            users = await actions.get_users_page(db, after_id, batch_size, shard_index, shard_count)
+            if not users:
+                break
+            after_id = users[-1].id
+            if db_shard is not None:
+                users = [user for user in users if shards.owns_user(db_shard, user.id)]
+            digests = await load_digest_batch(db, users, day)
+
+        messages = []
+        for digest in digests:
+            if DIGEST_SKIP_EMPTY and digest.is_empty:
+                stats["skipped"] += 1
+                continue
+            messages.append((digest.max_user_id, render_digest(digest, day)))
+        stats["users"] += len(users)
+
+        if pending_send:
+            sent = await pending_send
+            stats["sent"] += sent
+            stats["failed"] += pending_count - sent
+        pending_send = asyncio.create_task(sender.send_all(messages))
+        pending_count = len(messages)
+
+    if pending_send:
+        sent = await pending_send
+        stats["sent"] += sent
+        stats["failed"] += pending_count - sent
+
+    stats["seconds"] = time.perf_counter() - started_at
+    stats["users_per_second"] = stats["users"] / stats["seconds"] if stats["seconds"] else 0.0
+    logger.info("DIGEST: рассылка завершена", extra=stats)
+    return stats
+
+
+async def run_morning_digest_all_shards(
+    shard_index: int = 0,
+    shard_count: int = 1,
+    day: Optional[date] = None,
+    send: SendFunc = send_max_message,
+    send_rate: float = DIGEST_SEND_RATE,
+    send_concurrency: int = DIGEST_SEND_CONCURRENCY,
+    **kwargs: Any,
+) -> Dict[str, Any]:
+    """
+    Рассылка по всем шардам БД параллельно (shards.fan_out) с общим лимитом отправки.
+    shard_index/shard_count делят пользователей между воркерами, как в run_morning_digest.
+    """
+    sender = RateLimitedSender(send, send_rate, send_concurrency)
+    started_at = time.perf_counter()
+    results = await shards.fan_out(lambda db_shard, factory: run_morning_digest(
+        shard_index, shard_count, day=day, session_factory=factory, db_shard=db_shard, sender=sender, **kwargs
+    ))
+    stats = {key: sum(result[key] for result in results) for key in ("users", "sent", "skipped", "failed")}
+    stats["seconds"] = time.perf_counter() - started_at
+    stats["users_per_second"] = stats["users"] / stats["seconds"] if stats["seconds"] else 0.0
+    return stats
@@ -0,0 +1,186 @@
+import asyncio
+import logging
+import os
+import re
+from collections import OrderedDict
+from typing import Dict, List, Optional, Set, Tuple
+
+from app.crud.search_index import tokenize
+from app.services import maps
+from app.services.metrics import Counter
+
+logger = logging.getLogger(__name__)
+
+# --- Упреждающее геокодирование адресов из сообщения ---
+# Пока первый call_model решает, вызывать ли get_travel_time, адреса из текста уже
+# геокодируются в фоне, и инструмент берет готовые координаты из кэша хода.
+GEO_SPECULATION_ENABLED = os.getenv("GEO_SPECULATION_ENABLED", "1") == "1"
+# Не больше стольких адресов из одного сообщения (плюс домашний город)
+GEO_SPECULATION_MAX_ADDRESSES = int(os.getenv("GEO_SPECULATION_MAX_ADDRESSES", "2"))
+# Упреждающих запросов к геокодеру одновременно на весь процесс; сверх лимита догадки не запускаются
+GEO_SPECULATION_CONCURRENCY = int(os.getenv("GEO_SPECULATION_CONCURRENCY", "8"))
+# Упреждающий запрос дольше этого снимается (поток освобождается по ORS_HTTP_TIMEOUT_SECONDS)
+GEO_SPECULATION_TIMEOUT_SECONDS = float(os.getenv("GEO_SPECULATION_TIMEOUT_SECONDS", "5"))
+# Координаты найденных адресов в памяти процесса (адреса не переезжают)
+GEOCODE_CACHE_SIZE = int(os.getenv("GEOCODE_CACHE_SIZE", "1024"))
+
+# result: hit - инструмент взял упреждающий результат, miss - геокодировал сам,
+# wasted - догадка не пригодилась за ход, skipped - не запущена из-за лимита
+GEO_PREFETCH = Counter("geo_prefetch_total", "Упреждающее геокодирование адресов", ["result"])
+
+Coords = Tuple[float, float]
+
+# Слова-признаки адреса -> сокращение для запроса к геокодеру (в любой падежной форме)
+_MARKERS = {
+    "ул.": r"ул\.?|улиц[аеуы]|улицей",
+    "просп.": r"просп\.?|пр-т|проспект[аеу]?|проспектом",
+    "пер.": r"пер\.?|переул[оке]к?[аеу]?|переулком",
+    "бул.": r"б-р|бульвар[аеу]?|бульваром",
+    "ш.": r"ш\.|шоссе",
+    "пл.": r"пл\.?|площад[ьи]|площадью",
+    "наб.": r"наб\.?|набережн(?:ая|ой|ую)",
+    "проезд": r"проезд[аеу]?",
+    "метро": r"м\.|метро",
+}
+# Название с заглавной буквы или с номером ("1-я Тверская-Ямская"), до трех слов
+_NAME = r"(?:\d+-\w+|[А-ЯЁ][\w-]*)(?:\s+[А-ЯЁ][\w-]*){0,2}"
+_HOUSE = r"(?:,?\s*(?:д\.|дом)?\s*(\d+[а-яА-Я]?(?:/\d+)?)\b)?"
+# "на улице Баумана, 5", "м. Бауманская" и "на Тверской улице"
+_ADDRESS_PATTERNS = [
+    (canonical, re.compile(rf"(?<!\w)(?i:{marker})\s+({_NAME}){_HOUSE}"))
+    for canonical, marker in _MARKERS.items()
+] + [
+    (canonical, re.compile(rf"(?<!\w)([А-ЯЁ][\w-]+)\s+(?i:{marker})(?!\w){_HOUSE}"))
+    for canonical, marker in _MARKERS.items() if canonical != "метро"
+]
+# Признаки адреса в нормализованном ключе не участвуют: "ул. Баумана" и "улице Баумана" - один адрес
+_MARKER_TERMS = frozenset(tokenize(
+    "ул улица просп пр т проспект пер переулок б р бульвар ш шоссе пл площадь наб набережная проезд метро м д дом г город"
+))
+
+
+def extract_addresses(text: str) -> List[str]:
+    """
+    Похожие на адреса фрагменты сообщения в виде запроса к геокодеру ("ул Баумана 5").
+    Грубый разбор по словам-признакам: ошибка стоит один лишний запрос к геокодеру.
+    """
+    found: Dict[str, str] = {}
+    for canonical, pattern in _ADDRESS_PATTERNS:
+        for match in pattern.finditer(text):
+            name, house = match.group(1), match.group(2)
+            address = f"{canonical} {name}" + (f" {house}" if house else "")
+            found.setdefault(address_key(address), address)
+    return list(found.values())
+
+
+def address_key(address: str) -> str:
+    """
+    Ключ кэша: слова адреса без признаков ("ул", "дом"), домашнего города и окончаний.
+    Сам домашний город (ничего не осталось) - по всем словам.
+    """
+    terms = tokenize(address)
+    home_terms = tokenize(maps.DEFAULT_HOME_CITY)
+    street_terms = [term for term in terms if term not in _MARKER_TERMS and term not in home_terms]
+    return " ".join(street_terms or terms)
+
+
+_cache: "OrderedDict[str, Coords]" = OrderedDict()
+_in_flight = 0
+
+
+async def _geocode(address: str, bias_coords: Optional[Coords]) -> Optional[Coords]:
+    """Геокодирование в потоке (requests блокирует) с кэшем процесса для найденных адресов."""
+    key = address_key(address)
+    coords = _cache.get(key)
+    if coords is not None:
+        _cache.move_to_end(key)
+        return coords
+    coords = await asyncio.to_thread(maps.get_coords_by_address, address, bias_coords)
+    if coords is not None and key:
+        _cache[key] = coords
+        if len(_cache) > GEOCODE_CACHE_SIZE:
+            _cache.popitem(last=False)
+    return coords
+
+
+class GeoPrefetch:
+    """
+    Кэш геокодирования одного хода агента. speculate() запускает в фоне геокодирование
+    домашнего города и адресов из сообщения, geocode() сначала ждет уже запущенный запрос
+    по тому же адресу и только потом идет в геокодер сам. Упреждающие запросы ограничены
+    по времени, а незавершенные к концу хода (finish) отменяются, освобождая место в лимите.
+    """
+
+    def __init__(self, home_city: str = maps.DEFAULT_HOME_CITY):
+        self.home_city = home_city
+        self._results: Dict[str, asyncio.Future] = {}
+        self._speculative: Set[str] = set()
+        self._used: Set[str] = set()
+
+    def _start(self, key: str, coro) -> Optional[asyncio.Future]:
+        global _in_flight
+        if _in_flight >= GEO_SPECULATION_CONCURRENCY:
+            coro.close()
+            GEO_PREFETCH.labels("skipped").inc()
+            return None
+
+        async def run():
+            try:
+                return await asyncio.wait_for(coro, GEO_SPECULATION_TIMEOUT_SECONDS)
+            except asyncio.TimeoutError:
+                logger.debug("Упреждающее геокодирование: таймаут")
+                return None
+
+        def release(future: asyncio.Future) -> None:
+            global _in_flight
+            _in_flight -= 1
+            # Задача, отмененная до первого шага, не дошла до wait_for: coro так и не запущен
+            coro.close()
+
+        _in_flight += 1
+        future = self._results[key] = asyncio.ensure_future(run())
+        future.add_done_callback(release)
+        self._speculative.add(key)
+        return future
+
+    def speculate(self, text: str) -> int:
+        """Запускает геокодирование адресов из text. Возвращает, сколько адресов найдено."""
+        if not GEO_SPECULATION_ENABLED or not maps.ORS_API_KEY:
+            return 0
+        addresses = extract_addresses(text)[:GEO_SPECULATION_MAX_ADDRESSES]
+        if not addresses:
+            return 0
+        home_key = address_key(self.home_city)
+        home = self._results.get(home_key) or self._start(home_key, _geocode(self.home_city, None))
+
+        async def destination(address: str) -> Optional[Coords]:
+            # Как в get_travel_time: поиск с привязкой к домашнему городу
+            bias_coords = await asyncio.shield(home) if home is not None else None
+            return await _geocode(address, bias_coords)
+
+        for address in addresses:
+            key = address_key(address)
+            if key and key not in self._results:
+                self._start(key, destination(address))
+        logger.debug("Упреждающее геокодирование: %s", addresses)
+        return len(addresses)
+
+    async def geocode(self, address: str, bias_coords: Optional[Coords] = None) -> Optional[Coords]:
+        key = address_key(address)
+        future = self._results.get(key)
+        if future is None:
+            GEO_PREFETCH.labels("miss").inc()
+            future = self._results[key] = asyncio.ensure_future(_geocode(address, bias_coords))
+        elif key in self._speculative and key not in self._used:
+            GEO_PREFETCH.labels("hit").inc()
+        self._used.add(key)
+        return await asyncio.shield(future)
+
+    def finish(self) -> None:
+        """Конец хода: отменяет незавершенные запросы и учитывает догадки, которые не пригодились."""
+        for future in self._results.values():
+            if not future.done():
+                future.cancel()
+        wasted = len(self._speculative - self._used)
+        if wasted:
+            GEO_PREFETCH.labels("wasted").inc(wasted)
@@ -0,0 +1,112 @@
+import asyncio
+import os
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+# Окно, в течение которого подряд идущие сообщения пользователя склеиваются в один запуск агента
+AGENT_COALESCE_WINDOW_MS = int(os.getenv("AGENT_COALESCE_WINDOW_MS", "1500"))
+
+Handler = Callable[[str, int], Awaitable[Any]]
+
+
+@dataclass
+class InboxResult:
+    """Результат обработки сообщения через почтовый ящик пользователя."""
+    reply: Any
+    is_leader: bool              # True - именно этот вызов запускал агента
+    merged: int                  # сколько сообщений попало в запуск
+    error: Optional[BaseException] = None
+
+
+class _UserSlot:
+    __slots__ = ("lock", "texts", "batch", "waiters")
+
+    def __init__(self):
+        self.lock = asyncio.Lock()          # сериализует запуски агента для пользователя
+        self.texts: List[str] = []          # сообщения набирающейся пачки
+        self.batch: Optional[asyncio.Future] = None
+        self.waiters = 0
+
+
+class UserInbox:
+    """
+    Почтовый ящик на пользователя:
+    - запуски агента для одного пользователя идут строго по очереди;
+    - сообщения, пришедшие в пределах окна, объединяются в один запуск;
+    - разные пользователи обрабатываются параллельно.
+    """
+
+    def __init__(self, handler: Handler, window_seconds: float = AGENT_COALESCE_WINDOW_MS / 1000):
+        self._handler = handler
+        self._window = window_seconds
+        self._slots: Dict[int, _UserSlot] = {}
+
+    async def submit(self, user_id: int, text: str, coalesce: bool = True,
+                     handler: Optional[Handler] = None,
+                     on_lead: Optional[Callable[[], Any]] = None) -> InboxResult:
+        """
+        Ставит сообщение в очередь пользователя и ждет ответа агента.
+        Вызов, открывший пачку, становится лидером и выполняет агента; остальные
+        участники пачки получают тот же ответ с is_leader=False.
+        При coalesce=False сообщение обрабатывается отдельно (но все равно по очереди).
+        handler заменяет обработчик по умолчанию, если этот вызов станет лидером.
+        on_lead вызывается лидером сразу, до окна склейки и ожидания предыдущего хода
+        (например, чтобы подтвердить прием, не дожидаясь их).
+        """
+        slot = self._slots.get(user_id)
+        if slot is None:
+            slot = self._slots[user_id] = _UserSlot()
+        slot.waiters += 1
+        try:
+            if coalesce and slot.batch is not None:
+                return await self._join(slot, text)
+            if on_lead is not None:
+                on_lead()
+            return await self._lead(slot, user_id, text, coalesce, handler or self._handler)
+        finally:
+            slot.waiters -= 1
+            if slot.waiters == 0 and self._slots.get(user_id) is slot:
+                del self._slots[user_id]
+
+    async def _join(self, slot: _UserSlot, text: str) -> InboxResult:
+        slot.texts.append(text)
+        batch = slot.batch
+        try:
+            # shield: отмена одного участника не должна отменять общий запуск
+            reply, merged = await asyncio.shield(batch)
+        except asyncio.CancelledError as e:
+            if not batch.cancelled():
+                raise
+            # Отменили лидера, а не нас
+            return InboxResult(reply=None, is_leader=False, merged=0, error=e)
+        except Exception as e:
+            return InboxResult(reply=None, is_leader=False, merged=0, error=e)
+        return InboxResult(reply=reply, is_leader=False, merged=merged)
+
+    async def _lead(self, slot: _UserSlot, user_id: int, text: str, coalesce: bool,
+                    handler: Handler) -> InboxResult:
+        batch = asyncio.get_running_loop().create_future()
+        # Исключение лидера увидят участники; если их нет, не шумим в логах
+        batch.add_done_callback(lambda f: f.cancelled() or f.exception())
+        texts = [text]
+        try:
+            if coalesce:
+                slot.texts.append(text)
+                slot.batch = batch
+                if self._window > 0:
+                    await asyncio.sleep(self._window)
+            async with slot.lock:
+                if coalesce:
+                    # Забираем все, что накопилось, в том числе пока ждали предыдущий запуск
+                    texts, slot.texts, slot.batch = slot.texts, [], None
+                reply = await handler("\n".join(texts), user_id)
+        except BaseException as e:
+            if slot.batch is batch:
+                slot.texts, slot.batch = [], None
+            if isinstance(e, asyncio.CancelledError):
+                batch.cancel()
+            elif not batch.done():
+                batch.set_exception(e)
+            raise
+        batch.set_result((reply, len(texts)))
+        return InboxResult(reply=reply, is_leader=True, merged=len(texts))
@@ -0,0 +1,239 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from enum import IntEnum
+from typing import Any, List, Optional, Tuple
+
+from app.services.metrics import Counter, Gauge, Histogram
+from app.services.throttling import AsyncTokenBucket
+
+logger = logging.getLogger(__name__)
+
+# --- Настройки шлюза к GigaChat ---
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))          # одновременных запросов к модели
+LLM_RATE_PER_SECOND = float(os.getenv("LLM_RATE_PER_SECOND", "5"))        # новых запросов в секунду
+LLM_RATE_BURST = float(os.getenv("LLM_RATE_BURST", "10"))                 # допустимый всплеск
+LLM_MAX_QUEUE = int(os.getenv("LLM_MAX_QUEUE", "100"))                    # ожидающих в очереди, дальше - отказ
+LLM_DEFAULT_TIMEOUT_SECONDS = float(os.getenv("LLM_DEFAULT_TIMEOUT_SECONDS", "60"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))                  # повторов на ответ 429
+LLM_RETRY_BASE_DELAY = float(os.getenv("LLM_RETRY_BASE_DELAY", "0.5"))    # секунды, растет экспоненциально
+
+
+class Priority(IntEnum):
+    """Приоритет запроса к модели: меньше - важнее."""
+    INTERACTIVE = 0  # живой пользователь ждет ответа (webhook, /api/v1/process)
+    BACKGROUND = 1   # фоновые и пакетные задачи
+
+
+# --- Исключения ---
+
+class LLMGatewayError(Exception):
+    """Базовая ошибка шлюза: запрос к модели не был выполнен."""
+
+
+class LLMOverloadedError(LLMGatewayError):
+    """Очередь к модели переполнена - запрос отклонен сразу."""
+
+
+class LLMDeadlineExceededError(LLMGatewayError):
+    """Запрос не успевает выполниться до дедлайна."""
+
+
+class LLMRateLimitedError(LLMGatewayError):
+    """Провайдер продолжает отвечать 429 после всех повторов."""
+
+
+# --- Метрики ---
+LLM_QUEUE_WAIT = Histogram("llm_queue_wait_seconds", "Время ожидания слота к LLM", ["priority"])
+LLM_CALL_LATENCY = Histogram("llm_call_seconds", "Длительность запроса к LLM", ["priority"])
+LLM_REJECTED = Counter("llm_rejected_total", "Запросы к LLM, отклоненные шлюзом", ["reason"])
+LLM_RETRIES = Counter("llm_retries_total", "Повторы запросов к LLM после 429")
+LLM_IN_FLIGHT = Gauge("llm_in_flight", "Запросы к LLM в работе")
+LLM_QUEUED = Gauge("llm_queued", "Запросы к LLM в очереди")
+
+# --- Контекст запроса: приоритет и дедлайн текущего хода ---
+_priority: ContextVar[Priority] = ContextVar("llm_priority", default=Priority.INTERACTIVE)
+_deadline: ContextVar[Optional[float]] = ContextVar("llm_deadline", default=None)
+
+
+@contextmanager
+def llm_request_context(priority: Optional[Priority] = None, timeout: Optional[float] = None):
+    """
+    Задает приоритет и дедлайн (в секундах от текущего момента) для всех
+    запросов к модели внутри блока. Незаданные значения наследуются.
+    """
+    deadline = time.monotonic() + timeout if timeout is not None else _deadline.get()
+    priority_token = _priority.set(priority if priority is not None else _priority.get())
+    deadline_token = _deadline.set(deadline)
+    try:
+        yield
+    finally:
+        _priority.reset(priority_token)
+        _deadline.reset(deadline_token)
+
+
+def _is_gigachat_response_error(error: Exception) -> bool:
+    # Импорт здесь: к моменту ошибки клиент GigaChat уже загружен, а старт сервера не платит за пакет
+    from gigachat.exceptions import ResponseError
+    return isinstance(error, ResponseError)
+
+
+def _is_rate_limited(error: Exception) -> bool:
+    if _is_gigachat_response_error(error) and len(error.args) > 1:
+        return error.args[1] == 429
+    return getattr(error, "status_code", None) == 429
+
+
+def _retry_after(error: Exception) -> Optional[float]:
+    headers = error.args[3] if _is_gigachat_response_error(error) and len(error.args) > 3 else None
+    try:
+        return float(headers.get("retry-after")) if headers else None
+    except (TypeError, ValueError):
+        return None
+
+
+class LLMGateway:
+    """
+    Шлюз перед клиентом GigaChat:
+    - ограничивает число одновременных запросов и их темп (token bucket);
+    - держит очередь с приоритетом: интерактивные ходы раньше фоновых;
+    - сразу отклоняет запросы, которые не успеют к дедлайну или не влезают в очередь;
+    - повторяет запрос с экспоненциальной задержкой на 429.
+    """
+
+    def __init__(self, max_concurrency: int = LLM_MAX_CONCURRENCY, rate: float = LLM_RATE_PER_SECOND,
+                 burst: float = LLM_RATE_BURST, max_queue: int = LLM_MAX_QUEUE,
+                 max_retries: int = LLM_MAX_RETRIES, retry_base_delay: float = LLM_RETRY_BASE_DELAY):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.max_retries = max_retries
+        self.retry_base_delay = retry_base_delay
+        self._bucket = AsyncTokenBucket(rate, burst)
+        self._active = 0
+        self._queued = 0
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+        # Скользящая оценка длительности запроса - для прогноза ожидания
+        self._avg_call_seconds = 2.0
+
+    # --- Допуск ---
+
+    def _queue_ahead(self, priority: Priority) -> int:
+        return sum(1 for p, _, f in self._waiters if p <= priority and not f.done())
+
+    def _estimated_wait(self, priority: Priority) -> float:
+        if self._active < self.max_concurrency and not self._queued:
+            return 0.0
+        rounds = self._queue_ahead(priority) // self.max_concurrency + 1
+        return rounds * self._avg_call_seconds
+
+    async def _acquire(self, priority: Priority, deadline: Optional[float]) -> None:
+        if self._active < self.max_concurrency and not self._queued:
+            self._active += 1
+            return
+        if self._queued >= self.max_queue:
+            LLM_REJECTED.labels("queue_full").inc()
+            raise LLMOverloadedError("Очередь к LLM переполнена")
+
+        timeout = None
+        if deadline is not None:
+            timeout = deadline - time.monotonic()
+            # Не встаем в очередь, если заведомо не успеем получить ответ
+            if timeout <= self._estimated_wait(priority) + self._avg_call_seconds:
+                LLM_REJECTED.labels("deadline").inc()
+                raise LLMDeadlineExceededError("Запрос к LLM не успеет выполниться до дедлайна")
+
+        waiter = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (int(priority), next(self._seq), waiter))
+        self._queued += 1
+        LLM_QUEUED.inc()
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), timeout)
+        except BaseException as e:
+            if waiter.done() and not waiter.cancelled():
+                # Слот уже передали нам - возвращаем его следующему
+                self._release()
+            else:
+                waiter.cancel()
+                self._queued -= 1
+                LLM_QUEUED.dec()
+            if isinstance(e, asyncio.TimeoutError):
+                LLM_REJECTED.labels("deadline").inc()
+                raise LLMDeadlineExceededError("Истек дедлайн ожидания в очереди к LLM") from None
+            raise
+
+    def _release(self) -> None:
+        while self._waiters:
+            _, _, waiter = heapq.heappop(self._waiters)
+            if not waiter.done():
+                # Передаем слот напрямую: счетчик активных не меняется
+                self._queued -= 1
+                LLM_QUEUED.dec()
+                waiter.set_result(None)
+                return
+        self._active -= 1
+
+    # --- Вызов модели ---
+
+    async def ainvoke(self, runnable: Any, messages: Any, **kwargs) -> Any:
+        """Выполняет runnable.ainvoke(messages) с учетом лимитов, приоритета и дедлайна."""
+        priority = _priority.get()
+        deadline = _deadline.get()
+        if deadline is None:
+            deadline = time.monotonic() + LLM_DEFAULT_TIMEOUT_SECONDS
+        label = priority.name.lower()
+
+        queued_at = time.monotonic()
+        await self._acquire(priority, deadline)
+        LLM_IN_FLIGHT.inc()
+        try:
+            # Темп: если токен появится уже после дедлайна, отказываем сразу
+            if self._bucket.time_until_available() > deadline - time.monotonic():
+                LLM_REJECTED.labels("rate").inc()
+                raise LLMDeadlineExceededError("Лимит частоты запросов к LLM не позволяет успеть до дедлайна")
+            await self._bucket.acquire()
+            LLM_QUEUE_WAIT.labels(label).observe(time.monotonic() - queued_at)
+            return await self._call_with_retries(runnable, messages, deadline, label, **kwargs)
+        finally:
+            LLM_IN_FLIGHT.dec()
+            self._release()
+
+    async def _call_with_retries(self, runnable: Any, messages: Any, deadline: float, label: str, **kwargs) -> Any:
+        attempt = 0
+        while True:
+            started_at = time.monotonic()
+            try:
+                result = await asyncio.wait_for(runnable.ainvoke(messages, **kwargs), deadline - started_at)
+            except asyncio.TimeoutError:
+                LLM_REJECTED.labels("deadline").inc()
+                raise LLMDeadlineExceededError("Истек дедлайн запроса к LLM") from None
+            except Exception as e:
+                if not _is_rate_limited(e):
+                    raise
+                if attempt >= self.max_retries:
+                    LLM_REJECTED.labels("provider_429").inc()
+                    raise LLMRateLimitedError("GigaChat ограничивает частоту запросов") from e
+                delay = _retry_after(e) or self.retry_base_delay * (2 ** attempt) * (1 + random.random())
+                if time.monotonic() + delay >= deadline:
+                    LLM_REJECTED.labels("provider_429").inc()
+                    raise LLMRateLimitedError("GigaChat ограничивает частоту запросов") from e
+                attempt += 1
+                LLM_RETRIES.inc()
+                logger.info("LLM ответил 429, повтор %d/%d через %.2f с", attempt, self.max_retries, delay)
+                await asyncio.sleep(delay)
+                continue
+
+            elapsed = time.monotonic() - started_at
+            self._avg_call_seconds = 0.8 * self._avg_call_seconds + 0.2 * elapsed
+            LLM_CALL_LATENCY.labels(label).observe(elapsed)
+            return result
+
+
+# Общий шлюз процесса
+llm_gateway = LLMGateway()
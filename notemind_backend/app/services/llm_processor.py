@@ -1,197 +1,259 @@
 import asyncio
+import importlib
+import logging
+import math
 import os
-from typing import List, TypedDict, Annotated, Dict
-import operator
-from datetime import datetime
+import re
+import time
+from typing import Any, AsyncIterator, List, Optional, Dict
 
-from langchain_gigachat import GigaChat
-from langchain_core.messages import HumanMessage, BaseMessage, ToolMessage, SystemMessage
-from langchain.tools import tool
-from langgraph.graph import StateGraph, END
+from app.services.calendar_snapshot import CALENDAR_SNAPSHOT_ENABLED, calendar_index
+from app.services.inbox import UserInbox
+from app.services.metrics import Counter
+from app.services.prompts import PROMPT_VERSION, with_turn_context
+from app.services.turn_context import (
+    EVENT_ACK, EVENT_FINAL, EVENT_RESET, EVENT_TOKEN, EVENT_TOOL, TurnBudget,
+)
 
-from app.crud import actions
-from app.services.ai_planner import plan_task
-from app.services import maps
+logger = logging.getLogger(__name__)
 
 # --- Загрузка конфигурации ---
 GIGACHAT_CREDENTIALS = os.getenv("GIGACHAT_CREDENTIALS")
-if not GIGACHAT_CREDENTIALS:
-    raise ValueError("GIGACHAT_CREDENTIALS не найден в .env файле!")
-
-# --- Системный промпт для агента ---
-SYSTEM_PROMPT = f"""Ты — умный ассистент-планировщик Notemind. Твоя задача — помочь пользователю организовать его жизнь.
-Текущая дата: {datetime.now().strftime('%Y-%m-%d')}.
-
-Твоя главная цель — извлечь из сообщения пользователя ВСЕ возможные сущности (события, задачи, метрики здоровья) и вызвать для каждой из них соответствующий инструмент.
-
-**Порядок действий:**
-1.  **Полный анализ:** Внимательно прочти все сообщение. Найди в нем все упоминания событий, задач и состояний здоровья.
-2.  **Параллельный вызов инструментов:** Для КАЖДОЙ найденной сущности вызови соответствующий инструмент. Ты можешь и должен вызывать несколько инструментов за один раз, если в сообщении несколько разных действий.
-    *   `create_event`: для событий с точным временем.
-    *   `create_task`: для задач, которые нужно сделать.
-    *   `log_health_metric`: для записей о самочувствии.
-    *   `get_travel_time`: **ОСОБЫЙ СЛУЧАЙ**. Если в событии есть адрес, но не указано место отправления, твоим ПЕРВЫМ действием ДОЛЖЕН быть вызов `get_travel_time`. После получения ответа от пользователя с уточнением адреса, ты сможешь создать событие.
-3.  **Итоговый отчет:** После того, как все инструменты отработают, составь единый, краткий и дружелюбный отчет для пользователя. Например: "Готово! Добавил событие 'Созвон' на завтра в 10:00, задачу 'Сделать лабу' и отметил, что вы плохо спали." Не нужно спрашивать "Все верно?". Просто констатируй факт.
-
-**Помощь пользователю:**
-- Если пользователь прямо спрашивает "что ты умеешь?", "помощь" или "help", твоя задача — предоставить краткую инструкцию.
-- В инструкции опиши свои три основные функции: создание событий, создание задач и запись о самочувствии.
-- Приведи примеры фраз для каждой функции:
-    - **Событие:** "Завтра в 11 встреча с инвестором"
-    - **Задача:** "Нужно не забыть купить молоко" или "сделать презентацию (2 часа)"
-    - **Самочувствие:** "Сегодня я чувствую себя отлично" или "плохо спал"
-"""
-
-# --- Состояние графа (AgentState) ---
-class AgentState(TypedDict):
-    messages: Annotated[List[BaseMessage], operator.add]
-    user_id: int
-
-# --- Инструменты (Tools) ---
-# ВНИМАНИЕ: Это функции-заглушки.
-
-@tool
-async def create_event(user_id: int, title: str, start_time: str) -> str:
-    """Создает событие с фиксированным временем в календаре. Не используй этот инструмент для сохранения адреса."""
-    print(f"--- ИНСТРУМЕНТ: create_event для user_id={user_id} ---")
-    await actions.save_event(user_id, title, start_time, location=None) # Location теперь всегда None
-    return f"Событие '{title}' на {start_time} успешно сохранено."
-
-@tool
-async def create_task(user_id: int, title: str, duration_hours: float = None, deadline: str = None) -> str:
-    """
-    Создает задачу. Если указана длительность, пытается автоматически запланировать ее в календаре.
-    """
-    print(f"--- ИНСТРУМЕНТ: create_task для user_id={user_id} ---")
-    
-    # 1. Сохраняем саму задачу
-    task = await actions.save_task(user_id, title, duration_hours, deadline)
-    
-    # 2. Если есть длительность, пытаемся ее запланировать
-    if duration_hours:
-        print(f"    -> У задачи есть длительность, запускаем планировщик...")
-        planned_event = await plan_task(task, user_id)
-        
-        if planned_event:
-            planned_time = datetime.fromisoformat(planned_event['start_time']).strftime('%d %B в %H:%M')
-            return f"Задача '{title}' создана и автоматически запланирована на {planned_time}."
-        else:
-            return f"Задача '{title}' создана, но найти свободный слот для планирования не удалось."
-            
-    return f"Задача '{title}' успешно создана (без времени в календаре)."
-
-@tool
-async def log_health_metric(user_id: int, metric: str, value: str) -> str:
-    """Записывает метрику о самочувствии пользователя."""
-    print(f"--- ИНСТРУМЕНТ: log_health_metric для user_id={user_id} ---")
-    await actions.save_health_metric(user_id, metric, value)
-    return f"Запись о самочувствии '{metric}: {value}' сохранена."
-
-@tool
-async def get_travel_time(origin_address: str, destination_address: str) -> str:
-    """
-    Рассчитывает время в пути между двумя адресами.
-    """
-    print(f"--- ИНСТРУМЕНТ: get_travel_time ---")
-
-    # --- Имитация получения профиля пользователя ---
-    # В реальном приложении этот город нужно будет брать из базы данных
-    user_home_city = "Москва" 
-    print(f"    Имитация профиля: домашний город пользователя - {user_home_city}")
-    # -----------------------------------------
-
-    # В реальном приложении 'дом' нужно заменять на реальный адрес из профиля пользователя
-    if origin_address.lower() in ["дом", "из дома", "от дома"]:
-        origin_address = user_home_city 
-
-    # Получаем координаты домашнего города для более точного поиска
-    bias_coords = maps.get_coords_by_address(user_home_city)
-
-    # Ищем адрес назначения с привязкой к домашнему городу
-    destination_coords = maps.get_coords_by_address(destination_address, bias_coords=bias_coords)
-    if not destination_coords:
-        return f"Не удалось найти координаты для адреса назначения: {destination_address}"
-
-    # Ищем адрес отправления (он может быть не из домашнего города, поэтому без привязки)
-    origin_coords = maps.get_coords_by_address(origin_address)
-    if not origin_coords:
-        return f"Не удалось найти координаты для адреса отправления: {origin_address}"
-
-    time_minutes = maps.get_travel_time(origin_coords, destination_coords)
-    
-    return f"Расчетное время в пути от '{origin_address}' до '{destination_address}' составляет {time_minutes} минут."
-
-
-# ... Другие инструменты, такие как get_travel_time и schedule_task, могут быть добавлены позже
-tools = [create_event, create_task, log_health_metric, get_travel_time]
-
-# --- Настройка LLM ---
-llm = GigaChat(credentials=GIGACHAT_CREDENTIALS, verify_ssl_certs=False, scope="GIGACHAT_API_PERS")
-llm_with_tools = llm.bind_tools(tools)
-
-# --- Узлы графа (Nodes) ---
-async def call_model(state: AgentState):
-    print("--- УЗЕЛ: call_model ---")
-    response = await llm_with_tools.ainvoke(state["messages"])
-    return {"messages": [response]}
-
-async def call_tools_node(state: AgentState):
-    print("--- УЗЕЛ: call_tools_node ---")
-    tool_messages = []
-    for tool_call in state["messages"][-1].tool_calls:
-        tool_name = tool_call["name"]
-        tool_input = tool_call["args"]
-        tool_input["user_id"] = state["user_id"] # Внедряем user_id
-        print(f"Вызов: {tool_name} с {tool_input}")
-        selected_tool = next((t for t in tools if t.name == tool_name), None)
-        if selected_tool:
-            message = await selected_tool.ainvoke(tool_input)
-            tool_messages.append(ToolMessage(tool_call_id=tool_call["id"], content=str(message)))
-    return {"messages": tool_messages}
-
-def should_continue(state: AgentState):
-    print("--- УЗЕЛ: should_continue ---")
-    return "tools" if state["messages"][-1].tool_calls else END
 
 # --- Управление состоянием диалогов ---
 # Простое in-memory хранилище для истории чатов.
 # Ключ - user_id, значение - список сообщений.
-chat_histories: Dict[int, List[BaseMessage]] = {}
+chat_histories: Dict[int, List["BaseMessage"]] = {}
+
+
+# --- Кэш ответов модели ---
+# Вопросы вида "что ты умеешь" / "помощь" гоняют через GigaChat весь промпт ради
+# одного и того же ответа. Кэшируются ТОЛЬКО такие запросы справки первым сообщением
+# диалога и без вызовов инструментов: любой другой ответ может зависеть от истории,
+# даты или данных пользователя, и повторять его другим нельзя.
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "1") == "1"
+LLM_CACHE_TTL_SECONDS = float(os.getenv("LLM_CACHE_TTL_SECONDS", "3600"))
+LLM_CACHE_MAX_PROMPT_CHARS = int(os.getenv("LLM_CACHE_MAX_PROMPT_CHARS", "200"))  # длинные сообщения - не справка
+LLM_CACHE_SEMANTIC = os.getenv("LLM_CACHE_SEMANTIC", "0") == "1"                  # распознавать справку по эмбеддингам
+LLM_CACHE_SIMILARITY = float(os.getenv("LLM_CACHE_SIMILARITY", "0.92"))
+
+LLM_CACHE_REQUESTS = Counter("llm_cache_requests_total", "Обращения к кэшу ответов LLM", ["tier", "result"])
+LLM_CACHE_SAVED_SECONDS = Counter("llm_cache_saved_seconds_total", "Время LLM, сэкономленное попаданиями в кэш")
+
+_NON_WORD = re.compile(r"[^\w\s]+")
+_SPACES = re.compile(r"\s+")
+
+# Запросы справки (после normalize_prompt): ответ на них задан системным промптом.
+# Они же - образцы для распознавания пересказов по эмбеддингам
+HELP_REQUESTS = frozenset({
+    "что ты умеешь", "что ты можешь", "что умеешь", "помощь", "помоги", "справка",
+    "как пользоваться", "как тобой пользоваться", "help", "start",
+})
+
+
+def normalize_prompt(text: str) -> str:
+    """Приводит сообщение к канонической форме: регистр, ё, пунктуация, пробелы."""
+    text = _NON_WORD.sub(" ", text.lower().replace("ё", "е"))
+    return _SPACES.sub(" ", text).strip()
+
+
+def _unit(vector: List[float]) -> List[float]:
+    norm = math.sqrt(sum(x * x for x in vector)) or 1.0
+    return [x / norm for x in vector]
 
 
-# --- Построение графа ---
-workflow = StateGraph(AgentState)
-workflow.add_node("agent", call_model)
-workflow.add_node("tools", call_tools_node)
-workflow.set_entry_point("agent")
-workflow.add_conditional_edges("agent", should_continue)
-workflow.add_edge("tools", "agent")
-app_graph = workflow.compile()
+class _CacheEntry:
+    __slots__ = ("reply", "expires_at", "saved_seconds")
 
-# --- Функция для запуска агента ---
-async def run_agent_async(user_input: str, user_id: int):
+    def __init__(self, reply: str, expires_at: float, saved_seconds: float):
+        self.reply = reply
+        self.expires_at = expires_at
+        self.saved_seconds = saved_seconds
+
+
+class ResponseCache:
     """
-    Запускает LLM-агента с поддержкой истории сообщений.
+    Кэш ответа на запрос справки. Справка распознается в два уровня:
+    - точный: нормализованный текст совпадает с одним из HELP_REQUESTS;
+    - опциональный по смыслу: эмбеддинг сообщения близок к эмбеддингу одного из
+      HELP_REQUESTS ("а что ты вообще умеешь делать?").
+    Все распознанные запросы делят один ответ: он живет TTL секунд, смена системного
+    промпта его сбрасывает.
     """
+
+    def __init__(self, ttl_seconds: float = LLM_CACHE_TTL_SECONDS, embedder=None,
+                 similarity_threshold: float = LLM_CACHE_SIMILARITY):
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self._embedder = embedder
+        self._exemplars: Optional[List[List[float]]] = None
+        self._entries: Dict[str, _CacheEntry] = {}
+
+    @staticmethod
+    def _key() -> str:
+        # Смена системного промпта автоматически инвалидирует старый ответ
+        return f"{PROMPT_VERSION}:help"
+
+    async def _is_similar(self, normalized: str) -> bool:
+        try:
+            if self._exemplars is None:
+                vectors = await self._embedder.aembed_documents(sorted(HELP_REQUESTS))
+                self._exemplars = [_unit(vector) for vector in vectors]
+            vector = _unit(await self._embedder.aembed_query(normalized))
+        except Exception as e:
+            logger.warning("Кэш LLM: не удалось получить эмбеддинг: %s", e)
+            return False
+        return any(sum(a * b for a, b in zip(vector, exemplar)) >= self.similarity_threshold
+                   for exemplar in self._exemplars)
+
+    async def help_tier(self, prompt: str) -> Optional[str]:
+        """Уровень, на котором сообщение распознано как запрос справки ("exact", "semantic"), или None."""
+        normalized = normalize_prompt(prompt)
+        if not normalized or len(normalized) > LLM_CACHE_MAX_PROMPT_CHARS:
+            return None
+        if normalized in HELP_REQUESTS:
+            return "exact"
+        if self._embedder is not None and await self._is_similar(normalized):
+            return "semantic"
+        return None
+
+    def lookup(self, tier: str) -> Optional[str]:
+        """Закэшированный ответ на справку или None."""
+        entry = self._entries.get(self._key())
+        if entry is None or entry.expires_at < time.monotonic():
+            LLM_CACHE_REQUESTS.labels(tier, "miss").inc()
+            return None
+        LLM_CACHE_REQUESTS.labels(tier, "hit").inc()
+        LLM_CACHE_SAVED_SECONDS.inc(entry.saved_seconds)
+        logger.debug("Кэш LLM: попадание (%s)", tier)
+        return entry.reply
+
+    def store(self, reply: str, elapsed_seconds: float) -> None:
+        """Сохраняет ответ на справку. Вызывать только для ходов без вызовов инструментов."""
+        if reply:
+            self._entries = {self._key(): _CacheEntry(reply, time.monotonic() + self.ttl_seconds, elapsed_seconds)}
+
+
+def _build_response_cache() -> Optional[ResponseCache]:
+    if not LLM_CACHE_ENABLED:
+        return None
+    embedder = None
+    if LLM_CACHE_SEMANTIC:
+        from langchain_gigachat import GigaChatEmbeddings
+        embedder = GigaChatEmbeddings(credentials=GIGACHAT_CREDENTIALS, verify_ssl_certs=False, scope="GIGACHAT_API_PERS")
+    return ResponseCache(embedder=embedder)
+
+
+response_cache = _build_response_cache()
+
+
+# --- Ленивая загрузка агента ---
+# Граф, клиент GigaChat и инструменты тянут за собой langchain/langgraph;
+# они загружаются при первом обращении (или прогреве), а не при старте сервера.
+_agent = None
+_agent_lock = asyncio.Lock()
+
+
+async def get_agent():
+    """Возвращает модуль графа агента, при первом вызове загружая его в отдельном потоке."""
+    global _agent
+    if _agent is None:
+        async with _agent_lock:
+            if _agent is None:
+                started_at = time.perf_counter()
+                _agent = await asyncio.to_thread(importlib.import_module, "app.services.agent_graph")
+                logger.info("АГЕНТ: граф и клиент GigaChat загружены за %.2f с", time.perf_counter() - started_at)
+    return _agent
+
+
+# --- Функции для запуска агента ---
+
+_STREAM_END = object()
+
+async def run_agent_stream(user_input: str, user_id: int, budget: TurnBudget = None,
+                           stream_tokens: bool = True) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Запускает LLM-агента и отдает ход по мере выполнения: подтверждение приема,
+    результаты инструментов, фрагменты итогового ответа и сам итоговый ответ.
+    Ход ограничен бюджетом (шаги графа, время, вызовы инструментов): при его
+    исчерпании незавершенные вызовы отменяются, а пользователь получает
+    частичный ответ со списком уже сохраненного.
+    """
+    agent = await get_agent()
+
     # 1. Получаем историю сообщений для данного пользователя
-    # Если истории нет, создаем новую с системным промптом
-    messages = chat_histories.get(user_id, [SystemMessage(content=SYSTEM_PROMPT)])
-    
-    # 2. Добавляем новое сообщение от пользователя в историю
-    messages.append(HumanMessage(content=user_input))
-    
-    # 3. Вызываем графа с полной историей сообщений
-    final_state = await app_graph.ainvoke({
-        "messages": messages,
-        "user_id": user_id,
-    })
-    
-    # 4. Получаем последнее сообщение (ответ агента)
-    response_message = final_state["messages"][-1]
-    
+    # Если истории нет, создаем новую с общим для всех системным промптом
+    messages = chat_histories.get(user_id)
+    if messages is None:
+        messages = [agent.SYSTEM_MESSAGE]
+    # Из кэша - только справка первым сообщением: ответ не зависит ни от истории, ни от данных
+    help_tier = None
+    if response_cache is not None and len(messages) == 1:
+        help_tier = await response_cache.help_tier(user_input)
+
+    # 2. Добавляем новое сообщение от пользователя в историю вместе с контекстом хода
+    # (дата, время, часовой пояс). История только дописывается, поэтому префикс
+    # диалога от хода к ходу не меняется и переиспользуется кэшем промптов GigaChat
+    turn_text = with_turn_context(user_input, user_id)
+    messages.append(agent.HumanMessage(content=turn_text))
+
+    # Снимок календаря (занято/свободно, задачи) видит только текущий ход: в историю
+    # он не попадает, чтобы не копить устаревшие копии расписания
+    snapshot = calendar_index.snapshot(user_id) if CALENDAR_SNAPSHOT_ENABLED else ""
+    prompt = messages
+    if snapshot:
+        prompt = messages[:-1] + [agent.HumanMessage(content=f"{snapshot}\n{turn_text}")]
+
+    # Повторяющиеся запросы справки отвечаем из кэша
+    if help_tier is not None:
+        cached_reply = response_cache.lookup(help_tier)
+        if cached_reply is not None:
+            messages.append(agent.AIMessage(content=cached_reply))
+            chat_histories[user_id] = messages
+            yield {"type": EVENT_FINAL, "text": cached_reply}
+            return
+
+    yield {"type": EVENT_ACK}
+
+    # 3. Вызываем граф с полной историей сообщений
+    events: asyncio.Queue = asyncio.Queue()
+    producer = asyncio.create_task(agent.produce_turn(prompt, user_id, budget, stream_tokens, events, user_input))
+    producer.add_done_callback(lambda _: events.put_nowait(_STREAM_END))
+    try:
+        while (event := await events.get()) is not _STREAM_END:
+            yield event
+        # 4. Получаем последнее сообщение (ответ агента); исключения хода поднимаются здесь
+        response_message, cacheable, elapsed = producer.result()
+    finally:
+        # Читатель ушел (например, клиент закрыл соединение) - останавливаем ход
+        if not producer.done():
+            producer.cancel()
+
+    if cacheable and help_tier is not None:
+        response_cache.store(response_message.content, elapsed)
+
     # 5. Обновляем историю, добавляя и сообщение пользователя, и ответ агента
     # Мы уже добавили HumanMessage, теперь добавим ответ
-    chat_histories[user_id] = messages + [response_message]
+    messages.append(response_message)
+    chat_histories[user_id] = messages
+
+    # 6. Отдаем текст ответа
+    yield {"type": EVENT_FINAL, "text": response_message.content}
+
+
+async def run_agent_async(user_input: str, user_id: int, budget: TurnBudget = None):
+    """
+    Запускает LLM-агента с поддержкой истории сообщений и возвращает только итоговый ответ.
+    """
+    reply = None
+    async for event in run_agent_stream(user_input, user_id, budget, stream_tokens=False):
+        if event["type"] == EVENT_FINAL:
+            reply = event["text"]
+    return reply
+
 
-    # 6. Возвращаем только текст ответа
-    return response_message.content
\ No newline at end of file
+# --- Очередь сообщений на пользователя ---
+# Все входы (webhook, API) идут через один ящик: запуски агента для одного
+# пользователя не пересекаются на chat_histories[user_id], а серия коротких
+# сообщений подряд обрабатывается одним вызовом LLM.
+agent_inbox = UserInbox(run_agent_async)
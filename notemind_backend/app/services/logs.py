@@ -0,0 +1,159 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import time
+from functools import lru_cache
+from typing import Dict, Optional
+
+from app.services.metrics import Counter
+from app.services.tracing import current_request_id
+
+# --- Настройки логирования ---
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# Уровни отдельных логгеров: "app.crud=WARNING,app.services.agent_graph=DEBUG"
+LOG_LEVELS = os.getenv("LOG_LEVELS", "")
+# json - по записи JSON на строку (прод), text - читаемые строки (локальная разработка)
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+# Доля DEBUG-записей, которые пишутся: по умолчанию все, в нагрузке - например 0.01.
+# Можно задать по логгерам: "0.1" или "app.crud=0.01,app.services.agent_graph=0.1"
+LOG_DEBUG_SAMPLE = os.getenv("LOG_DEBUG_SAMPLE", "1")
+# Длинные сообщения и поля (тела запросов, ответы модели) обрезаются до этой длины
+LOG_MAX_FIELD_CHARS = int(os.getenv("LOG_MAX_FIELD_CHARS", "500"))
+# Очередь записей между кодом и потоком вывода; при переполнении записи отбрасываются
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+
+LOG_RECORDS_DROPPED = Counter("log_records_dropped_total", "Записи лога, отброшенные из-за переполненной очереди")
+
+# Стандартные атрибуты LogRecord: все остальное пришло через extra= и пишется отдельными полями
+_RECORD_ATTRS = frozenset(vars(logging.makeLogRecord({}))) | {"message", "asctime", "request_id"}
+
+
+def _truncate(text: str) -> str:
+    if len(text) <= LOG_MAX_FIELD_CHARS:
+        return text
+    return f"{text[:LOG_MAX_FIELD_CHARS]}… (+{len(text) - LOG_MAX_FIELD_CHARS} симв.)"
+
+
+def _parse_mapping(spec: str) -> Dict[str, str]:
+    """Разбирает "логгер=значение,логгер=значение" (без "логгер=" - значение для всех)."""
+    mapping = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        name, _, value = item.rpartition("=")
+        mapping[name.strip()] = value.strip()
+    return mapping
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна запись - одна строка JSON: время, уровень, логгер, сообщение, request_id и поля из extra."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        payload = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": _truncate(record.getMessage()),
+        }
+        if getattr(record, "request_id", None):
+            payload["request_id"] = record.request_id
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS:
+                payload[key] = value if isinstance(value, (int, float, bool, type(None))) else _truncate(str(value))
+        if record.exc_info:
+            payload["exc"] = self.formatException(record.exc_info)
+        return json.dumps(payload, ensure_ascii=False)
+
+
+class TextFormatter(logging.Formatter):
+    """Читаемый формат для локальной разработки, с теми же обрезкой и полями."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        fields = " ".join(
+            f"{key}={_truncate(str(value))}" for key, value in record.__dict__.items() if key not in _RECORD_ATTRS
+        )
+        request_id = getattr(record, "request_id", None)
+        line = (f"{time.strftime('%H:%M:%S', time.localtime(record.created))}.{int(record.msecs):03d} "
+                f"{record.levelname:<7} {record.name}"
+                f"{f' [{request_id}]' if request_id else ''}: {_truncate(record.getMessage())}"
+                f"{f' | {fields}' if fields else ''}")
+        if record.exc_info:
+            line += "\n" + self.formatException(record.exc_info)
+        return line
+
+
+class DebugSampler(logging.Filter):
+    """Пропускает только долю DEBUG-записей; доля задается по префиксу имени логгера."""
+
+    def __init__(self, spec: str):
+        super().__init__()
+        self._rates = {name: float(value) for name, value in _parse_mapping(spec).items()}
+        self._rate = lru_cache(maxsize=256)(self._lookup)
+
+    def _lookup(self, name: str) -> float:
+        # Ближайший предок с заданной долей: "app.crud.actions" -> "app.crud" -> "app" -> ""
+        while True:
+            if name in self._rates:
+                return self._rates[name]
+            if not name:
+                return 1.0
+            name = name.rpartition(".")[0]
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.DEBUG:
+            return True
+        rate = self._rate(record.name)
+        return rate >= 1.0 or random.random() < rate
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Кладет запись в очередь и сразу возвращается: форматирование и запись в stdout
+    выполняет поток QueueListener. В вызывающем коде фиксируются только текст сообщения
+    (msg % args: аргументы могут измениться, пока запись ждет в очереди) и request_id
+    (он в contextvar и в другом потоке недоступен). Переполненная очередь не
+    блокирует event loop - запись отбрасывается и учитывается в метрике.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Как QueueHandler.prepare, но exc_info остается: трассировку оформляет форматтер вывода
+        record.msg = record.getMessage()
+        record.args = None
+        record.request_id = current_request_id()
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_RECORDS_DROPPED.inc()
+
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def setup_logging() -> None:
+    """Настраивает корневой логгер: очередь -> поток вывода -> stdout. Повторный вызов ничего не делает."""
+    global _listener
+    if _listener is not None:
+        return
+
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(TextFormatter() if LOG_FORMAT == "text" else JsonFormatter())
+
+    handler = NonBlockingQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+    handler.addFilter(DebugSampler(LOG_DEBUG_SAMPLE))
+
+    root = logging.getLogger()
+    root.handlers = [handler]
+    root.setLevel(LOG_LEVEL)
+    for name, level in _parse_mapping(LOG_LEVELS).items():
+        logging.getLogger(name).setLevel(level.upper())
+
+    _listener = logging.handlers.QueueListener(handler.queue, output, respect_handler_level=True)
+    _listener.start()
+    # При выходе дописываем то, что осталось в очереди
+    atexit.register(_listener.stop)
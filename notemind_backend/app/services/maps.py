@@ -1,28 +1,49 @@
+import logging
 import os
 import requests
-import openrouteservice
 from dotenv import load_dotenv
 # Импорты для работы со временем (для Участника 2)
 from datetime import datetime, timedelta
 
+from app.services.tracing import MAPS_LATENCY, traced
+
+logger = logging.getLogger(__name__)
+
 load_dotenv()
 ORS_API_KEY = os.getenv("ORS_API_KEY")
 
+# Базовый адрес ORS (переопределяется для локальных прогонов)
+ORS_BASE_URL = os.getenv("ORS_BASE_URL", "https://api.openrouteservice.org")
+
+# Таймаут HTTP-запросов к ORS: зависший запрос не должен держать поток и ход агента
+ORS_HTTP_TIMEOUT_SECONDS = float(os.getenv("ORS_HTTP_TIMEOUT_SECONDS", "10"))
+
+# Город пользователя по умолчанию: "дом" в маршрутах и привязка поиска адресов
+DEFAULT_HOME_CITY = "Москва"
+
 # URL API ORS Geocoding
-ORS_GEOCODE_URL = "https://api.openrouteservice.org/geocode/search"
+ORS_GEOCODE_URL = f"{ORS_BASE_URL}/geocode/search"
 
-# Инициализация клиента ORS (используется для Directions API)
+# Клиент ORS (используется для Directions API) создается при первом запросе маршрута
 client_ors = None
-if ORS_API_KEY:
-    try:
-        client_ors = openrouteservice.Client(key=ORS_API_KEY)
-    except Exception as e:
-        print(f"Error initializing ORS client: {e}. Check your ORS_API_KEY.")
-        
+
+def get_ors_client():
+    """Лениво создает клиент ORS: пакет openrouteservice не грузится при старте сервера."""
+    global client_ors
+    if client_ors is None and ORS_API_KEY:
+        try:
+            import openrouteservice
+            client_ors = openrouteservice.Client(key=ORS_API_KEY, base_url=ORS_BASE_URL,
+                                                 timeout=ORS_HTTP_TIMEOUT_SECONDS)
+        except Exception as e:
+            logger.error("ORS: не удалось создать клиент (проверьте ORS_API_KEY): %s", e)
+    return client_ors
+
 # ------------------------------------------------------------
 # 1. API ГЕОКОДЕРА (ORS) - АДРЕС -> КООРДИНАТЫ 
 # ------------------------------------------------------------
 
+@traced(MAPS_LATENCY, "geocode", stage="maps:geocode")
 def get_coords_by_address(address: str, bias_coords: tuple[float, float] = None) -> tuple[float, float] | None:
     """
     Преобразует адрес в координаты (долгота, широта), используя ORS Geocoding HTTP API.
@@ -32,11 +53,11 @@ def get_coords_by_address(address: str, bias_coords: tuple[float, float] = None)
     """
     # Не отправляем запрос, если адрес пустой
     if not address or not address.strip():
-        print("ORS Geocoder: Address is empty, skipping API call.")
+        logger.debug("ORS Geocoder: пустой адрес, запрос не отправляется")
         return None
 
     if not ORS_API_KEY:
-        print("ERROR: ORS API key not found.")
+        logger.error("ORS: не задан ORS_API_KEY")
         return None
         
     headers = {
@@ -52,41 +73,42 @@ def get_coords_by_address(address: str, bias_coords: tuple[float, float] = None)
     if bias_coords:
         params['focus.point.lon'] = bias_coords[0]
         params['focus.point.lat'] = bias_coords[1]
-        print(f"    Using focus point bias: {bias_coords}")
 
     try:
-        response = requests.get(ORS_GEOCODE_URL, headers=headers, params=params)
+        response = requests.get(ORS_GEOCODE_URL, headers=headers, params=params, timeout=ORS_HTTP_TIMEOUT_SECONDS)
         response.raise_for_status()
         data = response.json()
         
         if not data.get('features'):
-            print(f"ORS Geocoder: No results found for address: {address}")
+            logger.info("ORS Geocoder: адрес не найден: %s", address)
             return None
             
         long, lat = data['features'][0]['geometry']['coordinates']
         
-        print(f"ORS Geocoder success: {address} -> ({long}, {lat})")
+        logger.debug("ORS Geocoder: %s -> (%s, %s)", address, long, lat, extra={"bias": bias_coords})
         return long, lat 
 
     except Exception as e:
-        print(f"Error calling ORS Geocoder API via HTTP: {e}")
+        logger.warning("ORS Geocoder: ошибка запроса: %s", e)
         return None
 
 # ------------------------------------------------------------
 # 2. API МАРШРУТИЗАЦИИ (ORS) - КООРДИНАТЫ -> ВРЕМЯ
 # ------------------------------------------------------------
 
+@traced(MAPS_LATENCY, "directions", stage="maps:directions")
 def get_travel_time(origin_coords: tuple[float, float], destination_coords: tuple[float, float]) -> int:
     """
     Возвращает время в пути в минутах, используя ORS Directions API.
     Координаты должны быть (долгота, широта).
     """
-    if not client_ors:
-        print("WARNING: ORS client not available. Returning 45 minutes fallback.")
+    client = get_ors_client()
+    if not client:
+        logger.warning("ORS: клиент недоступен, время в пути по умолчанию - 45 минут")
         return 45
         
     try:
-        route = client_ors.directions(
+        route = client.directions(
             coordinates=[origin_coords, destination_coords],
             profile='driving-car'
         )
@@ -94,11 +116,11 @@ def get_travel_time(origin_coords: tuple[float, float], destination_coords: tupl
         duration_seconds = route['routes'][0]['summary']['duration']
         time_minutes = round(duration_seconds / 60)
         
-        print(f"ORS Directions success: Travel time is {time_minutes} minutes.")
+        logger.debug("ORS Directions: время в пути %d мин", time_minutes)
         return time_minutes
 
     except Exception as e:
-        print(f"Error calling ORS Directions API: {e}. Returning fallback time.")
+        logger.warning("ORS Directions: ошибка запроса, время в пути по умолчанию: %s", e)
         return 45 
 
 # ------------------------------------------------------------
@@ -0,0 +1,92 @@
+import logging
+import os
+from typing import Optional
+
+import httpx
+from dotenv import load_dotenv
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+MAX_BOT_TOKEN = os.getenv("MAX_BOT_TOKEN")
+# Адрес переопределяется для локальных прогонов (например, фейковым сервером в нагрузочном тесте)
+MAX_API_URL = os.getenv("MAX_MESSAGES_URL", "https://platform-api.max.ru/messages")
+MAX_HTTP_TIMEOUT_SECONDS = float(os.getenv("MAX_HTTP_TIMEOUT_SECONDS", "10"))
+
+# Один клиент на процесс: переиспользуем соединения (keep-alive) между отправками
+_client: Optional[httpx.AsyncClient] = None
+
+
+def get_client() -> httpx.AsyncClient:
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(timeout=MAX_HTTP_TIMEOUT_SECONDS)
+    return _client
+
+
+async def _post_message(user_id: str, text: str) -> Optional[dict]:
+    """Отправляет сообщение и возвращает ответ API MAX (или None при ошибке)."""
+    if not MAX_BOT_TOKEN:
+        logger.error("MAX: не задан MAX_BOT_TOKEN, сообщение не отправлено")
+        return None
+
+    # АУТЕНТИФИКАЦИЯ: токен передается как query-параметр 'access_token'
+    # АДРЕСАТ: user_id также передается как query-параметр
+    params = {
+        "user_id": user_id,
+        "access_token": MAX_BOT_TOKEN
+    }
+
+    # ТЕЛО ЗАПРОСА: текст и обязательные пустые поля
+    json_body = {
+        "text": text,
+        "attachments": None,
+        "link": None
+    }
+
+    try:
+        response = await get_client().post(MAX_API_URL, params=params, json=json_body)
+        response.raise_for_status()
+        logger.debug("MAX: отправлено: %s", text, extra={"max_user_id": user_id})
+        return response.json() if response.content else {}
+    except Exception as e:
+        logger.warning("MAX: ошибка отправки сообщения: %s", e, extra={"max_user_id": user_id})
+        return None
+
+
+async def send_max_message(user_id: str, text: str) -> bool:
+    """Отправляет сообщение пользователю через API MAX. Возвращает True при успехе."""
+    return await _post_message(user_id, text) is not None
+
+
+async def send_max_message_get_id(user_id: str, text: str) -> Optional[str]:
+    """Отправляет сообщение и возвращает его идентификатор (mid) для последующего редактирования."""
+    result = await _post_message(user_id, text)
+    if not result:
+        return None
+    return (result.get("message") or {}).get("body", {}).get("mid")
+
+
+async def edit_max_message(message_id: str, text: str) -> bool:
+    """Заменяет текст ранее отправленного сообщения."""
+    if not MAX_BOT_TOKEN:
+        logger.error("MAX: не задан MAX_BOT_TOKEN, сообщение не изменено")
+        return False
+
+    params = {
+        "message_id": message_id,
+        "access_token": MAX_BOT_TOKEN
+    }
+    json_body = {
+        "text": text,
+        "attachments": None,
+        "link": None
+    }
+
+    try:
+        response = await get_client().put(MAX_API_URL, params=params, json=json_body)
+        response.raise_for_status()
+        return True
+    except Exception as e:
+        logger.warning("MAX: ошибка редактирования сообщения: %s", e, extra={"message_id": message_id})
+        return False
@@ -0,0 +1,86 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional, Sequence
+
+from app.services import slot_solver
+from app.services.metrics import Counter
+
+logger = logging.getLogger(__name__)
+
+# --- Пул процессов для CPU-работы планировщика ---
+# Сколько процессов-воркеров; 0 - всегда решать в процессе сервера (как раньше)
+PLANNER_POOL_WORKERS = int(os.getenv("PLANNER_POOL_WORKERS", "2"))
+# Календари не больше этого числа занятых интервалов решаются на месте:
+# сериализация и передача в воркер стоят дороже самого поиска
+PLANNER_INLINE_MAX_INTERVALS = int(os.getenv("PLANNER_INLINE_MAX_INTERVALS", "200"))
+# spawn: воркеры не наследуют потоки и соединения сервера (fork после их запуска небезопасен)
+PLANNER_POOL_START_METHOD = os.getenv("PLANNER_POOL_START_METHOD", "spawn")
+
+# path: inline - на месте, pool - в воркере, fallback - на месте после сбоя пула
+PLANNER_SOLVES = Counter("planner_solves_total", "Поиски слота планировщиком", ["path"])
+
+
+class PlannerPool:
+    """
+    Выносит поиск слота из event loop в пул процессов. Запрос передается в компактном
+    виде (массив минут, см. app.services.slot_solver), результат возвращается в корутину.
+    Пул создается при первом обращении или в warm_up(); если воркер упал, пул
+    пересоздается, а текущий запрос решается на месте.
+    """
+
+    def __init__(self, workers: int = PLANNER_POOL_WORKERS, inline_max_intervals: int = PLANNER_INLINE_MAX_INTERVALS,
+                 start_method: str = PLANNER_POOL_START_METHOD):
+        self.workers = workers
+        self.inline_max_intervals = inline_max_intervals
+        self.start_method = start_method
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context(self.start_method),
+                initializer=slot_solver.warm_up,
+            )
+        return self._executor
+
+    async def warm_up(self) -> None:
+        """Запускает все воркеры заранее, чтобы первый запрос не ждал старта процесса."""
+        if self.workers <= 0:
+            return
+        loop = asyncio.get_running_loop()
+        executor = self._get_executor()
+        await asyncio.gather(*(loop.run_in_executor(executor, slot_solver.warm_up) for _ in range(self.workers)))
+        logger.info("Пул планировщика запущен", extra={"workers": self.workers})
+
+    async def find_slot(self, busy: Sequence[int], start: int, duration: int, horizon: int,
+                        work_start: int, work_end: int, gap: int) -> int:
+        """Асинхронная обертка над slot_solver.find_slot с теми же аргументами."""
+        args = (busy, start, duration, horizon, work_start, work_end, gap)
+        if self.workers <= 0 or len(busy) // 2 <= self.inline_max_intervals:
+            PLANNER_SOLVES.labels("inline").inc()
+            return slot_solver.find_slot(*args)
+        executor = self._get_executor()
+        try:
+            result = await asyncio.get_running_loop().run_in_executor(executor, slot_solver.find_slot, *args)
+        except BrokenProcessPool:
+            logger.error("Пул планировщика сломан, пересоздаем; запрос решается на месте")
+            if self._executor is executor:
+                self._executor = None
+                executor.shutdown(wait=False, cancel_futures=True)
+            PLANNER_SOLVES.labels("fallback").inc()
+            return slot_solver.find_slot(*args)
+        PLANNER_SOLVES.labels("pool").inc()
+        return result
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+planner_pool = PlannerPool()
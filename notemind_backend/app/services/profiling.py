@@ -0,0 +1,166 @@
+import asyncio
+import hmac
+import itertools
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Dict, Optional
+
+from app.services.tracing import RequestTrace, current_trace
+
+logger = logging.getLogger(__name__)
+
+# --- Профилирование отдельных запросов (по умолчанию выключено) ---
+# Запрос с заголовком X-Profile: <PROFILE_TOKEN> профилируется; без токена заголовок игнорируется
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN", "")
+# Дополнительно профилировать каждый N-й запрос (0 - нет)
+PROFILE_SAMPLE_EVERY = int(os.getenv("PROFILE_SAMPLE_EVERY", "0"))
+# Какие пути профилируются (по префиксу)
+PROFILE_PATHS = tuple(filter(None, os.getenv("PROFILE_PATHS", "/api/v1/process,/webhook").split(",")))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "./profiles")
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+
+PROFILE_HEADER = b"x-profile"
+PROFILE_ID_HEADER = b"x-profile-id"
+
+# Верхние кадры, по которым видно, что event loop простаивает в ожидании ввода-вывода
+_IDLE_FUNCTIONS = frozenset({"select", "poll", "epoll", "kqueue", "_poll"})
+
+
+def profiling_enabled() -> bool:
+    return bool(PROFILE_TOKEN) or PROFILE_SAMPLE_EVERY > 0
+
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    return f"{getattr(code, 'co_qualname', code.co_name)} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class StackSampler:
+    """
+    Семплирующий профайлер потока event loop: отдельный поток раз в interval секунд
+    снимает стек через sys._current_frames() и считает одинаковые стеки. Результат -
+    свернутые стеки (формат flamegraph.pl / speedscope / inferno): "a;b;c 42".
+    Семплируется весь поток, так что в профиль попадают и параллельные запросы.
+    """
+
+    def __init__(self, thread_id: int, interval: float):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self.idle_samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            if frame.f_code.co_name in _IDLE_FUNCTIONS:
+                self.idle_samples += 1
+            names = []
+            while frame is not None:
+                names.append(_frame_name(frame))
+                frame = frame.f_back
+            self.stacks[";".join(reversed(names))] += 1
+            self.samples += 1
+
+    def start(self) -> "StackSampler":
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def folded(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+def _stage_totals(trace: RequestTrace) -> Dict[str, Dict[str, float]]:
+    totals: Dict[str, Dict[str, float]] = {}
+    for stage, elapsed in trace.stages:
+        entry = totals.setdefault(stage, {"seconds": 0.0, "count": 0})
+        entry["seconds"] = round(entry["seconds"] + elapsed, 6)
+        entry["count"] += 1
+    return dict(sorted(totals.items(), key=lambda item: item[1]["seconds"], reverse=True))
+
+
+def _write_profile(path: str, sampler: StackSampler, report: dict) -> None:
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    with open(f"{path}.folded", "w", encoding="utf-8") as folded:
+        folded.write(sampler.folded())
+    with open(f"{path}.json", "w", encoding="utf-8") as summary:
+        json.dump(report, summary, ensure_ascii=False, indent=2)
+
+
+class ProfilingMiddleware:
+    """
+    ASGI-middleware профилирования по запросу. Должна стоять внутри RequestMetricsMiddleware,
+    чтобы видеть трассу запроса. Одновременно профилируется один запрос: остальные в это
+    время проходят как обычно. Добавляется в приложение, только если профилирование включено.
+    Результат - два файла в PROFILE_DIR: <id>.folded (стеки для flamegraph) и <id>.json
+    (время запроса, время по этапам и узлам графа, доля времени, когда event loop был занят).
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._counter = itertools.count(1)
+        self._busy = False
+
+    def _wants_profile(self, scope) -> bool:
+        if scope["type"] != "http" or not scope["path"].startswith(PROFILE_PATHS):
+            return False
+        if PROFILE_TOKEN:
+            for name, value in scope.get("headers", ()):
+                if name == PROFILE_HEADER:
+                    return hmac.compare_digest(value.decode("latin-1"), PROFILE_TOKEN)
+        return PROFILE_SAMPLE_EVERY > 0 and next(self._counter) % PROFILE_SAMPLE_EVERY == 0
+
+    async def __call__(self, scope, receive, send):
+        if self._busy or not self._wants_profile(scope):
+            await self.app(scope, receive, send)
+            return
+
+        trace = current_trace()
+        profile_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{trace.request_id if trace else next(self._counter)}"
+
+        async def send_with_profile_id(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + [(PROFILE_ID_HEADER, profile_id.encode())]
+            await send(message)
+
+        self._busy = True
+        sampler = StackSampler(threading.get_ident(), PROFILE_INTERVAL_MS / 1000).start()
+        started_at = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_profile_id)
+        finally:
+            elapsed = time.perf_counter() - started_at
+            sampler.stop()
+            self._busy = False
+            report = {
+                "request_id": trace.request_id if trace else None,
+                "method": scope["method"],
+                "path": scope["path"],
+                "seconds": round(elapsed, 6),
+                "samples": sampler.samples,
+                "interval_ms": PROFILE_INTERVAL_MS,
+                # Доля семплов, когда loop выполнял код, а не ждал ввода-вывода
+                "loop_busy_share": round(1 - sampler.idle_samples / sampler.samples, 3) if sampler.samples else None,
+                "db_queries": trace.db_queries if trace else None,
+                "db_seconds": round(trace.db_seconds, 6) if trace else None,
+                "stages": _stage_totals(trace) if trace else {},
+            }
+            path = os.path.join(PROFILE_DIR, profile_id)
+            try:
+                await asyncio.to_thread(_write_profile, path, sampler, report)
+                logger.info("Профиль запроса записан: %s.folded", path, extra={"seconds": report["seconds"]})
+            except OSError as e:
+                logger.warning("Не удалось записать профиль запроса: %s", e)
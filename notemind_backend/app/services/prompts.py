@@ -0,0 +1,109 @@
+import hashlib
+import json
+import os
+import time
+from datetime import datetime, timezone
+from functools import lru_cache
+from typing import Dict, Optional, Tuple
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+# Часовой пояс для пользователей, которые его не указали
+DEFAULT_USER_TIMEZONE = os.getenv("DEFAULT_USER_TIMEZONE", "Europe/Moscow")
+
+# --- Системный промпт для агента ---
+# Промпт статичен: он одинаков для всех пользователей и всех ходов, поэтому один
+# экземпляр сообщения разделяется всеми историями, а префикс диалога кэшируется
+# на стороне GigaChat. Все, что меняется от хода к ходу (дата, время, часовой пояс),
+# передается в блоке [Контекст] в начале сообщения пользователя.
+SYSTEM_PROMPT = """Ты — умный ассистент-планировщик Notemind. Твоя задача — помочь пользователю организовать его жизнь.
+Текущие дата, время и часовой пояс пользователя указаны в блоке [Контекст] в начале каждого его сообщения. Относительные даты ("завтра", "в пятницу") считай от них.
+Если перед сообщением есть блок [Календарь], в нем занятое время, свободные окна и задачи пользователя на ближайшие дни: используй его, чтобы сразу выбрать время без пересечений и ответить на вопросы о расписании, не вызывая лишних инструментов.
+
+Твоя главная цель — извлечь из сообщения пользователя ВСЕ возможные сущности (события, задачи, метрики здоровья) и вызвать для каждой из них соответствующий инструмент.
+
+**Порядок действий:**
+1.  **Полный анализ:** Внимательно прочти все сообщение. Найди в нем все упоминания событий, задач и состояний здоровья.
+2.  **Параллельный вызов инструментов:** Для КАЖДОЙ найденной сущности вызови соответствующий инструмент. Ты можешь и должен вызывать несколько инструментов за один раз, если в сообщении несколько разных действий.
+    *   `create_event`: для событий с точным временем.
+    *   `create_task`: для задач, которые нужно сделать.
+    *   `log_health_metric`: для записей о самочувствии.
+    *   `find_items`: чтобы найти уже сохраненные события и задачи по словам ("когда встреча с инвестором", "что с лабой"), если их нет в блоке [Календарь].
+    *   `get_travel_time`: **ОСОБЫЙ СЛУЧАЙ**. Если в событии есть адрес, но не указано место отправления, твоим ПЕРВЫМ действием ДОЛЖЕН быть вызов `get_travel_time`. После получения ответа от пользователя с уточнением адреса, ты сможешь создать событие.
+3.  **Итоговый отчет:** После того, как все инструменты отработают, составь единый, краткий и дружелюбный отчет для пользователя. Например: "Готово! Добавил событие 'Созвон' на завтра в 10:00, задачу 'Сделать лабу' и отметил, что вы плохо спали." Не нужно спрашивать "Все верно?". Просто констатируй факт.
+
+**Помощь пользователю:**
+- Если пользователь прямо спрашивает "что ты умеешь?", "помощь" или "help", твоя задача — предоставить краткую инструкцию.
+- В инструкции опиши свои три основные функции: создание событий, создание задач и запись о самочувствии.
+- Приведи примеры фраз для каждой функции:
+    - **Событие:** "Завтра в 11 встреча с инвестором"
+    - **Задача:** "Нужно не забыть купить молоко" или "сделать презентацию (2 часа)"
+    - **Самочувствие:** "Сегодня я чувствую себя отлично" или "плохо спал"
+"""
+
+# Версия промпта: входит в ключ кэша ответов
+PROMPT_VERSION = hashlib.sha1(SYSTEM_PROMPT.encode("utf-8")).hexdigest()[:12]
+
+WEEKDAYS = ("понедельник", "вторник", "среда", "четверг", "пятница", "суббота", "воскресенье")
+
+# Часовые пояса пользователей (user_id -> имя зоны IANA), известные по их настройкам
+user_timezones: Dict[int, str] = {}
+
+
+@lru_cache(maxsize=128)
+def _zone(name: str) -> Optional[ZoneInfo]:
+    try:
+        return ZoneInfo(name)
+    except (ZoneInfoNotFoundError, ValueError):
+        return None
+
+
+def remember_user_timezone(user_id: int, preferences: Optional[str]) -> None:
+    """Запоминает часовой пояс из настроек пользователя (JSON-строка с ключом "timezone")."""
+    if not preferences:
+        return
+    try:
+        name = json.loads(preferences).get("timezone")
+    except (ValueError, AttributeError):
+        return
+    if name and _zone(name) is not None:
+        user_timezones[user_id] = name
+
+
+def user_zone(user_id: int):
+    """Часовой пояс пользователя (по умолчанию DEFAULT_USER_TIMEZONE, при ошибке в имени - UTC)."""
+    return _zone(user_timezones.get(user_id, DEFAULT_USER_TIMEZONE)) or timezone.utc
+
+
+def user_now(user_id: int) -> datetime:
+    """Текущее локальное время пользователя без tzinfo - в том же виде, в каком хранятся времена событий."""
+    return datetime.now(user_zone(user_id)).replace(tzinfo=None)
+
+
+# Готовые блоки контекста: часовой пояс -> (номер минуты, текст блока).
+# В пределах минуты блок один и тот же для всех пользователей пояса
+_context_blocks: Dict[str, Tuple[int, str]] = {}
+
+
+def _render_context_block(name: str, now: datetime) -> str:
+    zone = _zone(name)
+    if zone is None:
+        name, zone = "UTC", timezone.utc
+    local = now.astimezone(zone)
+    return f"[Контекст: {local:%Y-%m-%d %H:%M}, {WEEKDAYS[local.weekday()]}, часовой пояс {name}]"
+
+
+def turn_context_block(user_id: int, now: Optional[datetime] = None) -> str:
+    """Блок с текущими датой, временем и часовым поясом пользователя для одного хода."""
+    name = user_timezones.get(user_id, DEFAULT_USER_TIMEZONE)
+    if now is not None:
+        return _render_context_block(name, now)
+    minute = int(time.time() // 60)
+    cached = _context_blocks.get(name)
+    if cached is None or cached[0] != minute:
+        cached = _context_blocks[name] = (minute, _render_context_block(name, datetime.now(timezone.utc)))
+    return cached[1]
+
+
+def with_turn_context(user_input: str, user_id: int, now: Optional[datetime] = None) -> str:
+    """Текст сообщения пользователя, дополненный контекстом хода."""
+    return f"{turn_context_block(user_id, now)}\n{user_input}"
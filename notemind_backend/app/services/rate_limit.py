@@ -0,0 +1,174 @@
+import logging
+import math
+import os
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from sqlalchemy import text
+
+from app.database import core
+from app.services.metrics import Counter
+from app.services.throttling import AsyncTokenBucket
+
+logger = logging.getLogger(__name__)
+
+# --- Ограничение входящих сообщений (до любых запросов к БД и LLM) ---
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "1") == "1"
+# На пользователя: в среднем сообщений в секунду и допустимая пачка подряд
+RATE_LIMIT_USER_RATE = float(os.getenv("RATE_LIMIT_USER_RATE", "0.2"))
+RATE_LIMIT_USER_BURST = float(os.getenv("RATE_LIMIT_USER_BURST", "5"))
+# На весь сервис (все пользователи вместе)
+RATE_LIMIT_GLOBAL_RATE = float(os.getenv("RATE_LIMIT_GLOBAL_RATE", "50"))
+RATE_LIMIT_GLOBAL_BURST = float(os.getenv("RATE_LIMIT_GLOBAL_BURST", "100"))
+# local - корзины в памяти процесса; postgres - общие для всех воркеров (таблица ingress_buckets)
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "local")
+# Сколько корзин пользователей держать в памяти (давно не писавшие вытесняются)
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000"))
+# Не чаще одного ответа "подождите" пользователю за этот интервал, секунд
+RATE_LIMIT_REPLY_INTERVAL_SECONDS = float(os.getenv("RATE_LIMIT_REPLY_INTERVAL_SECONDS", "30"))
+
+SCOPE_USER = "user"
+SCOPE_GLOBAL = "global"
+
+INGRESS_ALLOWED = Counter("ingress_allowed_total", "Принятые входящие сообщения", ["source"])
+INGRESS_SHED = Counter("ingress_shed_total", "Отклоненные лимитом входящие сообщения", ["source", "scope"])
+INGRESS_LIMITER_ERRORS = Counter("ingress_limiter_errors_total", "Ошибки общего хранилища лимитов (сообщение пропущено)")
+
+# Атомарное списание токена в общей корзине: пополнение считается по часам БД, чтобы
+# расхождение часов воркеров не влияло на лимит. Нет строки в ответе - токенов не хватило
+_TAKE_SQL = text("""
+    INSERT INTO ingress_buckets AS b (key, tokens, updated_at)
+    VALUES (:key, :burst - 1, extract(epoch from clock_timestamp()))
+    ON CONFLICT (key) DO UPDATE SET
+        tokens = LEAST(:burst, b.tokens + (EXCLUDED.updated_at - b.updated_at) * :rate) - 1,
+        updated_at = EXCLUDED.updated_at
+    WHERE LEAST(:burst, b.tokens + (EXCLUDED.updated_at - b.updated_at) * :rate) >= 1
+    RETURNING tokens
+""")
+# UNLOGGED: корзины не нужны после сбоя БД, а запись в них не должна нагружать WAL
+_CREATE_SQL = text("""
+    CREATE UNLOGGED TABLE IF NOT EXISTS ingress_buckets (
+        key text PRIMARY KEY,
+        tokens double precision NOT NULL,
+        updated_at double precision NOT NULL
+    )
+""")
+
+
+class Decision:
+    """Результат проверки: пропустить или нет, чей лимит сработал и когда повторить."""
+    __slots__ = ("allowed", "scope", "retry_after")
+
+    def __init__(self, allowed: bool, scope: Optional[str] = None, retry_after: float = 0.0):
+        self.allowed = allowed
+        self.scope = scope
+        self.retry_after = retry_after
+
+    @property
+    def retry_after_header(self) -> str:
+        return str(max(1, math.ceil(self.retry_after)))
+
+
+ALLOW = Decision(True)
+
+
+class IngressLimiter:
+    """
+    Token bucket на пользователя и на весь сервис. Сначала проверяется корзина пользователя:
+    сообщения спамера не расходуют общий лимит. Корзины в памяти проверяются всегда - это
+    дешевый первый фильтр без ввода-вывода; с backend="postgres" пропущенное им сообщение
+    дополнительно списывает токен в общей таблице, и лимит действует на все воркеры сразу.
+    Если общее хранилище недоступно, сообщения пропускаются (fail open).
+    """
+
+    def __init__(self, user_rate: float = RATE_LIMIT_USER_RATE, user_burst: float = RATE_LIMIT_USER_BURST,
+                 global_rate: float = RATE_LIMIT_GLOBAL_RATE, global_burst: float = RATE_LIMIT_GLOBAL_BURST,
+                 backend: str = RATE_LIMIT_BACKEND, max_keys: int = RATE_LIMIT_MAX_KEYS):
+        if backend not in ("local", "postgres"):
+            raise ValueError(f"Неизвестный RATE_LIMIT_BACKEND: {backend}")
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self.global_rate = global_rate
+        self.global_burst = global_burst
+        self.backend = backend
+        self.max_keys = max_keys
+        self._users: "OrderedDict[str, AsyncTokenBucket]" = OrderedDict()
+        self._global = AsyncTokenBucket(global_rate, global_burst)
+        self._table_ready = False
+        self._replied_at: "OrderedDict[str, float]" = OrderedDict()
+
+    def _user_bucket(self, key: str) -> AsyncTokenBucket:
+        bucket = self._users.get(key)
+        if bucket is None:
+            bucket = self._users[key] = AsyncTokenBucket(self.user_rate, self.user_burst)
+            if len(self._users) > self.max_keys:
+                self._users.popitem(last=False)
+        else:
+            self._users.move_to_end(key)
+        return bucket
+
+    def _check_local(self, key: str) -> Decision:
+        bucket = self._user_bucket(key)
+        if not bucket.try_acquire():
+            return Decision(False, SCOPE_USER, bucket.time_until_available())
+        if not self._global.try_acquire():
+            # Возвращаем токен пользователю: сообщение не прошло не по его вине
+            bucket.refund()
+            return Decision(False, SCOPE_GLOBAL, self._global.time_until_available())
+        return ALLOW
+
+    async def _take_shared(self, key: str, rate: float, burst: float) -> bool:
+        async with core.engine.begin() as conn:
+            if not self._table_ready:
+                await conn.execute(_CREATE_SQL)
+                self._table_ready = True
+            result = await conn.execute(_TAKE_SQL, {"key": key, "rate": rate, "burst": burst})
+            return result.first() is not None
+
+    async def _check_shared(self, key: str) -> Decision:
+        try:
+            if not await self._take_shared(f"user:{key}", self.user_rate, self.user_burst):
+                return Decision(False, SCOPE_USER, 1 / self.user_rate)
+            if not await self._take_shared("global", self.global_rate, self.global_burst):
+                return Decision(False, SCOPE_GLOBAL, 1 / self.global_rate)
+        except Exception as e:
+            INGRESS_LIMITER_ERRORS.inc()
+            logger.warning("Общее хранилище лимитов недоступно, сообщение пропущено: %s", e)
+        return ALLOW
+
+    async def check(self, source: str, key: str) -> Decision:
+        """Списывает токен за входящее сообщение пользователя key из источника source (max, api)."""
+        if not RATE_LIMIT_ENABLED:
+            return ALLOW
+        decision = self._check_local(f"{source}:{key}")
+        if decision.allowed and self.backend == "postgres":
+            decision = await self._check_shared(f"{source}:{key}")
+        if decision.allowed:
+            INGRESS_ALLOWED.labels(source).inc()
+        else:
+            INGRESS_SHED.labels(source, decision.scope).inc()
+            logger.info("Сообщение отклонено лимитом (%s), повтор через %.1f с", decision.scope,
+                        decision.retry_after, extra={"source": source, "key": key})
+        return decision
+
+    def should_reply(self, key: str) -> bool:
+        """Отвечать ли пользователю "подождите": не чаще раза в RATE_LIMIT_REPLY_INTERVAL_SECONDS."""
+        now = time.monotonic()
+        replied_at = self._replied_at.get(key)
+        if replied_at is not None and now - replied_at < RATE_LIMIT_REPLY_INTERVAL_SECONDS:
+            return False
+        self._replied_at[key] = now
+        self._replied_at.move_to_end(key)
+        if len(self._replied_at) > self.max_keys:
+            self._replied_at.popitem(last=False)
+        return True
+
+
+def throttled_message(decision: Decision) -> str:
+    if decision.scope == SCOPE_GLOBAL:
+        return "Сейчас очень много запросов, я не успеваю. Пожалуйста, повторите сообщение через минуту 🙏"
+    return "Вы пишете быстрее, чем я успеваю обрабатывать. Подождите немного и отправьте сообщение еще раз 🙏"
+
+
+ingress_limiter = IngressLimiter()
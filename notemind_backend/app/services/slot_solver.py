@@ -0,0 +1,68 @@
+"""
+Поиск свободного слота на чистых целых числах - без datetime, ORM и зависимостей приложения.
+
+Время задается в минутах от базовой полуночи (минута 0 - 00:00 первого дня), занятые
+интервалы - плоским массивом [начало0, конец0, начало1, конец1, ...] по возрастанию начала.
+Такой запрос дешево сериализуется, поэтому модуль импортируется в процессах-воркерах
+пула планировщика (app.services.planner_pool) и ничего тяжелого за собой не тянет.
+"""
+from array import array
+from bisect import bisect_left
+from typing import Sequence
+
+MINUTES_PER_DAY = 24 * 60
+
+# Слот не найден
+NO_SLOT = -1
+
+
+def busy_array(intervals: Sequence) -> array:
+    """Плоский массив минут из пар (начало, конец)."""
+    flat = array("q")
+    for start, end in intervals:
+        flat.append(start)
+        flat.append(end)
+    return flat
+
+
+def find_slot(busy: Sequence[int], start: int, duration: int, horizon: int,
+              work_start: int, work_end: int, gap: int) -> int:
+    """
+    Первое начало слота длиной duration не раньше start, целиком внутри рабочего дня
+    [work_start, work_end) (минуты от полуночи) и не пересекающееся с занятыми интервалами.
+    После занятого интервала слот начинается не раньше чем через gap минут.
+    Кандидаты позже horizon не рассматриваются: тогда возвращается NO_SLOT.
+    """
+    if duration <= 0 or duration > work_end - work_start:
+        return NO_SLOT
+    count = len(busy) // 2
+    starts = [busy[2 * i] for i in range(count)]
+    # Самый длинный интервал: раньше (кандидат - max_length) не начинается ни один пересекающий
+    max_length = max((busy[2 * i + 1] - busy[2 * i] for i in range(count)), default=0)
+
+    candidate = start
+    while candidate <= horizon:
+        day = candidate - candidate % MINUTES_PER_DAY
+        minute_of_day = candidate - day
+        if minute_of_day < work_start:
+            candidate = day + work_start
+            continue
+        if minute_of_day + duration > work_end:
+            candidate = day + MINUTES_PER_DAY + work_start
+            continue
+
+        slot_end = candidate + duration
+        index = bisect_left(starts, candidate - max_length)
+        while index < count and busy[2 * index] < slot_end:
+            if busy[2 * index + 1] > candidate:
+                break
+            index += 1
+        else:
+            return candidate
+        # Слот занят: следующий кандидат - после конца первого пересекающегося интервала
+        candidate = busy[2 * index + 1] + gap
+    return NO_SLOT
+
+
+def warm_up() -> None:
+    """Инициализатор воркера пула: модуль уже импортирован, первый запрос не ждет импорта."""
@@ -0,0 +1,48 @@
+import asyncio
+import time
+
+
+class AsyncTokenBucket:
+    """
+    Асинхронный token bucket: не более `rate` операций в секунду
+    с допустимым всплеском до `capacity` операций.
+    """
+
+    def __init__(self, rate: float, capacity: float = None):
+        if rate <= 0:
+            raise ValueError("rate должен быть положительным")
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    def try_acquire(self, tokens: float = 1.0) -> bool:
+        """Забирает токены без ожидания. Возвращает False, если их не хватает."""
+        self._refill()
+        if self._tokens >= tokens:
+            self._tokens -= tokens
+            return True
+        return False
+
+    def refund(self, tokens: float = 1.0) -> None:
+        """Возвращает токены, взятые под операцию, которая так и не была выполнена."""
+        self._tokens = min(self.capacity, self._tokens + tokens)
+
+    def time_until_available(self, tokens: float = 1.0) -> float:
+        """Через сколько секунд будет доступно нужное количество токенов."""
+        self._refill()
+        missing = tokens - self._tokens
+        return 0.0 if missing <= 0 else missing / self.rate
+
+    async def acquire(self, tokens: float = 1.0) -> None:
+        """Ждет, пока не появятся токены, и забирает их."""
+        # Лок выстраивает ожидающих в очередь, чтобы они не просыпались все разом
+        async with self._lock:
+            while not self.try_acquire(tokens):
+                await asyncio.sleep(self.time_until_available(tokens))
@@ -0,0 +1,191 @@
+import asyncio
+import functools
+import logging
+import os
+import time
+import uuid
+from contextvars import ContextVar
+from typing import Callable, List, Optional, Tuple
+
+from app.services.metrics import Counter, Gauge, Histogram
+
+logger = logging.getLogger(__name__)
+
+# Запросы дольше порога печатают разбивку времени по этапам
+SLOW_REQUEST_SECONDS = float(os.getenv("SLOW_REQUEST_SECONDS", "5"))
+REQUEST_ID_HEADER = "x-request-id"
+_REQUEST_ID_HEADER_BYTES = REQUEST_ID_HEADER.encode()
+
+# --- Метрики этапов ---
+HTTP_REQUEST_LATENCY = Histogram("http_request_seconds", "Обработка HTTP-запроса", ["method", "route", "status"])
+HTTP_IN_FLIGHT = Gauge("http_requests_in_flight", "HTTP-запросы в работе")
+AGENT_NODE_LATENCY = Histogram("agent_node_seconds", "Узел графа агента целиком", ["node"])
+AGENT_MODEL_CALL_LATENCY = Histogram("agent_call_model_seconds", "Шаг агента call_model (с ожиданием в шлюзе)")
+AGENT_TOOL_LATENCY = Histogram("agent_tool_seconds", "Выполнение инструмента агента", ["tool"])
+CRUD_LATENCY = Histogram("crud_seconds", "CRUD-функции", ["function"])
+MAPS_LATENCY = Histogram("maps_call_seconds", "Запросы к картам (ORS)", ["function"])
+PLANNER_LATENCY = Histogram("planner_seconds", "Автопланирование задачи")
+# engine - primary или replica (см. DATABASE_READ_URL в app/database/core.py)
+DB_QUERY_LATENCY = Histogram("db_query_seconds", "Выполнение SQL-запроса", ["engine"])
+DB_QUERIES_PER_REQUEST = Histogram("http_request_db_queries", "SQL-запросов на HTTP-запрос", ["route"],
+                                   buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100))
+DB_CONNECTION_HOLD = Histogram("db_connection_hold_seconds", "Время от выдачи соединения из пула до возврата",
+                               ["engine"])
+DB_CONNECTIONS_IN_USE = Gauge("db_connections_in_use", "Соединения с БД, выданные из пула", ["engine"])
+DB_CONNECTIONS_OPEN = Gauge("db_connections_open", "Открытые соединения с БД (в пуле и выданные)", ["engine"])
+SLOW_REQUESTS = Counter("http_slow_requests_total", "Запросы дольше SLOW_REQUEST_SECONDS", ["route"])
+
+
+class RequestTrace:
+    """Идентификатор запроса и время его этапов: по ним разбирается один медленный ход."""
+    __slots__ = ("request_id", "started_at", "stages", "db_queries", "db_seconds")
+
+    def __init__(self, request_id: str):
+        self.request_id = request_id
+        self.started_at = time.perf_counter()
+        self.stages: List[Tuple[str, float]] = []
+        self.db_queries = 0
+        self.db_seconds = 0.0
+
+    def breakdown(self) -> str:
+        """Суммарное время и число вызовов по этапам, от самых долгих."""
+        totals = {}
+        for stage, elapsed in self.stages:
+            total, count = totals.get(stage, (0.0, 0))
+            totals[stage] = (total + elapsed, count + 1)
+        if self.db_queries:
+            totals["db"] = (self.db_seconds, self.db_queries)
+        ordered = sorted(totals.items(), key=lambda item: item[1][0], reverse=True)
+        return ", ".join(f"{stage} {count}x {total:.3f}s" for stage, (total, count) in ordered)
+
+
+_trace: ContextVar[Optional[RequestTrace]] = ContextVar("request_trace", default=None)
+
+
+def current_trace() -> Optional[RequestTrace]:
+    return _trace.get()
+
+
+def current_request_id() -> Optional[str]:
+    trace = _trace.get()
+    return trace.request_id if trace is not None else None
+
+
+def _record(child, stage: str, elapsed: float) -> None:
+    child.observe(elapsed)
+    trace = _trace.get()
+    if trace is not None:
+        trace.stages.append((stage, elapsed))
+
+
+def record_db_query(elapsed: float, engine: str = "primary") -> None:
+    """Учитывает один SQL-запрос: в метрике и в счетчиках текущего HTTP-запроса."""
+    DB_QUERY_LATENCY.labels(engine).observe(elapsed)
+    trace = _trace.get()
+    if trace is not None:
+        trace.db_queries += 1
+        trace.db_seconds += elapsed
+
+
+class stage_timer:
+    """Контекстный менеджер: время блока в гистограмму и в трассу текущего запроса."""
+    __slots__ = ("_child", "_stage", "_started_at")
+
+    def __init__(self, histogram: Histogram, *labels: str, stage: str):
+        self._child = histogram.labels(*labels)
+        self._stage = stage
+
+    def __enter__(self):
+        self._started_at = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        _record(self._child, self._stage, time.perf_counter() - self._started_at)
+
+
+def traced(histogram: Histogram, *labels: str, stage: str) -> Callable:
+    """
+    Декоратор для sync- и async-функций. Дочерняя метрика выбирается один раз при
+    декорировании, так что на горячем пути - только perf_counter и observe.
+    """
+    child = histogram.labels(*labels)
+
+    def decorate(func):
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                started_at = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    _record(child, stage, time.perf_counter() - started_at)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            started_at = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                _record(child, stage, time.perf_counter() - started_at)
+        return wrapper
+
+    return decorate
+
+
+def traced_by_name(histogram: Histogram, prefix: str) -> Callable:
+    """Как traced, но метка и этап берутся из имени функции: @traced_by_name(CRUD_LATENCY, "crud")."""
+    def decorate(func):
+        return traced(histogram, func.__name__, stage=f"{prefix}:{func.__name__}")(func)
+    return decorate
+
+
+class RequestMetricsMiddleware:
+    """
+    ASGI-middleware: заводит трассу запроса (X-Request-ID из заголовка или новый),
+    возвращает идентификатор в ответе, считает время и запросы в работе, а медленные
+    запросы печатает с разбивкой по этапам.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_id = None
+        for name, value in scope.get("headers", ()):
+            if name == _REQUEST_ID_HEADER_BYTES:
+                request_id = value.decode("latin-1")[:64]
+                break
+        trace = RequestTrace(request_id or uuid.uuid4().hex)
+        token = _trace.set(trace)
+        status = "500"
+
+        async def send_with_request_id(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = str(message["status"])
+                message["headers"] = list(message.get("headers", [])) + [
+                    (_REQUEST_ID_HEADER_BYTES, trace.request_id.encode()),
+                ]
+            await send(message)
+
+        HTTP_IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive, send_with_request_id)
+        finally:
+            HTTP_IN_FLIGHT.dec()
+            elapsed = time.perf_counter() - trace.started_at
+            # Шаблон пути, а не сам путь: иначе у метрики будет по ряду на каждый id
+            route = getattr(scope.get("route"), "path", "unmatched")
+            HTTP_REQUEST_LATENCY.labels(scope["method"], route, status).observe(elapsed)
+            DB_QUERIES_PER_REQUEST.labels(route).observe(trace.db_queries)
+            if elapsed >= SLOW_REQUEST_SECONDS:
+                SLOW_REQUESTS.labels(route).inc()
+                logger.warning("Медленный запрос %s %s: %.2f с; %s", scope["method"], route, elapsed,
+                               trace.breakdown() or "этапы не зафиксированы", extra={"seconds": round(elapsed, 3)})
+            # Трасса сбрасывается последней, чтобы запись о медленном запросе получила его request_id
+            _trace.reset(token)
@@ -0,0 +1,106 @@
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, List, Optional
+
+from app.services.metrics import Counter, Gauge
+
+if TYPE_CHECKING:
+    from app.services.geo_speculation import GeoPrefetch
+
+# --- Бюджет одного хода агента ---
+AGENT_MAX_STEPS = int(os.getenv("AGENT_MAX_STEPS", "12"))            # узлов графа (agent/tools) за ход
+AGENT_MAX_SECONDS = float(os.getenv("AGENT_MAX_SECONDS", "45"))      # общее время хода
+AGENT_MAX_TOOL_CALLS = int(os.getenv("AGENT_MAX_TOOL_CALLS", "10"))  # вызовов инструментов за ход
+
+# Причины исчерпания бюджета (используются как метки метрик)
+REASON_STEPS = "steps"
+REASON_TIME = "time"
+REASON_TOOL_CALLS = "tool_calls"
+
+# Ходы, прерванные по бюджету, с причиной (steps, time, tool_calls)
+AGENT_BUDGET_EXHAUSTED = Counter("agent_budget_exhausted_total", "Ходы агента, прерванные по бюджету", ["reason"])
+AGENT_TURNS_IN_FLIGHT = Gauge("agent_turns_in_flight", "Ходы агента в работе")
+
+# События потока хода агента
+EVENT_ACK = "ack"        # сообщение принято в работу
+EVENT_TOOL = "tool"      # инструмент завершился, text - его результат
+EVENT_TOKEN = "token"    # очередной фрагмент итогового ответа
+EVENT_RESET = "reset"    # накопленные фрагменты оказались не ответом, а прелюдией к вызову инструментов
+EVENT_FINAL = "final"    # итоговый ответ целиком
+
+REASON_TEXT = {
+    REASON_STEPS: "слишком много шагов обработки",
+    REASON_TIME: "закончилось время на ответ",
+    REASON_TOOL_CALLS: "слишком много действий за одно сообщение",
+}
+
+
+@dataclass
+class TurnBudget:
+    """Ограничения на один ход агента."""
+    max_steps: int = AGENT_MAX_STEPS
+    max_seconds: float = AGENT_MAX_SECONDS
+    max_tool_calls: int = AGENT_MAX_TOOL_CALLS
+
+
+class TurnBudgetExceeded(Exception):
+    """Ход агента исчерпал свой бюджет."""
+
+    def __init__(self, reason: str):
+        super().__init__(f"Бюджет хода исчерпан: {reason}")
+        self.reason = reason
+
+
+@dataclass
+class TurnContext:
+    """Состояние одного хода агента, доступное всем узлам графа и инструментам."""
+    user_id: int
+    budget: TurnBudget
+    started_at: float = field(default_factory=time.monotonic)
+    steps: int = 0
+    tool_calls: int = 0
+    saved: List[str] = field(default_factory=list)  # что уже успели сохранить за ход
+    geo: Optional["GeoPrefetch"] = None             # геокодирование адресов из сообщения, запущенное заранее
+
+    def count_step(self) -> None:
+        self.steps += 1
+        if self.steps > self.budget.max_steps:
+            raise TurnBudgetExceeded(REASON_STEPS)
+
+    def count_tool_call(self) -> None:
+        self.tool_calls += 1
+        if self.tool_calls > self.budget.max_tool_calls:
+            raise TurnBudgetExceeded(REASON_TOOL_CALLS)
+
+    def remaining_seconds(self) -> float:
+        return self.budget.max_seconds - (time.monotonic() - self.started_at)
+
+    def partial_reply(self, reason: str) -> str:
+        """Ответ пользователю, если ход прерван по бюджету."""
+        header = f"Не успел полностью обработать сообщение ({REASON_TEXT.get(reason, reason)})."
+        if not self.saved:
+            return f"{header} Ничего сохранить не успел — попробуйте написать короче или разбить на несколько сообщений."
+        return "\n".join([f"{header} Уже сохранено:"] + [f"• {item}" for item in self.saved])
+
+
+_current_turn: ContextVar[Optional[TurnContext]] = ContextVar("current_turn", default=None)
+
+
+def current_turn() -> Optional[TurnContext]:
+    """Контекст текущего хода или None вне хода агента."""
+    return _current_turn.get()
+
+
+@contextmanager
+def start_turn(user_id: int, budget: Optional[TurnBudget] = None):
+    turn = TurnContext(user_id=user_id, budget=budget or TurnBudget())
+    token = _current_turn.set(turn)
+    AGENT_TURNS_IN_FLIGHT.inc()
+    try:
+        yield turn
+    finally:
+        AGENT_TURNS_IN_FLIGHT.dec()
+        _current_turn.reset(token)
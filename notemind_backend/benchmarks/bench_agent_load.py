@@ -0,0 +1,197 @@
+"""
+Офлайн нагрузочный прогон агента через webhook MAX.
+
+Поднимает фейковые MAX и ORS (benchmarks/fakes.py), подменяет GigaChat сценарной
+моделью и отправляет тысячи одновременных обновлений в handle_max_update через
+ASGI-транспорт - без сети, ключей и внешних сервисов. Отчет:
+- пропускная способность (обновлений в секунду) и статусы ответов;
+- задержка обработки обновления: p50 / p95 / p99 / максимум;
+- задержка event loop (насколько опаздывает таймер с шагом 10 мс);
+- прирост памяти процесса (RSS) на пользователя.
+
+Запуск из папки notemind_backend:
+    python -m benchmarks.bench_agent_load
+    python -m benchmarks.bench_agent_load --users 2000 --messages 2 --llm-latency 0.5 --no-streaming
+"""
+import argparse
+import asyncio
+import contextlib
+import functools
+import os
+import resource
+import statistics
+import sys
+import time
+from collections import Counter
+
+from benchmarks.fakes import BackgroundServer, ScriptedChatModel, fake_max_app, fake_ors_app
+
+MESSAGES = [
+    "Завтра в 10 созвон с командой",
+    "Нужно сделать презентацию (2 часа)",
+    "Сегодня плохо спал",
+    "Что ты умеешь?",
+    "В 19 ужин, сколько ехать до ресторана?",
+]
+
+
+def _configure_env(args, max_url: str, ors_url: str) -> None:
+    """Окружение приложения задается до его импорта: настройки читаются при загрузке модулей."""
+    os.environ.update({
+        "GIGACHAT_CREDENTIALS": os.environ.get("GIGACHAT_CREDENTIALS", "offline"),
+        "DATABASE_URL": args.db_url,
+        "MAX_BOT_TOKEN": "offline",
+        "MAX_MESSAGES_URL": f"{max_url}/messages",
+        "ORS_API_KEY": "offline",
+        "ORS_BASE_URL": ors_url,
+        "MAX_STREAMING_REPLIES": "1" if args.streaming else "0",
+        "AGENT_COALESCE_WINDOW_MS": str(args.coalesce_ms),
+        "AGENT_PRELOAD": "0",
+        # Лог SQL и подробные логи приложения в нагрузке только мешают
+        "DB_ECHO": "0",
+        "LOG_LEVEL": os.environ.get("LOG_LEVEL", "DEBUG" if args.verbose else "WARNING"),
+        # Шлюз настраивается так, чтобы мерить приложение, а не лимиты GigaChat
+        "LLM_MAX_CONCURRENCY": str(args.llm_concurrency),
+        "LLM_MAX_QUEUE": str(args.users * args.messages),
+        "LLM_RATE_PER_SECOND": "100000",
+        "LLM_RATE_BURST": "100000",
+        # Нагрузка заведомо выше лимитов входящих сообщений - меряем обработку, а не отказы
+        "RATE_LIMIT_ENABLED": "0",
+    })
+
+
+def _rss_bytes() -> int:
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        # Не Linux: пиковый RSS (ru_maxrss в КиБ на Linux, в байтах на macOS)
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+class LoopLagMonitor:
+    """Будит себя каждые interval секунд и записывает опоздание пробуждения."""
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.lags = []
+        self._task = None
+
+    async def _run(self):
+        while True:
+            started_at = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.lags.append(max(0.0, time.perf_counter() - started_at - self.interval))
+
+    def __enter__(self):
+        self._task = asyncio.get_running_loop().create_task(self._run())
+        return self
+
+    def __exit__(self, *exc_info):
+        self._task.cancel()
+
+
+def _percentile(values, q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else 0.0
+
+
+async def _seed_users(count: int):
+    from sqlalchemy import delete
+    from app.database import core, models
+    from app.main import create_tables
+
+    await create_tables()
+    async with core.AsyncSessionLocal() as session:
+        await session.execute(delete(models.User))
+        session.add_all(models.User(max_user_id=f"load-{index}") for index in range(count))
+        await session.commit()
+
+
+async def run(args, max_server: BackgroundServer, ors_server: BackgroundServer):
+    import httpx
+    from app.main import app
+    from app.services import llm_processor
+
+    await _seed_users(args.users)
+    agent = await llm_processor.get_agent()
+    model = ScriptedChatModel(latency=args.llm_latency, token_latency=args.token_latency)
+    agent.set_chat_model(model)
+
+    latencies, statuses = [], Counter()
+    limiter = asyncio.Semaphore(args.concurrency)
+
+    async def user_session(client: httpx.AsyncClient, index: int):
+        # Сообщения одного пользователя идут последовательно, пользователи - параллельно
+        for step in range(args.messages):
+            payload = {"message": {"sender": {"user_id": f"load-{index}"},
+                                   "body": {"text": MESSAGES[(index + step) % len(MESSAGES)]}}}
+            async with limiter:
+                started_at = time.perf_counter()
+                try:
+                    response = await client.post("/webhook", json=payload)
+                    status = response.json().get("status", str(response.status_code))
+                except asyncio.CancelledError:
+                    # Отмена изнутри приложения (например, таймаут соединения в anyio) - считаем
+                    # ее ошибкой запроса; отмену самого прогона пропускаем дальше
+                    if asyncio.current_task().cancelling():
+                        raise
+                    status = "CancelledError"
+                except Exception as e:
+                    status = type(e).__name__
+                latencies.append(time.perf_counter() - started_at)
+                statuses[status] += 1
+
+    rss_before = _rss_bytes()
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        with LoopLagMonitor() as monitor:
+            started_at = time.perf_counter()
+            await asyncio.gather(*(user_session(client, index) for index in range(args.users)))
+            elapsed = time.perf_counter() - started_at
+    rss_after = _rss_bytes()
+
+    total = len(latencies)
+    report = functools.partial(print, file=sys.__stdout__)
+    report(f"Обновлений: {total} от {args.users} пользователей за {elapsed:.2f} с -> {total / elapsed:.0f} в секунду")
+    report("Статусы: " + ", ".join(f"{status}={count}" for status, count in statuses.most_common()))
+    report(f"Задержка обработки, мс: p50 {_percentile(latencies, 0.50) * 1000:.0f}, "
+          f"p95 {_percentile(latencies, 0.95) * 1000:.0f}, p99 {_percentile(latencies, 0.99) * 1000:.0f}, "
+          f"макс {max(latencies) * 1000:.0f}")
+    lags = monitor.lags or [0.0]
+    report(f"Задержка event loop, мс: среднее {statistics.mean(lags) * 1000:.1f}, "
+          f"p99 {_percentile(lags, 0.99) * 1000:.1f}, макс {max(lags) * 1000:.1f}")
+    report(f"Память: RSS {rss_before / 2**20:.0f} -> {rss_after / 2**20:.0f} МиБ, "
+          f"{(rss_after - rss_before) / args.users / 1024:.1f} КиБ на пользователя")
+    report(f"Вызовов модели: {model.calls}, MAX: {max_server.stats()}, ORS: {ors_server.stats()}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--messages", type=int, default=1, help="Сообщений от каждого пользователя")
+    parser.add_argument("--concurrency", type=int, default=1000, help="Максимум одновременных запросов к webhook")
+    parser.add_argument("--llm-latency", type=float, default=0.3, help="Секунды на ответ фейковой модели")
+    parser.add_argument("--token-latency", type=float, default=0.0, help="Секунды между токенами")
+    parser.add_argument("--llm-concurrency", type=int, default=512, help="LLM_MAX_CONCURRENCY шлюза")
+    parser.add_argument("--max-latency", type=float, default=0.02, help="Задержка фейкового API MAX")
+    parser.add_argument("--ors-latency", type=float, default=0.05, help="Задержка фейкового ORS")
+    parser.add_argument("--coalesce-ms", type=int, default=0, help="AGENT_COALESCE_WINDOW_MS")
+    parser.add_argument("--no-streaming", dest="streaming", action="store_false", help="MAX_STREAMING_REPLIES=0")
+    parser.add_argument("--db-url", default="sqlite+aiosqlite:///./bench_load.db")
+    parser.add_argument("--verbose", action="store_true", help="Не глушить вывод приложения")
+    args = parser.parse_args()
+
+    with BackgroundServer(fake_max_app, args.max_latency) as max_server, \
+            BackgroundServer(fake_ors_app, args.ors_latency) as ors_server:
+        _configure_env(args, max_server.url, ors_server.url)
+        # Вывод приложения (логи) в нагрузке уходит в /dev/null, отчет пишется напрямую
+        with open(os.devnull, "w") as devnull:
+            quiet = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(devnull)
+            with quiet:
+                asyncio.run(run(args, max_server, ors_server))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""
+Бенчмарк планировщика: задержка event loop, пока идет поиск слотов на плотных календарях.
+
+Параллельно с запросами планирования тикает корутина с периодом --tick-ms и записывает,
+на сколько она опоздала проснуться: это задержка, которую в тот момент видел бы любой
+другой запрос воркера (вебхуки, API). Варианты:
+  наивный - прежний поиск на datetime в event loop;
+  на месте - slot_solver в event loop (PLANNER_POOL_WORKERS=0);
+  пул      - slot_solver в пуле процессов (app.services.planner_pool).
+
+Запуск из папки notemind_backend:
+    python -m benchmarks.bench_planner --events-per-day 60 --requests 200
+"""
+import argparse
+import asyncio
+import random
+import statistics
+import time
+from datetime import datetime, timedelta
+from typing import List, Tuple
+
+from app.services import slot_solver
+from app.services.planner_pool import PlannerPool
+
+WORK_START, WORK_END, GAP, HORIZON_DAYS = 9 * 60, 21 * 60, 15, 30
+
+
+def make_calendar(events_per_day: int, seed: int) -> List[Tuple[int, int]]:
+    """Плотный календарь: короткие события в рабочее время с зазорами меньше GAP, по возрастанию начала."""
+    rng = random.Random(seed)
+    intervals = []
+    for day in range(HORIZON_DAYS):
+        for _ in range(events_per_day):
+            start = day * slot_solver.MINUTES_PER_DAY + rng.randrange(WORK_START, WORK_END - 30)
+            intervals.append((start, start + rng.randrange(10, 45)))
+    intervals.sort()
+    return intervals
+
+
+def naive_find_slot(calendar: List[dict], start: datetime, duration: timedelta, horizon: datetime):
+    """Прежний алгоритм ai_planner: datetime и полный проход по календарю на каждого кандидата."""
+    candidate = start
+    while candidate <= horizon:
+        if not (WORK_START // 60 <= candidate.hour < WORK_END // 60):
+            candidate = candidate.replace(hour=WORK_START // 60, minute=0) + timedelta(days=1)
+            continue
+        slot_end = candidate + duration
+        if slot_end.hour > WORK_END // 60 or (slot_end.hour == WORK_END // 60 and slot_end.minute > 0):
+            candidate = candidate.replace(hour=WORK_START // 60, minute=0) + timedelta(days=1)
+            continue
+        for event in calendar:
+            if max(candidate, event["start"]) < min(slot_end, event["end"]):
+                candidate = event["end"] + timedelta(minutes=GAP)
+                break
+        else:
+            return candidate
+    return None
+
+
+async def measure_lag(stop: asyncio.Event, tick: float, lags: List[float]) -> None:
+    while not stop.is_set():
+        expected = time.perf_counter() + tick
+        await asyncio.sleep(tick)
+        lags.append(max(0.0, time.perf_counter() - expected))
+
+
+async def run(name: str, solve, calendars, requests: int, concurrency: int, tick: float) -> None:
+    lags: List[float] = []
+    stop = asyncio.Event()
+    ticker = asyncio.create_task(measure_lag(stop, tick, lags))
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(index: int):
+        async with semaphore:
+            await solve(calendars[index % len(calendars)], rng.choice((30, 60, 90, 120)))
+
+    rng = random.Random(1)
+    started_at = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(requests)))
+    elapsed = time.perf_counter() - started_at
+    stop.set()
+    await ticker
+
+    lags_ms = sorted(lag * 1000 for lag in lags) or [0.0]
+    p99 = lags_ms[min(len(lags_ms) - 1, int(len(lags_ms) * 0.99))]
+    print(f"{name:10s} {requests / elapsed:9.1f} запросов/с   задержка loop: "
+          f"средняя {statistics.fmean(lags_ms):7.2f} мс, p99 {p99:7.2f} мс, макс {lags_ms[-1]:7.2f} мс")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events-per-day", type=int, default=60, help="Событий в день у каждого пользователя")
+    parser.add_argument("--users", type=int, default=8, help="Разных календарей")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--workers", type=int, default=2, help="Процессов в пуле")
+    parser.add_argument("--tick-ms", type=float, default=5.0)
+    parser.add_argument("--skip-naive", action="store_true", help="Не запускать наивный вариант")
+    args = parser.parse_args()
+
+    calendars = [make_calendar(args.events_per_day, seed) for seed in range(args.users)]
+    busy = [slot_solver.busy_array(intervals) for intervals in calendars]
+    print(f"Календари: {args.users} x {len(calendars[0])} событий, запросов {args.requests}, "
+          f"параллельно {args.concurrency}")
+
+    tick = args.tick_ms / 1000
+    base = datetime(2030, 1, 1)
+    horizon = HORIZON_DAYS * slot_solver.MINUTES_PER_DAY
+
+    if not args.skip_naive:
+        naive_calendars = [[{"start": base + timedelta(minutes=s), "end": base + timedelta(minutes=e)} for s, e in intervals]
+                           for intervals in calendars]
+
+        async def solve_naive(calendar, duration):
+            naive_find_slot(calendar, base, timedelta(minutes=duration), base + timedelta(minutes=horizon))
+        await run("наивный", solve_naive, naive_calendars, args.requests, args.concurrency, tick)
+
+    for name, pool in (("на месте", PlannerPool(workers=0)), ("пул", PlannerPool(workers=args.workers))):
+        await pool.warm_up()
+
+        async def solve(calendar, duration, pool=pool):
+            await pool.find_slot(calendar, 0, duration, horizon, WORK_START, WORK_END, GAP)
+        await run(name, solve, busy, args.requests, args.concurrency, tick)
+        pool.shutdown()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,155 @@
+"""
+Бенчмарк сборки промпта: токены на ход и стоимость сборки.
+
+Моделирует диалоги пользователей по несколько ходов и для каждого хода считает:
+- сколько токенов уходит в модель (системный промпт + история + новое сообщение);
+- сколько из них - неизменный префикс прошлого запроса той же сессии, который
+  GigaChat берет из кэша контекста (X-Session-ID), и сколько - новые токены;
+- сколько времени занимает сборка промпта хода и сколько памяти держат истории (tracemalloc).
+
+Сравниваются две схемы:
+- legacy: своя копия системного промпта с датой в каждой истории, история копируется каждый ход;
+- current: общий статичный системный промпт, блок [Контекст] в сообщении, история только дописывается.
+
+Токены по умолчанию оцениваются приблизительно (~4 символа на токен); с флагом --gigachat
+считаются точным подсчетом GigaChat (нужен GIGACHAT_CREDENTIALS).
+
+Запуск из папки notemind_backend:
+    python -m benchmarks.bench_prompt_tokens
+    python -m benchmarks.bench_prompt_tokens --users 200 --turns 10 --gigachat
+"""
+import argparse
+import asyncio
+import math
+import os
+import statistics
+import time
+import tracemalloc
+from datetime import datetime
+
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+
+from app.services.prompts import SYSTEM_PROMPT, with_turn_context
+
+USER_MESSAGES = [
+    "Завтра в 10 созвон с командой",
+    "Нужно сделать презентацию (2 часа) до пятницы",
+    "Сегодня плохо спал",
+    "В четверг в 19:00 ужин в ресторане на Тверской",
+    "Купить молоко",
+]
+REPLY = "Готово! Добавил событие 'Созвон' на завтра в 10:00 и отметил, что вы плохо спали."
+
+# Системный промпт в прежнем виде: дата подставлялась в текст при импорте
+LEGACY_SYSTEM_PROMPT = SYSTEM_PROMPT.replace(
+    SYSTEM_PROMPT.splitlines()[1], f"Текущая дата: {datetime.now().strftime('%Y-%m-%d')}.", 1,
+)
+
+
+def legacy_turn(histories: dict, user_id: int, text: str) -> list:
+    messages = histories.get(user_id, [SystemMessage(content=LEGACY_SYSTEM_PROMPT)])
+    messages.append(HumanMessage(content=text))
+    return messages
+
+
+def legacy_finish(histories: dict, user_id: int, messages: list) -> None:
+    histories[user_id] = messages + [AIMessage(content=REPLY)]
+
+
+SHARED_SYSTEM_MESSAGE = SystemMessage(content=SYSTEM_PROMPT)
+
+
+def current_turn(histories: dict, user_id: int, text: str) -> list:
+    messages = histories.get(user_id)
+    if messages is None:
+        messages = [SHARED_SYSTEM_MESSAGE]
+    messages.append(HumanMessage(content=with_turn_context(text, user_id)))
+    return messages
+
+
+def current_finish(histories: dict, user_id: int, messages: list) -> None:
+    messages.append(AIMessage(content=REPLY))
+    histories[user_id] = messages
+
+
+def measure_build(turn, finish, users: int, turns: int):
+    """Время сборки промпта на ход (мкс) и память историй на пользователя (байт)."""
+    histories = {}
+    elapsed = 0.0
+    tracemalloc.start()
+    for step in range(turns):
+        text = USER_MESSAGES[step % len(USER_MESSAGES)]
+        for user_id in range(users):
+            started_at = time.perf_counter()
+            messages = turn(histories, user_id, text)
+            elapsed += time.perf_counter() - started_at
+            finish(histories, user_id, messages)
+    retained, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed / (users * turns) * 1e6, retained / users
+
+
+class ApproximateCounter:
+    async def count(self, texts):
+        return [math.ceil(len(text) / 4) for text in texts]
+
+
+class GigaChatCounter:
+    def __init__(self):
+        from langchain_gigachat import GigaChat
+        self._llm = GigaChat(credentials=os.environ["GIGACHAT_CREDENTIALS"], verify_ssl_certs=False,
+                             scope="GIGACHAT_API_PERS")
+        self._cache = {}
+
+    async def count(self, texts):
+        missing = [text for text in texts if text not in self._cache]
+        if missing:
+            for text, result in zip(missing, await self._llm.atokens_count(missing)):
+                self._cache[text] = result.tokens
+        return [self._cache[text] for text in texts]
+
+
+async def measure_tokens(turn, finish, counter, turns: int, cached_prefix: bool):
+    """Токены одного диалога по ходам: (всего, из кэша, новые)."""
+    histories, previous, rows = {}, [], []
+    for step in range(turns):
+        messages = turn(histories, 0, USER_MESSAGES[step % len(USER_MESSAGES)])
+        prompt = [message.content for message in messages]  # то, что уходит в модель на этом ходу
+        finish(histories, 0, messages)
+        tokens = await counter.count(prompt)
+        reused = 0
+        if cached_prefix:
+            # Кэш работает только для сообщений, совпадающих с началом прошлого запроса
+            for text, old in zip(prompt, previous):
+                if text != old:
+                    break
+                reused += 1
+        total, cached = sum(tokens), sum(tokens[:reused])
+        rows.append((total, cached, total - cached))
+        previous = prompt
+    return rows
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--turns", type=int, default=8)
+    parser.add_argument("--gigachat", action="store_true", help="Точный подсчет токенов через GigaChat")
+    args = parser.parse_args()
+
+    counter = GigaChatCounter() if args.gigachat else ApproximateCounter()
+    schemes = (("legacy", legacy_turn, legacy_finish, False), ("current", current_turn, current_finish, True))
+    for name, turn, finish, cached_prefix in schemes:
+        rows = await measure_tokens(turn, finish, counter, args.turns, cached_prefix)
+        build_us, per_user = measure_build(turn, finish, args.users, args.turns)
+        print(f"--- {name} ---")
+        print(f"{'ход':>4} {'всего':>8} {'из кэша':>8} {'новые':>8}")
+        for step, (total, cached, fresh) in enumerate(rows, 1):
+            print(f"{step:>4} {total:>8} {cached:>8} {fresh:>8}")
+        print(f"Новых токенов на ход: медиана {statistics.median(r[2] for r in rows):.0f}, "
+              f"всего за диалог {sum(r[2] for r in rows)} из {sum(r[0] for r in rows)}")
+        print(f"Сборка промпта: {build_us:.1f} мкс на ход, история: {per_user / 1024:.1f} КиБ на пользователя")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
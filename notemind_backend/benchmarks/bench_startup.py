@@ -0,0 +1,100 @@
+"""
+Бенчмарк холодного старта API-сервера.
+
+1. `python -X importtime -c "import app.main"` - суммарное время импорта и самые тяжелые модули.
+2. Запуск uvicorn и время до первого успешного ответа GET /health.
+
+Запуск из папки notemind_backend:
+    python -m benchmarks.bench_startup
+    python -m benchmarks.bench_startup --runs 5 --no-preload
+"""
+import argparse
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+import httpx
+
+
+def _env(preload: bool) -> dict:
+    env = dict(os.environ)
+    # Сервер должен подниматься без внешних сервисов и ключей
+    env.setdefault("DATABASE_URL", "sqlite+aiosqlite:///./bench_startup.db")
+    env["AGENT_PRELOAD"] = "1" if preload else "0"
+    return env
+
+
+def measure_imports(env: dict, top: int):
+    """Возвращает (суммарное время импорта app.main в секундах, самые тяжелые модули верхнего уровня)."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import app.main"],
+        env=env, capture_output=True, text=True, check=True,
+    )
+    total = 0.0
+    packages = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, self_us, cumulative_us, name = [part.strip() for part in line.replace("import time:", "|").split("|")]
+        if name == "app.main":
+            total = int(cumulative_us) / 1e6
+        # Собственное время модулей суммируем по пакету верхнего уровня
+        package = name.split(".")[0]
+        packages[package] = packages.get(package, 0) + int(self_us)
+    heaviest = sorted(packages.items(), key=lambda item: item[1], reverse=True)[:top]
+    return total, heaviest
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def measure_first_health(env: dict, timeout: float = 30.0) -> float:
+    """Запускает uvicorn и возвращает время до первого 200 от /health в секундах."""
+    port = _free_port()
+    started_at = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        with httpx.Client(timeout=1.0) as client:
+            while time.perf_counter() - started_at < timeout:
+                try:
+                    if client.get(f"http://127.0.0.1:{port}/health").status_code == 200:
+                        return time.perf_counter() - started_at
+                except httpx.TransportError:
+                    pass
+                time.sleep(0.005)
+        raise RuntimeError("Сервер не ответил на /health за отведенное время")
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--top", type=int, default=10, help="Сколько самых тяжелых пакетов показать")
+    parser.add_argument("--no-preload", action="store_true", help="Не загружать агента в фоне после старта")
+    args = parser.parse_args()
+    env = _env(preload=not args.no_preload)
+
+    imports = [measure_imports(env, args.top) for _ in range(args.runs)]
+    print(f"Импорт app.main: медиана {statistics.median(t for t, _ in imports) * 1000:.0f} мс")
+    print("Самые тяжелые пакеты (собственное время импорта):")
+    for package, self_us in imports[-1][1]:
+        print(f"  {package:<30} {self_us / 1000:8.1f} мс")
+
+    health = [measure_first_health(env) for _ in range(args.runs)]
+    print(f"Время до первого ответа /health: медиана {statistics.median(health) * 1000:.0f} мс, "
+          f"максимум {max(health) * 1000:.0f} мс")
+
+
+if __name__ == "__main__":
+    main()
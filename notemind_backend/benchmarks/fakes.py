@@ -0,0 +1,227 @@
+"""
+Фейки внешних сервисов для офлайн-прогонов агента.
+
+- ScriptedChatModel - детерминированная модель вместо GigaChat: по тексту сообщения
+  выбирает вызовы инструментов по сценарию, после результатов инструментов отвечает
+  итоговым отчетом. Задержка до ответа и между токенами настраивается.
+- fake_max_app / fake_ors_app - HTTP-серверы с API MAX (отправка и правка сообщений)
+  и ORS (геокодер и маршруты) с настраиваемой задержкой.
+- BackgroundServer - запускает такое приложение через uvicorn в отдельном процессе,
+  чтобы фейки не делили event loop и GIL с измеряемым сервером.
+"""
+import asyncio
+import itertools
+import json
+import multiprocessing
+import re
+import socket
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Any, Callable, List, Optional
+
+import httpx
+
+import uvicorn
+from fastapi import FastAPI, Request
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage, HumanMessage, ToolMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+HELP_REPLY = ("Я умею создавать события, задачи и записывать самочувствие. "
+              "Например: \"Завтра в 11 встреча с инвестором\", \"сделать презентацию (2 часа)\", \"плохо спал\".")
+
+_HOUR = re.compile(r"\bв (\d{1,2})(?::(\d{2}))?\b")
+_DURATION = re.compile(r"\((?:часа? на |на )?(\d+)\s*час", re.IGNORECASE)
+
+
+def _user_text(message: BaseMessage) -> str:
+    # Перед текстом пользователя идут служебные блоки ([Календарь], [Контекст]) - сценарий их пропускает
+    text = str(message.content)
+    marker = text.rfind("[Контекст")
+    if marker == -1:
+        return text
+    newline = text.find("\n", marker)
+    return text[newline + 1:] if newline != -1 else ""
+
+
+def scripted_tool_calls(text: str) -> List[dict]:
+    """Вызовы инструментов, которые сценарий делает в ответ на сообщение пользователя."""
+    lowered = text.lower()
+    calls = []
+    if (hour := _HOUR.search(lowered)) and any(word in lowered for word in ("созвон", "встреч", "ужин", "врач")):
+        start = (datetime.now() + timedelta(days=1)).replace(hour=int(hour.group(1)) % 24, minute=int(hour.group(2) or 0),
+                                                              second=0, microsecond=0)
+        calls.append({"name": "create_event", "args": {"title": "Встреча", "start_time": start.isoformat()}})
+    if duration := _DURATION.search(lowered):
+        calls.append({"name": "create_task", "args": {"title": "Задача", "duration_hours": float(duration.group(1))}})
+    elif any(word in lowered for word in ("купить", "не забыть", "сделать")):
+        calls.append({"name": "create_task", "args": {"title": "Задача"}})
+    if any(word in lowered for word in ("спал", "самочувств", "устал")):
+        calls.append({"name": "log_health_metric", "args": {"metric": "сон", "value": "плохо"}})
+    if any(word in lowered for word in ("доехать", "ехать", "дорога")):
+        calls.append({"name": "get_travel_time",
+                      "args": {"origin_address": "дом", "destination_address": "Москва, ул Гашека, 7"}})
+    return calls
+
+
+class ScriptedChatModel(BaseChatModel):
+    """Детерминированная замена GigaChat для нагрузочных прогонов."""
+    latency: float = 0.3         # секунды до ответа (до первого токена)
+    token_latency: float = 0.0   # секунды между токенами при потоковой генерации
+    calls: int = 0               # сколько раз модель вызывали
+
+    @property
+    def _llm_type(self) -> str:
+        return "scripted"
+
+    def bind_tools(self, tools: Any, **kwargs: Any) -> "ScriptedChatModel":
+        return self
+
+    def _reply(self, messages: List[BaseMessage]) -> AIMessage:
+        self.calls += 1
+        last = messages[-1]
+        if isinstance(last, ToolMessage):
+            # Итоговый отчет по результатам инструментов этого хода
+            results = []
+            for message in reversed(messages):
+                if not isinstance(message, ToolMessage):
+                    break
+                results.append(str(message.content))
+            return AIMessage(content="Готово! " + " ".join(reversed(results)))
+        text = _user_text(last) if isinstance(last, HumanMessage) else ""
+        calls = scripted_tool_calls(text)
+        if not calls:
+            return AIMessage(content=HELP_REPLY)
+        return AIMessage(content="", tool_calls=[
+            {"name": call["name"], "args": call["args"], "id": f"call_{self.calls}_{index}"}
+            for index, call in enumerate(calls)
+        ])
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        time.sleep(self.latency)
+        return ChatResult(generations=[ChatGeneration(message=self._reply(messages))])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        await asyncio.sleep(self.latency)
+        return ChatResult(generations=[ChatGeneration(message=self._reply(messages))])
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        reply = self._reply(messages)
+        await asyncio.sleep(self.latency)
+        if reply.tool_calls:
+            yield ChatGenerationChunk(message=AIMessageChunk(content="", tool_call_chunks=[
+                {"name": call["name"], "args": json.dumps(call["args"], ensure_ascii=False), "id": call["id"], "index": index}
+                for index, call in enumerate(reply.tool_calls)
+            ]))
+            return
+        for index, word in enumerate(reply.content.split(" ")):
+            if index and self.token_latency:
+                await asyncio.sleep(self.token_latency)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=word if not index else " " + word))
+            if run_manager:
+                await run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
+
+
+# --- Фейковые HTTP-сервисы ---
+
+def fake_max_app(latency: float = 0.0) -> FastAPI:
+    """API MAX: POST /messages (отправка) и PUT /messages (правка). Счетчики - в app.state.stats."""
+    app = FastAPI()
+    app.state.stats = Counter()
+    mids = itertools.count(1)
+
+    @app.post("/messages")
+    async def send(request: Request):
+        await request.body()
+        if latency:
+            await asyncio.sleep(latency)
+        app.state.stats["sent"] += 1
+        return {"message": {"body": {"mid": f"mid.{next(mids)}"}}}
+
+    @app.put("/messages")
+    async def edit(request: Request):
+        await request.body()
+        if latency:
+            await asyncio.sleep(latency)
+        app.state.stats["edited"] += 1
+        return {"success": True}
+
+    return app
+
+
+def fake_ors_app(latency: float = 0.0) -> FastAPI:
+    """API ORS: геокодер (GET /geocode/search) и маршруты (POST /v2/directions/{profile}/json)."""
+    app = FastAPI()
+    app.state.stats = Counter()
+
+    @app.get("/geocode/search")
+    async def geocode(text: str = ""):
+        if latency:
+            await asyncio.sleep(latency)
+        app.state.stats["geocode"] += 1
+        # Координаты детерминированы текстом адреса, в пределах Москвы
+        seed = sum(map(ord, text)) % 1000 / 10000
+        return {"features": [{"geometry": {"coordinates": [37.5 + seed, 55.7 + seed]}}]}
+
+    @app.post("/v2/directions/{profile}/json")
+    async def directions(profile: str):
+        if latency:
+            await asyncio.sleep(latency)
+        app.state.stats["directions"] += 1
+        return {"routes": [{"summary": {"duration": 1800.0, "distance": 12000.0}}]}
+
+    return app
+
+
+class BackgroundServer:
+    """
+    Фейковое приложение под uvicorn в отдельном процессе: фейки не делят с измеряемым
+    сервером ни event loop, ни GIL. Приложение строится в дочернем процессе вызовом
+    factory(*args); счетчики запросов доступны по GET /stats.
+    """
+
+    def __init__(self, factory: Callable[..., FastAPI], *args: Any, host: str = "127.0.0.1", port: Optional[int] = None):
+        self.host = host
+        self.port = port or _free_port()
+        self._process = multiprocessing.Process(target=_serve, args=(factory, args, host, self.port), daemon=True)
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    def stats(self) -> dict:
+        return httpx.get(f"{self.url}/stats").json()
+
+    def __enter__(self) -> "BackgroundServer":
+        self._process.start()
+        deadline = time.monotonic() + 10
+        while True:
+            try:
+                with socket.create_connection((self.host, self.port), timeout=0.1):
+                    return self
+            except OSError:
+                if time.monotonic() > deadline or not self._process.is_alive():
+                    raise RuntimeError(f"Фейковый сервер на порту {self.port} не запустился")
+                time.sleep(0.02)
+
+    def __exit__(self, *exc_info) -> None:
+        self._process.terminate()
+        self._process.join(timeout=5)
+
+
+def _serve(factory: Callable[..., FastAPI], args: tuple, host: str, port: int) -> None:
+    app = factory(*args)
+
+    @app.get("/stats")
+    async def stats():
+        return dict(app.state.stats)
+
+    uvicorn.run(app, host=host, port=port, log_level="warning", access_log=False, lifespan="off")
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
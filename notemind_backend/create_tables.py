@@ -0,0 +1,16 @@
+import asyncio
+
+from app.database import shards
+from app.main import create_tables
+
+
+async def main():
+    await create_tables()
+    await shards.dispose_engines()
+    print("✅ Database tables created")
+
+
+if __name__ == "__main__":
+    # Создание схемы БД выполняется отдельно от старта сервера:
+    #   python create_tables.py && uvicorn app.main:app
+    asyncio.run(main())
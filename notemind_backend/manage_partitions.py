@@ -0,0 +1,36 @@
+import argparse
+import asyncio
+
+from app.database import partitions, shards
+
+
+async def run(args) -> None:
+    try:
+        if args.command == "partitions":
+            for shard, shard_engine in enumerate(shards.engines):
+                async with shard_engine.begin() as conn:
+                    created = await partitions.ensure_partitions(conn)
+                print(f"шард {shard}: создано секций {len(created)}")
+        elif args.command in ("archive", "maintain"):
+            archived = await (partitions.maintain() if args.command == "maintain" else partitions.archive_cold_months())
+            for table, rows in archived.items():
+                print(f"{table}: в архив перенесено строк {rows}")
+            if not archived:
+                print("Холодных месяцев в БД нет")
+    finally:
+        await shards.dispose_engines()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Секции по месяцам и архивация холодных данных (events, health_metrics)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("partitions", help="Создать секции на ближайшие месяцы (PostgreSQL)")
+    commands.add_parser("archive", help="Перенести месяцы старше ARCHIVE_AFTER_MONTHS в ARCHIVE_DIR")
+    commands.add_parser("maintain", help="И то, и другое")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    # Запуск по расписанию (cron), например раз в сутки:
+    #   python manage_partitions.py maintain
+    main()
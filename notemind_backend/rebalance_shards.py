@@ -0,0 +1,41 @@
+import argparse
+import asyncio
+
+from app.database import shards
+
+
+async def run(args) -> None:
+    try:
+        if args.command == "status":
+            for shard, count in enumerate(await shards.user_counts()):
+                print(f"шард {shard}: {count} пользователей")
+        elif args.command == "move":
+            moved = await shards.move_user(args.user_id, args.to)
+            print(f"Пользователь {args.user_id} перенесен в шард {args.to}" if moved
+                  else f"Пользователь {args.user_id} уже в шарде {args.to}")
+        elif args.command == "rebalance":
+            moves = await shards.rebalance(args.max_moves)
+            for user_id, source, target in moves:
+                print(f"{user_id}: {source} -> {target}")
+            print(f"Перенесено пользователей: {len(moves)}")
+    finally:
+        await shards.dispose_engines()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Перенос пользователей между шардами БД (без остановки сервиса)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("status", help="Число пользователей в каждом шарде")
+    move = commands.add_parser("move", help="Перенести одного пользователя")
+    move.add_argument("--user-id", type=int, required=True)
+    move.add_argument("--to", type=int, required=True, help="Номер целевого шарда")
+    rebalance = commands.add_parser("rebalance", help="Выровнять число пользователей по шардам")
+    rebalance.add_argument("--max-moves", type=int, default=100, help="Не больше стольких переносов за запуск")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    # После добавления шарда в DATABASE_SHARD_URLS (и python create_tables.py):
+    #   python rebalance_shards.py status
+    #   python rebalance_shards.py rebalance --max-moves 500
+    main()
@@ -0,0 +1,22 @@
+import argparse
+import asyncio
+from datetime import date
+
+from app.services.digest import run_morning_digest_all_shards
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Утренняя рассылка плана дня пользователям MAX")
+    parser.add_argument("--shard-index", type=int, default=0, help="Номер шарда пользователей (user.id %% shard-count)")
+    parser.add_argument("--shard-count", type=int, default=1, help="Общее количество шардов")
+    parser.add_argument("--date", type=date.fromisoformat, default=None, help="Дата сводки в формате YYYY-MM-DD (по умолчанию сегодня)")
+    args = parser.parse_args()
+
+    # Каждый воркер обходит все шарды БД, но только свою долю пользователей
+    asyncio.run(run_morning_digest_all_shards(args.shard_index, args.shard_count, day=args.date))
+
+
+if __name__ == "__main__":
+    # Запуск по расписанию (cron), например для 4 воркеров:
+    #   python send_digest.py --shard-index 0 --shard-count 4
+    main()